@@ -1,9 +1,70 @@
+import array
+import base64
 import json
-import boto3
+import bisect
+import codecs
 import decimal
+import functools
+import heapq
+import io
+import os
+import queue
+import random
 import sys
+import threading
+import time
 import urllib.parse
-from urllib.request import urlopen, Request
+import weakref
+import zlib
+from collections import OrderedDict, deque
+
+# asyncio, concurrent.futures (which imports logging), http.client,
+# urllib.request and the date parsing modules are imported where they are
+# used. Together they were most of the import time, and a Lambda handler
+# that only reads a few items never touches them.
+
+# boto3 itself is imported the first time a resource is needed, see
+# shared_resource(). Without boto3 the local backends raise the same error.
+try:
+    from botocore.exceptions import ClientError
+except ImportError:
+    from Local_Backends import ClientError
+
+
+# Error codes from DynamoDB that are worth retrying after a short wait.
+RETRYABLE_ERRORS = (
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'InternalServerError',
+    'ServiceUnavailable'
+)
+
+# Marks the end of a segment in the scan_items() page queue.
+_SEGMENT_DONE = object()
+
+# Extra attributes of the sharded table layout, see create_item_table().
+# Shard is the partition key and Unique_ID the sort key. Ranked_ID is a copy
+# of Unique_ID that is only set while quantity > 0, which makes TOP_INDEX a
+# sparse index of the items that are in stock.
+SHARD_KEY = 'Shard'
+RANKED_KEY = 'Ranked_ID'
+TOP_INDEX = 'Top_items'
+
+# Attributes of the epoch mode, see DynamoDB.reset_table(). The current
+# generation lives in the GENERATION_ID item and every row records the
+# generation its quantity was counted in. Rows without one are generation 0.
+GENERATION_ID = '#generation'
+GENERATION_KEY = 'generation'
+
+# The token of the last bulk write to a row, see DynamoDB.bulk_update_table().
+WRITE_TOKEN_KEY = 'Write_token'
+
+# The most items find_top_page() returns on one page.
+TOP_PAGE_LIMIT = 1000
+
+# The highest ilvl a StashCounts (and a snapshot file) can hold.
+MAX_ILVL = 0xFFFF
 
 
 # Helper class to convert a DynamoDB item to JSON.
@@ -18,6 +79,816 @@ class DecimalEncoder(json.JSONEncoder):
         return super(DecimalEncoder, self).default(o)
 
 
+# Default botocore settings for the DynamoDB resources made by
+# shared_resource(), see client_config(). The connections are kept alive so
+# a warm Lambda container reuses them between invocations.
+CLIENT_CONFIG = {
+    'max_pool_connections': 50,
+    'connect_timeout': 5,
+    'read_timeout': 10,
+    'tcp_keepalive': True,
+    'retries': {
+        'max_attempts': 3,
+        'mode': 'standard'
+    }
+}
+
+_resources = {}
+_resources_lock = threading.Lock()
+_thread_resources = threading.local()
+# Resources of threads that have ended, ready for the next thread.
+_idle_resources = {}
+# The ItemCaches of every table, see shared_cache().
+_caches = {}
+
+
+def client_config(**options):
+    """ This builds the botocore Config for a DynamoDB resource from
+    CLIENT_CONFIG and any options that override it.
+
+    Args: botocore Config options, like max_pool_connections,
+    connect_timeout, read_timeout or tcp_keepalive.
+
+    Returns: The botocore Config.
+    """
+    from botocore.config import Config
+    settings = dict(CLIENT_CONFIG)
+    settings.update(options)
+    return Config(**settings)
+
+
+def _new_resource(region_name, options):
+    # boto3 is only imported the first time a resource is needed.
+    import boto3.session
+    return boto3.session.Session().resource(
+        'dynamodb', region_name=region_name, config=client_config(**options))
+
+
+def shared_resource(region_name=None, **options):
+    """ This is the DynamoDB resource for the process. It is made once per
+    region and config and then shared, so every DynamoDB object in a warm
+    Lambda container uses the same connection pool. boto3 resources are not
+    thread safe, so other threads should use thread_resource().
+
+    Args: The AWS region (the default region when None) and any options for
+    client_config().
+
+    Returns: The boto3 DynamoDB resource.
+    """
+    key = (region_name, json.dumps(options, sort_keys=True))
+    resource = _resources.get(key)
+    if resource is None:
+        with _resources_lock:
+            resource = _resources.get(key)
+            if resource is None:
+                resource = _new_resource(region_name, options)
+                _resources[key] = resource
+    return resource
+
+
+def shared_cache(resource, table_name, kind='items', max_size=1024,
+                 ttl=60.0):
+    """ This is the ItemCache of a table for the process, the way
+    shared_resource() is the resource. Every DynamoDB object for the same
+    table on the same resource gets the same cache, so a write through any
+    of them clears what the others have cached, and a warm Lambda container
+    keeps its cache between invocations. The first object to ask for a cache
+    picks its size and time to live.
+
+    Args: The resource, the name of the table, 'items' for get_item() or
+    'pages' for find_top_page_body(), and the size and time to live of a new
+    cache.
+
+    Returns: The ItemCache.
+    """
+    key = (id(resource), table_name, kind)
+    with _resources_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = ItemCache(max_size, ttl)
+            # The id of a resource can be reused once it is gone.
+            weakref.finalize(resource, _caches.pop, key, None)
+    return cache
+
+
+def _table_caches(resource, table_name):
+    # The caches of a table that any DynamoDB object has turned on.
+    return (_caches.get((id(resource), table_name, 'items')),
+            _caches.get((id(resource), table_name, 'pages')))
+
+
+def shared_client(region_name=None, **options):
+    """ This is the low level client of shared_resource(), which shares its
+    connection pool. Clients are thread safe.
+
+    Args: The same as shared_resource().
+
+    Returns: The boto3 DynamoDB client.
+    """
+    return shared_resource(region_name, **options).meta.client
+
+
+def _release_resources(resources):
+    # Called once the thread that held the resources has ended.
+    with _resources_lock:
+        for key, resource in resources.items():
+            _idle_resources.setdefault(key, []).append(resource)
+
+
+class _ResourceLease():
+    # Lives in the thread local data of one thread, so it is dropped when
+    # the thread ends and its resources go back to _idle_resources.
+
+    def __init__(self):
+        self.resources = {}
+        finalizer = weakref.finalize(self, _release_resources, self.resources)
+        finalizer.atexit = False
+
+
+def _thread_pool(max_workers):
+    # concurrent.futures is only imported once threads are wanted.
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+
+def thread_resource(region_name=None, **options):
+    """ This is shared_resource() for the calling thread. boto3 resources
+    are not thread safe, so a thread has a resource to itself for as long as
+    it runs. When the thread ends the resource (and its connection pool) is
+    handed on to the next thread that asks, so the worker threads of every
+    new ThreadPoolExecutor reuse the resources of the last one instead of
+    making their own. The process never has more resources than it has had
+    threads using them at once.
+
+    Args: The same as shared_resource().
+
+    Returns: The boto3 DynamoDB resource for the calling thread.
+    """
+    lease = getattr(_thread_resources, 'lease', None)
+    if lease is None:
+        lease = _thread_resources.lease = _ResourceLease()
+    key = (region_name, json.dumps(options, sort_keys=True))
+    resource = lease.resources.get(key)
+    if resource is None:
+        with _resources_lock:
+            idle = _idle_resources.get(key)
+            if idle:
+                resource = idle.pop()
+        if resource is None:
+            resource = _new_resource(region_name, options)
+        lease.resources[key] = resource
+    return resource
+
+
+class MemorySink():
+    """ A metrics sink that keeps running totals in memory. Counters are
+    added up per (operation, name) and timers keep the count, total and
+    maximum per operation.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    def count(self, operation, name, value):
+        with self.lock:
+            counters = self.counters.setdefault(operation, {})
+            counters[name] = counters.get(name, 0) + value
+
+    def timing(self, operation, seconds):
+        with self.lock:
+            timer = self.timers.get(operation)
+            if timer is None:
+                timer = self.timers[operation] = {
+                    "count": 0,
+                    "total": 0.0,
+                    "max": 0.0
+                }
+            timer['count'] += 1
+            timer['total'] += seconds
+            timer['max'] = max(timer['max'], seconds)
+
+    def snapshot(self, reset=False):
+        """ This reads the totals.
+
+        Args: If the totals should be cleared after they are read.
+
+        Returns: A Dict of operation to its counters and, for timed
+        operations, "calls", "seconds" and "max_seconds".
+        """
+        with self.lock:
+            result = {operation: dict(counters)
+                      for operation, counters in self.counters.items()}
+            for operation, timer in self.timers.items():
+                result.setdefault(operation, {}).update({
+                    "calls": timer['count'],
+                    "seconds": timer['total'],
+                    "max_seconds": timer['max']
+                })
+            if reset:
+                self.counters = {}
+                self.timers = {}
+        return result
+
+    def flush(self):
+        pass
+
+
+class LoggingSink():
+    """ A metrics sink that writes every counter and timer to a logger.
+
+    Args: The logger (the AWS_Classes logger by default) and the level
+    (DEBUG by default).
+    """
+
+    def __init__(self, logger=None, level=None):
+        import logging
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = logging.DEBUG if level is None else level
+
+    def count(self, operation, name, value):
+        self.logger.log(self.level, '%s %s %s', operation, name, value)
+
+    def timing(self, operation, seconds):
+        self.logger.log(self.level, '%s took %.3fs', operation, seconds)
+
+    def flush(self):
+        pass
+
+
+class SummarySink(MemorySink):
+    """ A metrics sink that adds everything up and emits one summary per
+    operation every interval seconds, and again on flush().
+
+    Args: The number of seconds between summaries and the function the
+    summary lines are passed to (print by default).
+    """
+
+    def __init__(self, interval=60.0, emit=print):
+        super(SummarySink, self).__init__()
+        self.interval = interval
+        self.emit = emit
+        self.next_summary = time.monotonic() + interval
+
+    def count(self, operation, name, value):
+        super(SummarySink, self).count(operation, name, value)
+        self._maybe_emit()
+
+    def timing(self, operation, seconds):
+        super(SummarySink, self).timing(operation, seconds)
+        self._maybe_emit()
+
+    def _maybe_emit(self):
+        if time.monotonic() >= self.next_summary:
+            self.flush()
+
+    def flush(self):
+        self.next_summary = time.monotonic() + self.interval
+        for operation, values in sorted(self.snapshot(reset=True).items()):
+            self.emit('{}: {}'.format(operation, ', '.join(
+                '{} {}'.format(name, round(value, 3))
+                for name, value in sorted(values.items())
+            )))
+
+
+class Metrics():
+    """ Counters and timers for the DynamoDB class, passed on to any number
+    of sinks (MemorySink, LoggingSink, SummarySink or anything with count,
+    timing and flush). Without sinks every call returns straight away.
+
+    Args: The list of sinks.
+    """
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+        self.enabled = bool(self.sinks)
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        self.enabled = True
+
+    def count(self, operation, name, value=1):
+        if not self.enabled or not value:
+            return
+        for sink in self.sinks:
+            sink.count(operation, name, value)
+
+    def timing(self, operation, seconds):
+        if not self.enabled:
+            return
+        for sink in self.sinks:
+            sink.timing(operation, seconds)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+
+def _timed(operation):
+    # Times a DynamoDB method under the given operation name.
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.metrics.enabled:
+                return method(self, *args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.metrics.timing(operation, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+# Table operations that consume read capacity, the rest consume writes.
+READ_OPERATIONS = ('get_item', 'scan', 'query', 'batch_get_item')
+
+
+class _CapacityBucket():
+    # The pacing state of one kind of capacity (read or write).
+
+    def __init__(self, target):
+        self.target = target
+        self.rate = target
+        self.ceiling = target
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.last_decrease = 0.0
+        # (time, units) of the requests of the last second.
+        self.recent = deque()
+        self.recent_units = 0.0
+        # The most units seen in one second.
+        self.peak_units = 0.0
+
+    def prune(self, now):
+        # Drops the requests that are more than a second old.
+        while self.recent and self.recent[0][0] < now - 1.0:
+            self.recent_units -= self.recent.popleft()[1]
+
+
+class RateController():
+    """ Paces the requests of every thread (and every DynamoDB object it is
+    passed to) so that together they stay just under the capacity of a
+    table. Each request reserves the units it is expected to consume from a
+    token bucket and waits for its turn, and the estimate is corrected with
+    the ConsumedCapacity of the response.
+
+    The rate adapts AIMD style: a throttled request cuts it by decrease
+    (at most once per cooldown seconds, so a burst of throttles from many
+    threads counts once), and successful requests add back increase units
+    per second every second, up to the target. By default the increase is a
+    tenth of the target, or of the rate before the last cut. Without a
+    target the rate is not limited until the first throttle, and then
+    starts from the throughput of the last second, or the best second seen
+    so far if the last one was idle. A throttle before any request has
+    gone through leaves the rate unlimited, since there is nothing to start
+    from yet, and the request is only retried with a backoff.
+
+    Args: The read and write capacity units per second to aim for (None
+    for no limit), the minimum rate, the additive increase in units per
+    second, the multiplicative decrease, the cooldown in seconds and how
+    many seconds of unused capacity can be saved up for a burst.
+    """
+
+    def __init__(self, read_capacity=None, write_capacity=None, min_rate=1.0,
+                 increase=None, decrease=0.7, cooldown=1.0, burst=0.2):
+        self.lock = threading.Lock()
+        self.burst = burst
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.buckets = {
+            'read': _CapacityBucket(read_capacity),
+            'write': _CapacityBucket(write_capacity)
+        }
+
+    @classmethod
+    def for_table(cls, table, utilisation=0.9, **kwargs):
+        """ This makes a controller that aims for a share of the provisioned
+        capacity of a table. On demand tables report no capacity, so they
+        are only slowed down once they are throttled.
+
+        Args: The boto3 Table, the share of its capacity to use and any
+        other arguments for the controller.
+
+        Returns: The RateController.
+        """
+        throughput = getattr(table, 'provisioned_throughput', None) or {}
+        capacity = {}
+        for kind, name in (('read_capacity', 'ReadCapacityUnits'),
+                           ('write_capacity', 'WriteCapacityUnits')):
+            units = throughput.get(name)
+            capacity[kind] = float(units) * utilisation if units else None
+        capacity.update(kwargs)
+        return cls(**capacity)
+
+    @staticmethod
+    def estimate(operation, kwargs):
+        """ This guesses the capacity a request will use before it is sent.
+
+        Args: The name of the operation and its arguments.
+
+        Returns: The kind of capacity ('read' or 'write') and the units.
+        """
+        if operation == 'batch_write_item':
+            return 'write', float(sum(
+                len(requests) for requests in kwargs['RequestItems'].values()))
+        if operation == 'batch_get_item':
+            return 'read', 0.5 * sum(
+                len(request['Keys'])
+                for request in kwargs['RequestItems'].values())
+        if operation in READ_OPERATIONS:
+            return 'read', 0.5 if operation == 'get_item' else 1.0
+        return 'write', 1.0
+
+    def _refill(self, bucket, now):
+        if bucket.rate is not None:
+            bucket.tokens = min(
+                max(bucket.rate * self.burst, 1.0),
+                bucket.tokens + (now - bucket.updated) * bucket.rate)
+        bucket.updated = now
+
+    def acquire(self, kind, units):
+        """ This waits until the request may be sent.
+
+        Args: The kind of capacity and the units it is expected to use.
+
+        Returns: The number of seconds it waited.
+        """
+        bucket = self.buckets[kind]
+        with self.lock:
+            if bucket.rate is None:
+                return 0.0
+            self._refill(bucket, time.monotonic())
+            bucket.tokens -= units
+            wait = -bucket.tokens / bucket.rate if bucket.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def record(self, kind, estimated, consumed):
+        """ This settles a successful request and lets the rate grow.
+
+        Args: The kind of capacity, the units reserved by acquire() and the
+        units the response says were consumed.
+
+        Returns: Null
+        """
+        bucket = self.buckets[kind]
+        now = time.monotonic()
+        with self.lock:
+            bucket.recent.append((now, consumed))
+            bucket.recent_units += consumed
+            bucket.prune(now)
+            bucket.peak_units = max(bucket.peak_units, bucket.recent_units)
+            if bucket.rate is None:
+                return
+            bucket.tokens -= consumed - estimated
+            increase = self.increase
+            if increase is None:
+                increase = max(self.min_rate, bucket.ceiling * 0.1)
+            bucket.rate += increase * consumed / bucket.rate
+            if bucket.target is not None:
+                bucket.rate = min(bucket.rate, bucket.target)
+
+    def throttled(self, kind):
+        """ This cuts the rate after DynamoDB throttled a request.
+
+        Args: The kind of capacity that ran out.
+
+        Returns: Null
+        """
+        bucket = self.buckets[kind]
+        now = time.monotonic()
+        with self.lock:
+            if now - bucket.last_decrease < self.cooldown:
+                return
+            rate = bucket.rate
+            if rate is None:
+                # The units of the last second are what the table took.
+                bucket.prune(now)
+                rate = bucket.recent_units or bucket.peak_units
+                if not rate:
+                    return
+            bucket.last_decrease = now
+            self._refill(bucket, now)
+            bucket.ceiling = max(rate, self.min_rate)
+            bucket.rate = max(self.min_rate, rate * self.decrease)
+            bucket.tokens = min(bucket.tokens, 0.0)
+
+    def rates(self):
+        """ This reports the current rates.
+
+        Args: Null
+
+        Returns: A Dict with the "read" and "write" rates in units per
+        second (None while they are not limited).
+        """
+        with self.lock:
+            return {kind: bucket.rate for kind, bucket in self.buckets.items()}
+
+
+def _backoff(retries):
+    # Full jitter exponential backoff, capped at 5 seconds.
+    time.sleep(random.uniform(0, min(5.0, 0.05 * 2 ** retries)))
+
+
+def _capacity_units(response):
+    # ConsumedCapacity is a Dict for table calls and a list for batch calls.
+    consumed = response.get('ConsumedCapacity')
+    if consumed is None:
+        return 0.0
+    if isinstance(consumed, dict):
+        return consumed.get('CapacityUnits', 0.0)
+    return sum(entry.get('CapacityUnits', 0.0) for entry in consumed)
+
+
+class ItemCache():
+    """ A small thread safe LRU cache for get_item() results with a time
+    to live on every entry. Items that are not in the table are cached too
+    (as None), so repeated lookups of a missing item do not go to DynamoDB
+    either.
+
+    Args: The maximum number of entries and the time to live in seconds.
+    """
+
+    def __init__(self, max_size=1024, ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """ This looks up a Unique_ID in the cache.
+
+        Args: The Unique_ID.
+
+        Returns: (True, value) on a hit, or (False, version) on a miss. The
+        version has to be passed to put() so that an entry read before an
+        invalidation is not stored after it.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1]
+                del self.entries[key]
+            self.misses += 1
+            return False, self.version
+
+    def put(self, key, value, version):
+        """ This stores a get_item() result, unless the cache has been
+        invalidated since the lookup started.
+
+        Args: The Unique_ID, the item (or None if it is not in the table)
+        and the version from get().
+
+        Returns: Null
+        """
+        with self.lock:
+            if version != self.version:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys):
+        """ This drops the given Unique_IDs from the cache.
+
+        Args: An iterable of Unique_IDs.
+
+        Returns: Null
+        """
+        with self.lock:
+            self.version += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        """ This drops every entry from the cache.
+
+        Args: Null
+
+        Returns: Null
+        """
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+
+    def stats(self):
+        """ Args: Null
+
+        Returns: A Dict with the size, hits, misses and evictions.
+        """
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+class SeenKeys():
+    """ A bounded, thread safe set of the Unique_IDs that are known to be in
+    the table, so upload_stash() can drop them without a request. When it is
+    full the key that was seen least recently is forgotten, which only costs
+    one extra conditional put if that key comes back.
+
+    Args: The maximum number of keys to remember.
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.keys = OrderedDict()
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.keys:
+                self.keys.move_to_end(key)
+                return True
+            return False
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.keys[key] = None
+            self.keys.move_to_end(key)
+            while len(self.keys) > self.max_size:
+                self.keys.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.keys.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.keys = OrderedDict()
+
+
+class TopItemsView():
+    """ This keeps the top number_of_items rows of a table (the rows in
+    stock with the lowest Unique_IDs) up to date from the quantities that
+    DynamoDB writes, instead of finding them again with a full scan. Attach
+    it with DynamoDB.track_top_items() and copy it to the small
+    PoE_top_items table with sync().
+
+    Quantities only grow between resets, so a row can only move into the
+    view or change inside it. When a row leaves it (a put_item with 0 or a
+    delete_item) the view can not know which row takes its place, so it is
+    read again from the table on the next sync().
+
+    Args: The number of items to keep.
+    """
+
+    def __init__(self, number_of_items=20):
+        self.number_of_items = max(number_of_items, 1)
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.keys = []
+        self.complete = False
+        self.synced = None
+
+    def seed(self, db):
+        """ This loads the view from the table.
+
+        Args: The DynamoDB object for the item table.
+
+        Returns: Null
+        """
+        rows = db.top_rows(self.number_of_items) or []
+        with self.lock:
+            self.rows = {
+                row['Unique_ID']: {
+                    'item': row['item'],
+                    'ilvl': row['ilvl'],
+                    'quantity': row['quantity']
+                }
+                for row in rows
+            }
+            self.keys = sorted(self.rows)
+            self.complete = True
+
+    def apply(self, unique, item, ilvl, quantity):
+        """ This records the quantity a row has after a write.
+
+        Args: The Unique_ID, item, ilvl and new quantity of the row.
+
+        Returns: Null
+        """
+        with self.lock:
+            if quantity > 0:
+                if unique not in self.rows:
+                    if (len(self.keys) >= self.number_of_items and
+                            unique > self.keys[-1]):
+                        return
+                    bisect.insort(self.keys, unique)
+                self.rows[unique] = {
+                    'item': item,
+                    'ilvl': ilvl,
+                    'quantity': quantity
+                }
+                if len(self.keys) > self.number_of_items:
+                    del self.rows[self.keys.pop()]
+            elif unique in self.rows:
+                del self.rows[unique]
+                self.keys.remove(unique)
+                self.complete = False
+
+    def clear(self):
+        """ This empties the view after the table has been reset or
+        emptied, when nothing is in stock.
+
+        Args: Null
+
+        Returns: Null
+        """
+        with self.lock:
+            self.rows = {}
+            self.keys = []
+            self.complete = True
+
+    def top_items(self):
+        """ This applies the find_top_quantity() cut off to the view.
+
+        Args: Null
+
+        Returns: A Dict of Unique_ID to {"item", "ilvl", "quantity"}, in
+        Unique_ID order.
+        """
+        counter = 0
+        total = 0
+        top = {}
+        with self.lock:
+            for unique in self.keys:
+                top[unique] = dict(self.rows[unique])
+                total += int(self.rows[unique]['quantity'])
+                counter += 1
+                if total >= self.number_of_items or \
+                        counter >= self.number_of_items:
+                    break
+        return top
+
+    def sync(self, db, top_db):
+        """ This makes the small top items table match the view. Only the
+        rows that entered, left or changed are written, in BatchWriteItem
+        calls with the puts before the deletes, so the table is never empty
+        while it is being refreshed.
+
+        Args: The DynamoDB object for the item table (to reload the view
+        from when it is incomplete) and the one for the top items table.
+
+        Returns: A Dict with the number of rows put and deleted.
+        """
+        if not self.complete:
+            self.seed(db)
+        wanted = self.top_items()
+        if self.synced is None:
+            self.synced = {
+                row['Unique_ID']: {
+                    'item': row['item'],
+                    'ilvl': row['ilvl'],
+                    'quantity': row['quantity']
+                }
+                for row in top_db.scan_items()
+            }
+
+        puts = [unique for unique in wanted
+                if self.synced.get(unique) != wanted[unique]]
+        deletes = [unique for unique in self.synced if unique not in wanted]
+        requests = [
+            {'PutRequest': {'Item': dict(wanted[unique],
+                                         **top_db._key(unique))}}
+            for unique in puts
+        ] + [
+            {'DeleteRequest': {'Key': top_db._key(unique)}}
+            for unique in deletes
+        ]
+        for start in range(0, len(requests), 25):
+            top_db._batch_write(requests[start:start + 25])
+        top_db._invalidate(puts + deletes)
+        self.synced = wanted
+        return {
+            "put": len(puts),
+            "deleted": len(deletes)
+        }
+
+
 class DynamoDB():
     """ This will be the class that we will use to access the DyanmDB table.
     It will contain all the functions that will be needed to read/write to
@@ -31,19 +902,420 @@ class DynamoDB():
         ilvl
         item
         quantity
+
+    Tables made with create_item_table(name, shards=N) also have a Shard
+    partition key (with Unique_ID as the sort key) and, with top_index=True,
+    a Ranked_ID attribute for the sparse Top_items index. Pass the same
+    shards and top_index values here to use them.
+
+    With epochs=True every row also has a generation, see reset_table().
+    Every client of a table has to agree on epochs as well.
+
+    With cache_size > 0, get_item() results are cached in this process for
+    cache_ttl seconds, see ItemCache. The cache is shared by every DynamoDB
+    object for the table in this process (see shared_cache()), and writes
+    made through any of them clear the keys they touch, but writes from
+    other processes can take up to cache_ttl seconds to show up.
+    page_cache_size does the same for the encoded pages of
+    find_top_page_body().
     """
 
-    def __init__(self, table):
+    def __init__(self, table, scan_segments=4, shards=None, top_index=False,
+                 epochs=False, generation_ttl=10.0, cache_size=0,
+                 cache_ttl=60.0, resource=None, metrics=None, verbose=False,
+                 rate_controller=None, seen_size=100000, region_name=None,
+                 client_options=None, page_cache_size=0):
         """ Simple initialization for you DynamoDB client and table. This 
         will give use access to the right table that we are looking for.
+        scan_segments is the number of parallel segments that full table
+        scans are split into. shards and top_index select the sharded table
+        layout and have to match the values the table was created with.
+        epochs turns on generation based resets, and generation_ttl is how
+        many seconds the current generation is cached for. cache_size and
+        cache_ttl turn on the get_item() cache. resource replaces
+        the shared boto3 resource, for example with a MemoryResource or
+        SQLiteResource from Local_Backends.py to run without AWS. metrics
+        is a Metrics object to record the requests in, and verbose turns the
+        print() of every single item back on. rate_controller is a
+        RateController that paces every request, and can be shared with
+        other DynamoDB objects for the same table. seen_size is how many
+        Unique_IDs upload_stash() remembers between pages. region_name and
+        client_options (see client_config()) pick the shared boto3 resource
+        to use when no resource is given. page_cache_size turns on the cache
+        of find_top_page_body() pages, with the same cache_ttl.
         """
         self.table_id = table
-        self.dynamodb = boto3.resource('dynamodb')
+        self.cache = None
+        self.page_cache = None
+        self.top_view = None
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.verbose = verbose
+        self.rate_controller = rate_controller
+        self.seen_keys = SeenKeys(seen_size)
+        self.scan_segments = scan_segments
+        self.shards = shards
+        self.top_index = bool(shards) and top_index
+        self.epochs = epochs
+        self.generation_ttl = generation_ttl
+        self._generation = None
+        self._generation_read = 0.0
+        self.local_resource = resource is not None
+        self.region_name = region_name
+        self.client_options = client_options or {}
+        if resource is None:
+            resource = shared_resource(region_name, **self.client_options)
+        self.dynamodb = resource
         self.table = self.dynamodb.Table(self.table_id)
+        if cache_size:
+            self.cache = shared_cache(resource, table, 'items', cache_size,
+                                      cache_ttl)
+        if page_cache_size:
+            self.page_cache = shared_cache(resource, table, 'pages',
+                                           page_cache_size, cache_ttl)
+        self._local = threading.local()
+
+    def _key(self, unique_id):
+        """ This builds the primary key for a Unique_ID in the layout this
+        table uses.
+
+        Args: The Unique_ID from create_unique_ilvl_str().
+
+        Returns: The Key Dict for the DynamoDB calls.
+        """
+        if self.shards:
+            return {
+                SHARD_KEY: shard_of(unique_id, self.shards),
+                'Unique_ID': unique_id
+            }
+        return {
+            'Unique_ID': unique_id
+        }
+
+    def _ranked_id(self, unique_id, generation=None):
+        """ In epoch mode Ranked_ID starts with the generation, so a query
+        of the Top_items index can skip every row from an older generation
+        with begins_with().
+
+        Args: The Unique_ID and the generation it is written in.
+
+        Returns: The value for Ranked_ID.
+        """
+        if self.epochs:
+            return "{:012d}#{}".format(int(generation), unique_id)
+        return unique_id
+
+    def _rank_clause(self, unique_id, in_stock, generation=None):
+        """ This is the update clause that keeps the sparse Top_items index
+        in step with the quantity. It is added to the end of an
+        UpdateExpression that finishes with a SET clause.
+
+        Args: The Unique_ID being written, if its quantity will be > 0 and
+        the generation it is written in.
+
+        Returns: The clause and the ExpressionAttributeValues it needs.
+        """
+        if not self.top_index:
+            return "", {}
+        if in_stock:
+            return ", {} = :r".format(RANKED_KEY), {
+                ":r": self._ranked_id(unique_id, generation)
+            }
+        return " REMOVE {}".format(RANKED_KEY), {}
+
+    def _invalidate(self, keys=None):
+        """ This clears cached get_item() results after a write. The caches
+        are shared by every DynamoDB object for this table (see
+        shared_cache()), so they are cleared even when this object does not
+        read through them.
+
+        Args: The Unique_IDs that were written, or None for all of them.
+
+        Returns: Null
+        """
+        item_cache, page_cache = _table_caches(self.dynamodb, self.table_id)
+        if page_cache is not None:
+            # Any write can move rows from one page to the next.
+            page_cache.clear()
+        if item_cache is None:
+            return
+        if keys is None:
+            item_cache.clear()
+        else:
+            item_cache.invalidate(keys)
+
+    def track_top_items(self, number_of_items=20):
+        """ This attaches a TopItemsView to this table. It is loaded from
+        the table once and then kept up to date by every write made through
+        this object.
+
+        Args: The number of top items to keep.
+
+        Returns: The TopItemsView.
+        """
+        view = TopItemsView(number_of_items)
+        view.seed(self)
+        self.top_view = view
+        return view
+
+    def cache_stats(self):
+        """ Args: Null
+
+        Returns: The hits, misses, evictions and size of the get_item()
+        cache, or None when it is turned off.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
+    def current_generation(self, refresh=False):
+        """ This reads the current generation from the GENERATION_ID item.
+        It is cached for generation_ttl seconds, so another process's reset
+        can take that long to show up in this one's reads. Writes check the
+        generation of the row they touch and refresh it when they find a
+        newer one.
+
+        Args: refresh=True to skip the cache.
+
+        Returns: The current generation as an int.
+        """
+        now = time.monotonic()
+        if (refresh or self._generation is None or
+                now - self._generation_read > self.generation_ttl):
+            response, _ = self._request(
+                self.table,
+                'get_item',
+                Key=self._key(GENERATION_ID),
+                ConsistentRead=True
+            )
+            self._generation = int(
+                response.get('Item', {}).get(GENERATION_KEY, 0))
+            self._generation_read = now
+        return self._generation
+
+    def _same_generation(self, generation):
+        """ This is the ConditionExpression for a row that was counted in
+        the given generation, using #gen and :g. Rows written before epochs
+        were turned on have no generation and belong to generation 0.
+
+        Args: The generation.
+
+        Returns: The ConditionExpression.
+        """
+        if generation == 0:
+            return "attribute_not_exists(#gen) OR #gen = :g"
+        return "#gen = :g"
+
+    def _live_quantity(self, item, generation):
+        """ In epoch mode a row from an older generation has been reset, so
+        its quantity counts as 0.
+
+        Args: The row from the table and the current generation.
+
+        Returns: The quantity of the row in the current generation.
+        """
+        if self.epochs and item.get(GENERATION_KEY, 0) != generation:
+            return decimal.Decimal(0)
+        return item.get('quantity', decimal.Decimal(0))
+
+    def _worker_resource(self):
+        """ boto3 resources are not thread safe, so every worker thread gets
+        its own resource from thread_resource() and keeps reusing it (and its
+        connection pool) for every later request. Once the thread ends the
+        resource is reused by a later worker thread. A resource passed to the
+        constructor is shared by every thread, which the local backends allow.
+
+        Args: Null
+
+        Returns: The DynamoDB resource for the calling thread.
+        """
+        if self.local_resource:
+            return self.dynamodb
+        return thread_resource(self.region_name, **self.client_options)
+
+    def _worker_table(self):
+        """ This is the table object for the calling thread, see
+        _worker_resource().
+
+        Args: Null
+
+        Returns: The Table object for the calling thread.
+        """
+        table = getattr(self._local, 'table', None)
+        if table is None:
+            table = self._worker_resource().Table(self.table_id)
+            self._local.table = table
+        return table
+
+    def _call(self, table, operation, **kwargs):
+        """ This makes a single call to the table (or resource) and records
+        the request, its latency, any throttling or error and the capacity
+        it consumed in the metrics.
+
+        Args: The table to call, the name of the Table method and the
+        arguments for that call.
+
+        Returns: The response from the DynamoDB table.
+        """
+        metrics = self.metrics
+        controller = self.rate_controller
+        if not metrics.enabled and controller is None:
+            return getattr(table, operation)(**kwargs)
+        kwargs.setdefault('ReturnConsumedCapacity', "TOTAL")
+        if controller is not None:
+            kind, units = controller.estimate(operation, kwargs)
+            waited = controller.acquire(kind, units)
+            metrics.count(operation, 'paced_seconds', waited)
+        started = time.perf_counter()
+        try:
+            response = getattr(table, operation)(**kwargs)
+        except ClientError as error:
+            if error.response['Error']['Code'] in RETRYABLE_ERRORS:
+                metrics.count(operation, 'throttles')
+                if controller is not None:
+                    controller.throttled(kind)
+            else:
+                metrics.count(operation, 'errors')
+            raise
+        finally:
+            metrics.count(operation, 'requests')
+            metrics.timing(operation, time.perf_counter() - started)
+        consumed = _capacity_units(response)
+        metrics.count(operation, 'consumed_capacity', consumed)
+        if controller is not None:
+            controller.record(kind, units, consumed or units)
+        return response
+
+    def _request(self, table, operation, max_retries=8, **kwargs):
+        """ This will make a single call to the table and retry it with a
+        jittered exponential backoff when DynamoDB throttles it.
+
+        Args: The table to call, the name of the Table method and the
+        arguments for that call.
+
+        Returns: The response from the DynamoDB table and the number of
+        retries it took.
+        """
+        retries = 0
+        while True:
+            try:
+                return self._call(table, operation, **kwargs), retries
+            except ClientError as error:
+                code = error.response['Error']['Code']
+                if code not in RETRYABLE_ERRORS or retries >= max_retries:
+                    raise
+                _backoff(retries)
+                retries += 1
+                self.metrics.count(operation, 'retries')
+
+    def _batch_write(self, requests, max_retries=8):
+        """ This sends up to 25 PutRequest/DeleteRequest entries for this
+        table in one BatchWriteItem call. DynamoDB can hand some of them back
+        as UnprocessedItems when it is busy, so those are sent again after a
+        jittered backoff until every request has gone through.
+
+        Args: The list of write requests.
+
+        Returns: The number of retries and the consumed capacity.
+        """
+        resource = self._worker_resource()
+        pending = {self.table_id: requests}
+        retries = 0
+        capacity = 0.0
+        while True:
+            response, tries = self._request(
+                resource,
+                'batch_write_item',
+                RequestItems=pending,
+                ReturnConsumedCapacity="TOTAL"
+            )
+            retries += tries
+            for consumed in response.get('ConsumedCapacity', []):
+                capacity += consumed.get('CapacityUnits', 0.0)
+            pending = response.get('UnprocessedItems') or {}
+            if not pending:
+                return retries, capacity
+            if retries >= max_retries:
+                raise RuntimeError('{} write requests were left unprocessed.'.format(
+                    len(pending[self.table_id])))
+            # Unprocessed items are DynamoDB throttling part of the batch.
+            if self.rate_controller is not None:
+                self.rate_controller.throttled('write')
+            _backoff(retries)
+            retries += 1
+            self.metrics.count('batch_write_item', 'retries')
+
+    def scan_items(self, total_segments=None, max_workers=None, **scan_kwargs):
+        """ This is the one place that scans the table. The scan is split
+        into total_segments with DynamoDB's Segment/TotalSegments and every
+        segment is paged through LastEvaluatedKey on its own worker thread.
+        Pages are handed back through a small queue, so items are yielded as
+        soon as any segment returns them and only a few pages are held in
+        memory at once. Any other scan arguments, like ProjectionExpression,
+        FilterExpression and their ExpressionAttribute Names/Values, are
+        passed straight through to every scan call.
+
+        Args: The number of segments (defaults to scan_segments), the number
+        of threads to run them on (defaults to one per segment) and the
+        arguments for scan().
+
+        Returns: A generator of the items in the table, in no set order.
+        """
+        total_segments = total_segments or self.scan_segments
+        max_workers = max_workers or total_segments
+        pages = queue.Queue(maxsize=2 * max_workers)
+        stop = threading.Event()
+
+        def put(page):
+            while not stop.is_set():
+                try:
+                    pages.put(page, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def scan_segment(segment):
+            kwargs = dict(scan_kwargs)
+            if total_segments > 1:
+                kwargs['Segment'] = segment
+                kwargs['TotalSegments'] = total_segments
+            try:
+                table = self._worker_table()
+                while not stop.is_set():
+                    response, _ = self._request(table, 'scan', **kwargs)
+                    put(response['Items'])
+                    if 'LastEvaluatedKey' not in response:
+                        break
+                    kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+            except Exception as error:
+                put(error)
+            finally:
+                put(_SEGMENT_DONE)
+
+        executor = _thread_pool(max_workers=max_workers)
+        for segment in range(total_segments):
+            executor.submit(scan_segment, segment)
+        finished = 0
+        try:
+            while finished < total_segments:
+                page = pages.get()
+                if page is _SEGMENT_DONE:
+                    finished += 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    for item in page:
+                        if item.get('Unique_ID') != GENERATION_ID:
+                            yield item
+        finally:
+            # Stops the other segments if the caller breaks out early or a
+            # segment failed.
+            stop.set()
+            executor.shutdown(wait=True)
 
     # These functions are for accesssing information for the table with API
     # Gateway calls. Every function will return a JSON object with a: header,
     # Body and StatusCode.
+    @_timed('find_top_quantity')
     def find_top_quantity(self, number_of_items=20):
         """ This will find the top number_of_items from the Dynamodb table 
         passed through a API call. This will only find the 'Top' items 
@@ -63,64 +1335,260 @@ class DynamoDB():
             }
         ]
         """
-
-        # This will be used to get all the items from the table and then
-        lvl_dict = {}
-        response = self.table.scan()
-        for item in response['Items']:
-            lvl_dict[item['Unique_ID']] = {
-                'item': item['item'],
-                'ilvl': item['ilvl'],
-                'quantity': item['quantity']
-            }
-
-        while 'LastEvaluatedKey' in response:
-            last_key = response['LastEvaluatedKey']
-            response = self.table.scan(
-                ExclusiveStartKey=last_key,
-            )
-            for item in response['Items']:
-                lvl_dict[item['Unique_ID']] = {
-                    'item': item['item'],
-                    'ilvl': item['ilvl'],
-                    'quantity': item['quantity']
-                }
+        top_rows = self.top_rows(number_of_items)
 
         # We can simply return a statusCode of 500 if the table is empty.
-        if len(lvl_dict) == 0:
+        if top_rows is None:
             response = {
                 "message": "Table is empty , please wait for maintanence"
             }
             return response
 
-        # These are the variables and tables needed to keep track of the
-        # iterations. We also needed to order the items into a resverse order
-        # based off the item lvl.
-        sorted_lvl_dict = {k: v for k, v in sorted(
-            lvl_dict.items(), key=lambda item: item[0]
+        top_items = take_top_items(top_rows, number_of_items, self.verbose)
+        self.metrics.count('find_top_quantity', 'items', len(top_items))
+        return top_items
+
+    @_timed('find_top_page')
+    def find_top_page(self, cursor=None, page_size=50):
+        """ This is find_top_quantity() a page at a time. The rows in stock
+        are listed in Unique_ID order (highest ilvl first) and every page
+        comes with a cursor for the next one, so a client can walk as far as
+        it wants without one large response. There is no quantity cut off.
+
+        Only the sharded layout with top_index=True reads just the rows a
+        page needs. On the original layout every page is a full scan of the
+        table that filters out the rows before the cursor, so walking n pages
+        reads the whole table n times.
+
+        Args: The cursor from the last page (None for the first page) and the
+        number of items on a page, up to TOP_PAGE_LIMIT.
+
+        Returns: A JSON object of the form:
+        {
+            "items": [{"item": item, "ilvl": ilvl, "quantity": quantity}],
+            "cursor": cursor for the next page, or None on the last page
+        }
+        A page size that is not a number or a cursor that is not valid gets
+        a message with a statusCode of 400 instead.
+        """
+        page_size = _page_size(page_size)
+        if page_size is None:
+            response = {
+                "statusCode": 400,
+                "message": "Page size has to be a number up to {}.".format(
+                    TOP_PAGE_LIMIT)
+            }
+            return response
+        after = None
+        if cursor:
+            try:
+                after = decode_cursor(cursor)
+            except ValueError:
+                response = {
+                    "statusCode": 400,
+                    "message": "Cursor is not valid, please start from the first page."
+                }
+                return response
+
+        # One row more than the page says if there is a next page.
+        rows = self.top_rows(page_size + 1, after) or []
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = encode_cursor(rows[-1]['Unique_ID'])
+        self.metrics.count('find_top_page', 'items', len(rows))
+        return {
+            "items": [{
+                "item": row['item'],
+                "ilvl": row['ilvl'],
+                "quantity": row['quantity']
+            } for row in rows],
+            "cursor": next_cursor
+        }
+
+    def find_top_page_body(self, cursor=None, page_size=50):
+        """ This is find_top_page() already encoded for an API Gateway
+        body, see encode_top_page(). With page_cache_size > 0 the encoded
+        pages are kept until a write through this object or cache_ttl
+        seconds, so hot pages like the first one are not read or encoded
+        again.
+
+        Args: The cursor and the page size, see find_top_page().
+
+        Returns: The JSON body as UTF-8 bytes.
+        """
+        # "50" and 50 are the same page.
+        key = (cursor or None, _page_size(page_size))
+        if self.page_cache is not None:
+            hit, cached = self.page_cache.get(key)
+            if hit:
+                return cached
+        page = self.find_top_page(cursor, page_size)
+        body = encode_top_page(page)
+        if self.page_cache is not None and "message" not in page:
+            self.page_cache.put(key, body, cached)
+        return body
+
+    def top_rows(self, number_of_items=20, after=None):
+        """ This finds the number_of_items rows in stock with the lowest
+        Unique_IDs (the highest ilvl), before the quantity cut off that
+        find_top_quantity() applies.
+
+        Args: The number of rows wanted, and the Unique_ID the rows have to
+        come after, for the pages of find_top_page().
+
+        Returns: The rows in Unique_ID order, or None if the table is empty.
+        """
+        if self.shards:
+            top_rows = self._query_top_rows(number_of_items, after)
+            # No rows in stock is [] like the original layout, and only a
+            # table without any rows is empty.
+            if top_rows or self._has_rows():
+                return top_rows
+            return None
+
+        # Only the number_of_items lowest Unique_IDs (highest ilvl) that have
+        # a quantity can make it into the result, so we only keep a bounded
+        # heap of those while the scan pages stream in.
+        scanned = 0
+        generation = self.current_generation() if self.epochs else None
+        kwargs = {}
+        if after is not None:
+            kwargs['FilterExpression'] = "Unique_ID > :c"
+            kwargs['ExpressionAttributeValues'] = {":c": after}
+
+        def stocked_rows():
+            nonlocal scanned
+            for item in self.scan_items(
+                ProjectionExpression="Unique_ID, #it, ilvl, quantity, #gen",
+                ExpressionAttributeNames={
+                    "#it": "item",
+                    "#gen": GENERATION_KEY
+                },
+                **kwargs
+            ):
+                scanned += 1
+                if self._live_quantity(item, generation) > 0:
+                    yield item
+
+        top_rows = heapq.nsmallest(
+            max(number_of_items, 1),
+            stocked_rows(),
+            key=lambda item: item['Unique_ID']
         )
+        if scanned == 0:
+            return None
+        return top_rows
+
+    def _has_rows(self):
+        """ This checks if the table holds any item rows, reading no more
+        than it has to. The generation item of epoch mode does not count.
+
+        Args: Null
+
+        Returns: True if the table has an item row.
+        """
+        kwargs = {
+            'ProjectionExpression': "Unique_ID",
+            'Limit': 2
         }
-        counter = 0
-        total = 0
-        json_list = []
+        while True:
+            response, _ = self._request(self.table, 'scan', **kwargs)
+            if any(item['Unique_ID'] != GENERATION_ID
+                   for item in response['Items']):
+                return True
+            if 'LastEvaluatedKey' not in response:
+                return False
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _query_top_rows(self, number_of_items, after=None):
+        """ In the sharded layout every shard is already sorted by Unique_ID,
+        so the top items are the first few rows of each shard. This queries
+        every shard in parallel (the Top_items index when there is one, which
+        only holds items in stock) and merges the shards by Unique_ID, only
+        fetching more pages from a shard when the merge gets to them.
+
+        Args: The number of items wanted, and the Unique_ID they have to come
+        after.
+
+        Returns: Up to number_of_items rows in stock, in Unique_ID order.
+        """
+        limit = max(number_of_items, 1)
+        generation = self.current_generation() if self.epochs else None
+
+        def query_shard(shard, start_key=None):
+            kwargs = {
+                'KeyConditionExpression': "#sh = :s",
+                'ProjectionExpression': "Unique_ID, #it, ilvl, quantity",
+                'ExpressionAttributeNames': {
+                    "#sh": SHARD_KEY,
+                    "#it": "item"
+                },
+                'ExpressionAttributeValues': {
+                    ":s": shard
+                },
+                'ScanIndexForward': True,
+                'Limit': limit
+            }
+            names = kwargs['ExpressionAttributeNames']
+            values = kwargs['ExpressionAttributeValues']
+            if self.epochs:
+                kwargs['ProjectionExpression'] += ", #gen"
+                names["#gen"] = GENERATION_KEY
+            if self.top_index:
+                kwargs['IndexName'] = TOP_INDEX
+                if after is not None:
+                    # Older generations sort before the current one, so
+                    # this also skips them.
+                    kwargs['KeyConditionExpression'] += " AND #rk > :c"
+                    names["#rk"] = RANKED_KEY
+                    values[":c"] = self._ranked_id(after, generation)
+                elif self.epochs:
+                    kwargs['KeyConditionExpression'] += \
+                        " AND begins_with(#rk, :p)"
+                    names["#rk"] = RANKED_KEY
+                    values[":p"] = self._ranked_id("", generation)
+            else:
+                if after is not None:
+                    kwargs['KeyConditionExpression'] += " AND Unique_ID > :c"
+                    values[":c"] = after
+                kwargs['FilterExpression'] = "quantity > :z"
+                values[":z"] = decimal.Decimal(0)
+                if self.epochs:
+                    kwargs['FilterExpression'] += " AND ({})".format(
+                        self._same_generation(generation))
+                    values[":g"] = generation
+            if start_key is not None:
+                kwargs['ExclusiveStartKey'] = start_key
+            response, _ = self._request(self._worker_table(), 'query',
+                                        **kwargs)
+            return response
 
-        # Once we have the sorted list we can then count the quantity and
-        # the get the items untill we reach the correct amount of items.
-        for item in sorted_lvl_dict:
-            if sorted_lvl_dict[item]['quantity'] > 0:
-                total += int(sorted_lvl_dict[item]['quantity'])
-                counter += 1
-                json_list.append(sorted_lvl_dict[item])
-                print("name: {},\t\t ilvl: {},\t quantity: {}".format(
-                    sorted_lvl_dict[item]['item'],
-                    sorted_lvl_dict[item]['ilvl'],
-                    sorted_lvl_dict[item]['quantity']
-                )
-                )
-            if total >= number_of_items or counter >= number_of_items:
+        def shard_rows(shard, response):
+            while True:
+                for item in response['Items']:
+                    if self._live_quantity(item, generation) > 0:
+                        yield item
+                if 'LastEvaluatedKey' not in response:
+                    return
+                response = query_shard(shard, response['LastEvaluatedKey'])
+
+        with _thread_pool(max_workers=min(self.shards, 16)) as executor:
+            first_pages = list(executor.map(query_shard, range(self.shards)))
+
+        merged = heapq.merge(
+            *[shard_rows(shard, response)
+              for shard, response in enumerate(first_pages)],
+            key=lambda item: item['Unique_ID']
+        )
+        top_rows = []
+        for item in merged:
+            top_rows.append(item)
+            if len(top_rows) >= limit:
                 break
-        return json_list
+        return top_rows
 
+    @_timed('put_item')
     def put_item(self, item, ilvl, quantity):
         """This will take a client for a DynamoDB table, an item, and the 
         ilvl of that item. It will create the Unique_ID for the item and 
@@ -133,27 +1601,60 @@ class DynamoDB():
         """
         item = url_decode(item)
         Unique_ID = create_unique_ilvl_str(ilvl, item)
-        response = self.table.update_item(
-            Key={
-                'Unique_ID': Unique_ID,
-            },
-            UpdateExpression="SET quantity = :q, ilvl = :l, #it = :i",
-            ExpressionAttributeValues={
-                ":q": decimal.Decimal(quantity),
-                ":l": ilvl,
-                ":i": item
-            },
-            ExpressionAttributeNames={
-                "#it": "item"
-            },
-            ReturnValues="ALL_NEW"
-        )
+        update = "SET quantity = :q, ilvl = :l, #it = :i"
+        values = {
+            ":q": decimal.Decimal(quantity),
+            ":l": ilvl,
+            ":i": item
+        }
+        names = {
+            "#it": "item"
+        }
+        generation = None
+        kwargs = {}
+        if self.epochs:
+            update += ", #gen = :g"
+            names["#gen"] = GENERATION_KEY
+            # A row from a newer generation means another process has reset
+            # the table since the generation was cached.
+            kwargs['ConditionExpression'] = \
+                "attribute_not_exists(#gen) OR #gen <= :g"
+        for attempt in range(3):
+            if self.epochs:
+                generation = self.current_generation(refresh=attempt > 0)
+                values[":g"] = generation
+            rank_clause, rank_values = self._rank_clause(
+                Unique_ID, decimal.Decimal(quantity) > 0, generation)
+            try:
+                self._request(
+                    self.table,
+                    'update_item',
+                    Key=self._key(Unique_ID),
+                    UpdateExpression=update + rank_clause,
+                    ExpressionAttributeValues={
+                        **values,
+                        **rank_values
+                    },
+                    ExpressionAttributeNames=names,
+                    ReturnValues="ALL_NEW",
+                    **kwargs
+                )
+                break
+            except ClientError as error:
+                if error.response['Error']['Code'] != \
+                        'ConditionalCheckFailedException' or attempt == 2:
+                    raise
+        self._invalidate([Unique_ID])
+        if self.top_view is not None:
+            self.top_view.apply(Unique_ID, item, ilvl,
+                                decimal.Decimal(quantity))
         response = {
             "message": "Item has been added to the table.",
             "Item": [Unique_ID, item, ilvl, quantity]
         }
         return response
 
+    @_timed('get_item')
     def get_item(self, item, ilvl):
         """ This is used to get an item from the DynamoDB table with the class.
         You need to pass the item and the ilvl of the item. You can pass the 
@@ -164,16 +1665,25 @@ class DynamoDB():
 
         Returns: The response from the DynamoDB table.
         """
-        item = url_decode(item)
-        ID = create_unique_ilvl_str(ilvl, item)
-        response = self.table.get_item(
-            Key={
-                'Unique_ID': ID
-            }
-        )
-        if "Item" in response:
-            response_item = response['Item']
-            return response_item
+        item, ID = _lookup_key(item, ilvl)
+        response_item = None
+        if self.cache is not None:
+            hit, cached = self.cache.get(ID)
+            if hit:
+                response_item = cached
+        if self.cache is None or not hit:
+            response, _ = self._request(
+                self.table,
+                'get_item',
+                Key=self._key(ID)
+            )
+            if "Item" in response:
+                response_item = self._clean_item(response['Item'])
+            if self.cache is not None:
+                self.cache.put(ID, response_item, cached)
+
+        if response_item is not None:
+            return dict(response_item)
         else:
             response = {
                 "message": "Item not in table please try an other.",
@@ -181,6 +1691,143 @@ class DynamoDB():
             }
             return response
 
+    def _clean_item(self, response_item):
+        """ This turns a row from the table into what get_item() returns:
+        the quantity of the current generation and none of the extra
+        attributes the class keeps.
+
+        Args: The row from the table.
+
+        Returns: The same row, changed in place.
+        """
+        if self.epochs:
+            response_item['quantity'] = self._live_quantity(
+                response_item, self.current_generation())
+        response_item.pop(SHARD_KEY, None)
+        response_item.pop(RANKED_KEY, None)
+        response_item.pop(GENERATION_KEY, None)
+        response_item.pop(WRITE_TOKEN_KEY, None)
+        return response_item
+
+    def _get_chunk(self, ids, max_retries=8):
+        """ This reads up to 100 Unique_IDs with one BatchGetItem call, and
+        sends the keys DynamoDB hands back as UnprocessedKeys again after a
+        jittered backoff.
+
+        Args: The list of Unique_IDs, without duplicates.
+
+        Returns: A Dict of Unique_ID to the cleaned row for the ones that are
+        in the table.
+        """
+        resource = self._worker_resource()
+        pending = {self.table_id: {'Keys': [self._key(ID) for ID in ids]}}
+        found = {}
+        retries = 0
+        while True:
+            response, tries = self._request(
+                resource,
+                'batch_get_item',
+                RequestItems=pending
+            )
+            retries += tries
+            for row in response.get('Responses', {}).get(self.table_id, []):
+                found[row['Unique_ID']] = self._clean_item(row)
+            pending = response.get('UnprocessedKeys') or {}
+            if not pending:
+                return found
+            if retries >= max_retries:
+                raise RuntimeError('{} keys were left unprocessed.'.format(
+                    len(pending[self.table_id]['Keys'])))
+            if self.rate_controller is not None:
+                self.rate_controller.throttled('read')
+            _backoff(retries)
+            retries += 1
+            self.metrics.count('batch_get_item', 'retries')
+
+    def _plan_items(self, pairs):
+        # Works out the keys of the pairs, answers what it can from the
+        # cache and splits the rest into BatchGetItem sized chunks.
+        keys = [_lookup_key(item, ilvl) for item, ilvl in pairs]
+        rows = {}
+        versions = {}
+        missing = []
+        for _, ID in keys:
+            if ID in rows or ID in versions:
+                continue
+            if self.cache is not None:
+                hit, cached = self.cache.get(ID)
+                if hit:
+                    rows[ID] = cached
+                    continue
+                versions[ID] = cached
+            else:
+                versions[ID] = None
+            missing.append(ID)
+        chunks = [missing[start:start + 100]
+                  for start in range(0, len(missing), 100)]
+        return keys, rows, versions, chunks
+
+    def _finish_items(self, pairs, keys, rows, versions, found):
+        # Puts the fetched rows in the cache and answers in input order.
+        for ID in versions:
+            rows[ID] = found.get(ID)
+            if self.cache is not None:
+                self.cache.put(ID, rows[ID], versions[ID])
+        results = []
+        for (item, ID), (_, ilvl) in zip(keys, pairs):
+            if rows[ID] is not None:
+                results.append(dict(rows[ID]))
+            else:
+                results.append({
+                    "message": "Item not in table please try an other.",
+                    "item": [item, ilvl]
+                })
+        self.metrics.count('get_items', 'items', len(pairs))
+        return results
+
+    @_timed('get_items')
+    def get_items(self, pairs, max_workers=8):
+        """ This is get_item() for many items at once. The keys are read
+        with BatchGetItem, 100 at a time, and the chunks are sent from
+        max_workers threads at the same time. Items in the get_item() cache
+        are not read again, and an item asked for twice is read once.
+
+        Args: A list of (item, ilvl) pairs and the number of threads.
+
+        Returns: A list with what get_item() would return for each pair, in
+        the same order.
+        """
+        pairs = list(pairs)
+        keys, rows, versions, chunks = self._plan_items(pairs)
+        found = {}
+        if chunks:
+            workers = max(1, min(max_workers, len(chunks)))
+            with _thread_pool(max_workers=workers) as executor:
+                for chunk_rows in executor.map(self._get_chunk, chunks):
+                    found.update(chunk_rows)
+        return self._finish_items(pairs, keys, rows, versions, found)
+
+    async def get_items_async(self, pairs):
+        """ This is get_items() for callers that are already in an asyncio
+        event loop. The chunks are read in the loop's default executor and
+        awaited together, so the loop is never blocked.
+
+        Args: A list of (item, ilvl) pairs.
+
+        Returns: The same list get_items() returns.
+        """
+        import asyncio
+        pairs = list(pairs)
+        keys, rows, versions, chunks = self._plan_items(pairs)
+        loop = asyncio.get_running_loop()
+        found = {}
+        for chunk_rows in await asyncio.gather(*[
+                loop.run_in_executor(None, self._get_chunk, chunk)
+                for chunk in chunks]):
+            found.update(chunk_rows)
+        return self._finish_items(pairs, keys, rows, versions, found)
+
+    @_timed('delete_item')
     def delete_item(self, item, ilvl):
         """ This will clear an item from the Dynamodb table passed within the 
         class.
@@ -195,12 +1842,16 @@ class DynamoDB():
         ilvl = ilvl
         unique = create_unique_ilvl_str(ilvl, item)
 
-        response = self.table.delete_item(
-            Key={
-                'Unique_ID': unique
-            },
+        response, _ = self._request(
+            self.table,
+            'delete_item',
+            Key=self._key(unique),
             ReturnValues="ALL_OLD"
         )
+        self._invalidate([unique])
+        self.seen_keys.discard(unique)
+        if self.top_view is not None:
+            self.top_view.apply(unique, item, ilvl, decimal.Decimal(0))
         response = {
             "message": "Item has been deleted from the table.",
             "Item": [unique, item, ilvl]
@@ -210,179 +1861,541 @@ class DynamoDB():
     # These are functions to augment the table, but these are not called from an API
     # These do not need to return anything as all the logging is done with
     # print().
-    def update_table(self, unique_items):
+    @_timed('update_table')
+    def update_table(self, unique_items, bulk=False, max_workers=8, token=None):
         """ This will be used to update the quantity for any item passed through the
         function call in the Dict Unique_items. This will only process one tab at a 
         time.
 
+        With bulk=True the quantities are added with a single atomic ADD per
+        item instead of a get_item and an update_item, and the writes are
+        spread over max_workers threads. token is passed on to
+        bulk_update_table().
+
         Args: The client for the DynamoDB table that you want updated and the Dict 
         with Quantities that you want updated.
 
-        Returns: Null
+        Returns: Null, or the summary from bulk_update_table() in bulk mode.
         """
+        if bulk:
+            return self.bulk_update_table(unique_items, max_workers, token)
+
         counter = 0
         for item in unique_items:
             counter += 1
-            get_response = self.table.get_item(
-                Key={
-                    'Unique_ID': item
-                }
-            )
-
-            if 'Item' in get_response:
-                response = self.table.update_item(
-                    Key={
-                        'Unique_ID': item
-                    },
-                    UpdateExpression="SET quantity = quantity + :q",
-                    ExpressionAttributeValues={
-                        ":q": decimal.Decimal(unique_items[item]['quantity']),
-                    },
-                    ReturnValues="ALL_NEW"
+            response = self._update_row(item, unique_items[item])
+            self._invalidate([item])
+            if self.top_view is not None:
+                self.top_view.apply(
+                    item,
+                    unique_items[item]['item'],
+                    unique_items[item]['ilvl'],
+                    response['Attributes']['quantity']
+                )
+            if self.verbose:
+                print("Item: {}, ilvl: {}, Quantity: {}.".format(
+                    response['Attributes']['item'],
+                    response['Attributes']['ilvl'],
+                    response['Attributes']['quantity']
                 )
-            else:
-                response = self.table.update_item(
-                    Key={
-                        'Unique_ID': item
-                    },
-                    UpdateExpression="SET quantity = :q",
-                    ExpressionAttributeValues={
-                        ":q": decimal.Decimal(unique_items[item]['quantity']),
-                    },
-                    ReturnValues="ALL_NEW"
                 )
+        self.metrics.count('update_table', 'items', counter)
+        print('Total number of writes to the table {}.'.format(counter))
+
+    def _update_row(self, unique, entry):
+        """ This is one write of update_table() without bulk: the row is read
+        first, then its quantity is added to, or set when the row is new. In
+        epoch mode a row from an older generation is set as well, since it
+        has been reset, and both writes only go through while the row is
+        still in the generation it was read in. A row from a newer
+        generation means another process has reset the table, so the
+        generation is read again and the write is retried, the same way
+        _add_quantity() does.
+
+        Args: The Unique_ID and its Dict from get_stash_quantities().
 
-            print("Item: {}, ilvl: {}, Quantity: {}.".format(
-                response['Attributes']['item'],
-                response['Attributes']['ilvl'],
-                response['Attributes']['quantity']
+        Returns: The response from the DynamoDB table.
+        """
+        conflict = None
+        for attempt in range(3):
+            generation = None
+            if self.epochs:
+                generation = self.current_generation(refresh=attempt > 0)
+            get_response, _ = self._request(
+                self.table,
+                'get_item',
+                Key=self._key(unique)
             )
+            row = get_response.get('Item')
+            if self.epochs and row is not None and \
+                    int(row.get(GENERATION_KEY, 0)) > generation:
+                generation = self.current_generation(refresh=True)
+
+            # In epoch mode a row from an older generation starts over.
+            stale = self.epochs and row is not None and \
+                int(row.get(GENERATION_KEY, 0)) < generation
+            rank_clause, rank_values = self._rank_clause(
+                unique, True, generation)
+            values = {
+                ":q": decimal.Decimal(entry['quantity']),
+                **rank_values
+            }
+            names = {}
+            condition = None
+            if row is not None and not stale:
+                update = "SET quantity = quantity + :q"
+                if self.epochs:
+                    condition = self._same_generation(generation)
+            else:
+                # A new row needs its item and ilvl as well as the quantity.
+                update = "SET quantity = :q, ilvl = :l, #it = :i"
+                values[":l"] = entry['ilvl']
+                values[":i"] = entry['item']
+                names["#it"] = "item"
+                if self.epochs:
+                    condition = "attribute_not_exists(#gen) OR #gen < :g"
+            kwargs = {}
+            if self.epochs:
+                update += ", #gen = :g"
+                values[":g"] = generation
+                names["#gen"] = GENERATION_KEY
+                kwargs['ConditionExpression'] = condition
+            if names:
+                kwargs['ExpressionAttributeNames'] = names
+            try:
+                response, _ = self._request(
+                    self.table,
+                    'update_item',
+                    Key=self._key(unique),
+                    UpdateExpression=update + rank_clause,
+                    ExpressionAttributeValues=values,
+                    ReturnValues="ALL_NEW",
+                    **kwargs
+                )
+                return response
+            except ClientError as error:
+                if error.response['Error']['Code'] != \
+                        'ConditionalCheckFailedException':
+                    raise
+                # Another process wrote or reset the row in between.
+                conflict = error
+        raise conflict
+
+    @_timed('bulk_update_table')
+    def bulk_update_table(self, unique_items, max_workers=8, token=None):
+        """ This will add the quantities in unique_items to the table without
+        reading them first. ADD creates the quantity when the item is new and
+        adds to it when it is not, so one write per item is enough. The keys
+        are split between max_workers threads that each use their own table.
+
+        A token (for example the change id of the stash page) makes the batch
+        idempotent: every row records the token of its last write, and rows
+        that already have it are skipped. Sending the same batch again with
+        the same token, like after a crash, does not count anything twice as
+        long as no write with another token has reached those rows since.
+
+        Args: The Dict with quantities from get_stash_quantities() or a
+        StashCounts, the number of threads to write with and an optional
+        write token.
+
+        Returns: A Dict with the number of writes, retries, rows skipped
+        because they had the token, the consumed capacity and the Unique_IDs
+        that could not be written:
+        {
+            "writes": writes,
+            "retries": retries,
+            "skipped": skipped,
+            "consumed_capacity": capacity_units,
+            "failed": [Unique_ID]
+        }
+        """
+        if isinstance(unique_items, StashCounts):
+            # The Decimals for DynamoDB are only made here.
+            unique_items = unique_items.to_dict()
+        keys = list(unique_items)
+        workers = max(1, min(max_workers, len(keys)))
+        chunks = [keys[index::workers] for index in range(workers)]
+
+        def write_chunk(chunk):
+            table = self._worker_table()
+            summary = {
+                "writes": 0,
+                "retries": 0,
+                "skipped": 0,
+                "consumed_capacity": 0.0,
+                "failed": []
+            }
+            for unique in chunk:
+                try:
+                    response, retries = self._add_quantity(
+                        table, unique, unique_items[unique], token)
+                except ClientError as error:
+                    print('Unable to update {}: {}'.format(unique, error))
+                    summary['failed'].append(unique)
+                    continue
+                summary['retries'] += retries
+                if response is None:
+                    summary['skipped'] += 1
+                    continue
+                summary['writes'] += 1
+                if self.top_view is not None:
+                    entry = unique_items[unique]
+                    self.top_view.apply(
+                        unique, entry['item'], entry['ilvl'],
+                        response['Attributes']['quantity'])
+                if 'ConsumedCapacity' in response:
+                    summary['consumed_capacity'] += \
+                        response['ConsumedCapacity']['CapacityUnits']
+            return summary
+
+        total = {
+            "writes": 0,
+            "retries": 0,
+            "skipped": 0,
+            "consumed_capacity": 0.0,
+            "failed": []
+        }
+        if not keys:
+            return total
+        try:
+            with _thread_pool(max_workers=workers) as executor:
+                summaries = list(executor.map(write_chunk, chunks))
+        finally:
+            self._invalidate(keys)
+        for summary in summaries:
+            total['writes'] += summary['writes']
+            total['retries'] += summary['retries']
+            total['skipped'] += summary['skipped']
+            total['consumed_capacity'] += summary['consumed_capacity']
+            total['failed'].extend(summary['failed'])
+        self.metrics.count('bulk_update_table', 'items', total['writes'])
+        self.metrics.count('bulk_update_table', 'skipped', total['skipped'])
+        self.metrics.count('bulk_update_table', 'failed', len(total['failed']))
+
+        print('Total number of writes to the table {}, {} retries, {} failed.'.format(
+            total['writes'], total['retries'], len(total['failed'])
+        )
+        )
+        return total
+
+    def _add_quantity(self, table, unique, entry, token=None):
+        """ This adds the quantity in entry to one row with a single atomic
+        write. In epoch mode the ADD is only allowed while the row is in the
+        current generation. A row from an older generation is reset lazily
+        by setting its quantity to the delta instead, and a row from a newer
+        generation means another process has reset the table, so the
+        generation is read again and the write is retried.
+
+        With a token the row also remembers the token of the last write that
+        changed it, and a write with the same token is skipped. That makes it
+        safe to send the same batch again after a crash or a failed flush, as
+        long as no other token has written the row in between.
+
+        Args: The table for this thread, the Unique_ID, its Dict from
+        get_stash_quantities() and an optional write token.
+
+        Returns: The response from the DynamoDB table (None if the token had
+        already been written) and the number of retries it took.
+        """
+        values = {
+            ":q": decimal.Decimal(entry['quantity']),
+            ":l": entry['ilvl'],
+            ":i": entry['item']
+        }
+        names = {
+            "#it": "item"
+        }
+        token_clause = ""
+        token_condition = None
+        if token is not None:
+            token_clause = ", #tok = :t"
+            token_condition = "attribute_not_exists(#tok) OR #tok <> :t"
+            names["#tok"] = WRITE_TOKEN_KEY
+            values[":t"] = token
+
+        # The top items view needs the quantity the row ends up with.
+        returns = {}
+        if self.top_view is not None:
+            returns['ReturnValues'] = "UPDATED_NEW"
+
+        conflict = None
+        for attempt in range(3):
+            generation = None
+            writes = (
+                ("ADD quantity :q SET ilvl = :l, #it = :i", None),
             )
-        print('Total number of writes to the table {}.'.format(counter))
+            if self.epochs:
+                generation = self.current_generation(refresh=attempt > 0)
+                names["#gen"] = GENERATION_KEY
+                values[":g"] = generation
+                writes = (
+                    ("ADD quantity :q SET ilvl = :l, #it = :i, #gen = :g",
+                     self._same_generation(generation)),
+                    ("SET quantity = :q, ilvl = :l, #it = :i, #gen = :g",
+                     "attribute_not_exists(#gen) OR #gen < :g")
+                )
+            rank_clause, rank_values = self._rank_clause(
+                unique, True, generation)
+            for update, condition in writes:
+                conditions = [
+                    "({})".format(part)
+                    for part in (condition, token_condition) if part
+                ]
+                kwargs = dict(returns)
+                if conditions:
+                    kwargs['ConditionExpression'] = " AND ".join(conditions)
+                try:
+                    return self._request(
+                        table,
+                        'update_item',
+                        Key=self._key(unique),
+                        UpdateExpression=update + token_clause + rank_clause,
+                        ExpressionAttributeValues={
+                            **values,
+                            **rank_values
+                        },
+                        ExpressionAttributeNames=names,
+                        ReturnConsumedCapacity="TOTAL",
+                        **kwargs
+                    )
+                except ClientError as error:
+                    if error.response['Error']['Code'] != \
+                            'ConditionalCheckFailedException':
+                        raise
+                    conflict = error
+            # Either this token has been written already, or the row is from
+            # a newer generation than the one we have cached.
+            if token is not None and self._written_with(table, unique, token):
+                return None, 0
+        raise conflict
+
+    def _written_with(self, table, unique, token):
+        """ This checks if the last write to a row used the given token.
+
+        Args: The table for this thread, the Unique_ID and the token.
+
+        Returns: True if the row was last written with the token.
+        """
+        response, _ = self._request(
+            table,
+            'get_item',
+            Key=self._key(unique),
+            ConsistentRead=True,
+            ProjectionExpression="#tok",
+            ExpressionAttributeNames={
+                "#tok": WRITE_TOKEN_KEY
+            }
+        )
+        return response.get('Item', {}).get(WRITE_TOKEN_KEY) == token
 
-    def upload_stash(self, current_stash):
+    @_timed('upload_stash')
+    def upload_stash(self, current_stash, max_workers=8):
         """ This will be used to upload all items in the current_stash to the 
         DynamoDB table stored within the class. This will only process the 
         current_stash.
 
-        Args: The current_stash from the PoE public API.
-
-        Returns: Null
+        Items that are already in the table are left alone. Keys that were
+        seen earlier in the page, or on an earlier page (see SeenKeys), are
+        dropped without a request, and the rest are inserted with a put that
+        only succeeds if the key is not in the table yet, so no read is
+        needed first. The puts are split between max_workers threads.
+
+        Args: The current_stash from the PoE public API and the number of
+        threads to write with.
+
+        Returns: A Dict with the number of items in the stash, the new
+        items that were inserted, the ones that were already in the table
+        and the Unique_IDs that could not be written:
+        {
+            "items": items,
+            "inserted": inserted,
+            "existing": existing,
+            "failed": [Unique_ID]
+        }
         """
-        counter = 0
-        counter_unique = 0
-        for stash in current_stash['stashes']:
-            for row in stash['items']:
-                counter += 1
-                if row['name'] != '' and row['ilvl'] != '':
-                    unique_ = create_unique_ilvl_str(row['ilvl'], row['name'])
-                    get_response = self.table.get_item(
-                        Key={
-                            'Unique_ID': unique_
-                        }
+        new_rows = {}
+
+        def add_row(name, ilvl):
+            unique_ = create_unique_ilvl_str(ilvl, name)
+            if unique_ in new_rows or unique_ in self.seen_keys:
+                return False
+            new_rows[unique_] = {'name': name, 'ilvl': ilvl}
+            return True
+
+        counter = count_stash_items(stash_item_pairs(current_stash), add_row)
+
+        generation = None
+        if self.epochs and new_rows:
+            generation = self.current_generation()
+        keys = list(new_rows)
+        workers = max(1, min(max_workers, len(keys)))
+        chunks = [keys[index::workers] for index in range(workers)]
+
+        def put_chunk(chunk):
+            table = self._worker_table()
+            summary = {
+                "inserted": 0,
+                "existing": 0,
+                "failed": []
+            }
+            for unique in chunk:
+                row = new_rows[unique]
+                item = {
+                    **self._key(unique),
+                    'quantity': decimal.Decimal(0),
+                    'ilvl': row['ilvl'],
+                    'item': row['name']
+                }
+                if generation is not None:
+                    item[GENERATION_KEY] = generation
+                try:
+                    self._request(
+                        table,
+                        'put_item',
+                        Item=item,
+                        ConditionExpression="attribute_not_exists(Unique_ID)"
                     )
-
-                    if 'Item' in get_response:
+                except ClientError as error:
+                    if error.response['Error']['Code'] != \
+                            'ConditionalCheckFailedException':
+                        print('Unable to insert {}: {}'.format(unique, error))
+                        summary['failed'].append(unique)
                         continue
-
-                    else:
-                        counter_unique += 1
-                        response = table.update_item(
-                            Key={
-                                'Unique_ID': unique_,
-                            },
-                            UpdateExpression="SET quantity = :q, ilvl = :l, #it = :i",
-                            ExpressionAttributeValues={
-                                ":q": int(0),
-                                ":l": row['ilvl'],
-                                ":i": row['name']
-                            },
-                            ExpressionAttributeNames={
-                                "#it": "item"
-                            },
-                            ReturnValues="ALL_NEW"
-                        )
+                    summary['existing'] += 1
+                else:
+                    summary['inserted'] += 1
+                    if self.verbose:
                         print("name: {},\t\t ilvl: {},\t quantity: {},\t unique: {}".format(
-                            response['Attributes']['item'],
-                            response['Attributes']['ilvl'],
-                            response['Attributes']['quantity'],
-                            response['Attributes']['Unique_ID']
-                        )
-                        )
-                if counter % 100 == 0:
-                    print("{} have been processed of {} total items.".format(
-                        counter_unique, counter
-                    )
-                    )
+                            row['name'], row['ilvl'], 0, unique))
+                self.seen_keys.add(unique)
+            return summary
+
+        total = {
+            "items": counter,
+            "inserted": 0,
+            "existing": 0,
+            "failed": []
+        }
+        if keys:
+            try:
+                with _thread_pool(max_workers=workers) as executor:
+                    summaries = list(executor.map(put_chunk, chunks))
+            finally:
+                self._invalidate(keys)
+            for summary in summaries:
+                total['inserted'] += summary['inserted']
+                total['existing'] += summary['existing']
+                total['failed'].extend(summary['failed'])
+        self.metrics.count('upload_stash', 'items', counter)
+        self.metrics.count('upload_stash', 'inserted', total['inserted'])
+        print("{} new items inserted of {} total items.".format(
+            total['inserted'], counter
+        )
+        )
+        return total
 
+    @_timed('reset_table')
     def reset_table(self):
         """ This will set every quantity value to 0. This is best run from a home
         console as this will take longer than the 15min time out that Lambda 
         functions have.
 
+        In epoch mode nothing is rewritten. The generation is moved on with a
+        single conditional write and every row from an older generation is
+        read as 0 from then on, until the next write to it resets it.
+
         Args: A Dynamodb table.
 
         Returns: Null
         """
+        if self.epochs:
+            generation = self.current_generation(refresh=True)
+            try:
+                self._request(
+                    self.table,
+                    'update_item',
+                    Key=self._key(GENERATION_ID),
+                    UpdateExpression="SET #gen = :n",
+                    ConditionExpression=self._same_generation(generation),
+                    ExpressionAttributeNames={
+                        "#gen": GENERATION_KEY
+                    },
+                    ExpressionAttributeValues={
+                        ":g": generation,
+                        ":n": generation + 1
+                    }
+                )
+            except ClientError as error:
+                if error.response['Error']['Code'] != \
+                        'ConditionalCheckFailedException':
+                    raise
+                print('The table was reset by another process.')
+            self._invalidate()
+            if self.top_view is not None:
+                self.top_view.clear()
+            print('Table reset to generation {}.'.format(
+                self.current_generation(refresh=True)))
+            return
+
         # We need to find all the unique IDs
         unique_ids = []
         counter = 0
 
-        response = self.table.scan(
+        for unique in self.scan_items(
+            ProjectionExpression="Unique_ID",
             FilterExpression="quantity > :z",
             ExpressionAttributeValues={
                 ":z": decimal.Decimal(0)
             }
-        )
-        for unique in response['Items']:
+        ):
             unique_ids.append(unique['Unique_ID'])
 
-        while 'LastEvaluatedKey' in response:
-            last_key = response['LastEvaluatedKey']
-            response = self.table.scan(
-                ExclusiveStartKey=last_key,
-                FilterExpression="quantity > :z",
-                ExpressionAttributeValues={
-                    ":z": decimal.Decimal(0)
-                }
-            )
-
-            for unique in response['Items']:
-                unique_ids.append(unique['Unique_ID'])
-
         print('{} Unique_IDs found.'.format(len(unique_ids)))
 
         # Now we can update the quantity column
+        rank_clause, _ = self._rank_clause(None, False)
         for unique in unique_ids:
             counter += 1
-            response = self.table.update_item(
-                Key={
-                    'Unique_ID': unique
-                },
-                UpdateExpression="SET quantity = :q",
+            response, _ = self._request(
+                self.table,
+                'update_item',
+                Key=self._key(unique),
+                UpdateExpression="SET quantity = :q" + rank_clause,
                 ExpressionAttributeValues={
                     ":q": decimal.Decimal(0),
                 },
                 ReturnValues="ALL_OLD"
             )
 
-            print("name: {},\t\t ilvl: {},\t quantity: {},\t unique: {}".format(
-                response['Attributes']['item'],
-                response['Attributes']['ilvl'],
-                response['Attributes']['quantity'],
-                response['Attributes']['Unique_ID']
-            )
-            )
-            if counter % 100 == 0:
-                print('{} items reset.'.format(counter))
-                print('{} items left.'.format(str(len(unique_ids) - counter)))
+            if self.verbose:
+                print("name: {},\t\t ilvl: {},\t quantity: {},\t unique: {}".format(
+                    response['Attributes']['item'],
+                    response['Attributes']['ilvl'],
+                    response['Attributes']['quantity'],
+                    response['Attributes']['Unique_ID']
+                )
+                )
+                if counter % 100 == 0:
+                    print('{} items reset.'.format(counter))
+                    print('{} items left.'.format(str(len(unique_ids) - counter)))
+        self.metrics.count('reset_table', 'items', counter)
+        self._invalidate()
+        if self.top_view is not None:
+            self.top_view.clear()
 
     def upload_top_items(self, item_list):
         """ This will be for the smaller PoE_top_items table. This is to avoid 
         the long time it takes to get the top items from the DynamoDB table
         as taking the top items requires scanning the entire table. The step 
         prior to running this function should be to delete every item in the
-        table.
+        table, which delete_items(recreate=True) does the quickest for a table
+        this small. A table in the sharded layout with a Top_items index can
+        answer find_top_quantity() with a few queries, so it does not need
+        this side table.
+
+        TopItemsView.sync() keeps this table up to date without emptying it
+        first, by only writing the rows that changed, and replace_top_items()
+        does the same for a whole new list.
 
         Args: The list of items that we want to upload to the smaller DynamoDB
         table.
@@ -393,46 +2406,686 @@ class DynamoDB():
             item_ = item["item"]
             ilvl_ = item["ilvl"]
             quantity_ = item["quantity"]
-            print(
-                "Item: {}, Ilvl: {}, Quantity: {}".format(
-                    item_, ilvl_, quantity_)
-            )
+            if self.verbose:
+                print(
+                    "Item: {}, Ilvl: {}, Quantity: {}".format(
+                        item_, ilvl_, quantity_)
+                )
             self.put_item(item_, ilvl_, quantity_)
 
-    def delete_items(self):
+    @_timed('replace_top_items')
+    def replace_top_items(self, item_list, max_workers=8):
+        """ This makes the smaller PoE_top_items table hold exactly
+        item_list without emptying it first. The new rows are written with
+        put_rows() and only then are the rows that are no longer in the list
+        deleted, so a reader sees either the old or the new top items (or a
+        mix of both while it runs), but never an empty table.
+
+        Args: The list from find_top_quantity() or Snapshot.top_items(), and
+        the number of threads to write with.
+
+        Returns: A Dict with the number of rows put and deleted.
+        """
+        old_keys = [item['Unique_ID'] for item in
+                    self.scan_items(ProjectionExpression="Unique_ID")]
+        rows = [
+            dict(item, Unique_ID=create_unique_ilvl_str(item['ilvl'],
+                                                        item['item']))
+            for item in item_list
+        ]
+        self.put_rows(rows, max_workers=max_workers)
+        wanted = set(row['Unique_ID'] for row in rows)
+        stale = [unique for unique in old_keys if unique not in wanted]
+        requests = [{'DeleteRequest': {'Key': self._key(unique)}}
+                    for unique in stale]
+        for start in range(0, len(requests), 25):
+            self._batch_write(requests[start:start + 25])
+        self._invalidate(stale)
+        return {
+            "put": len(rows),
+            "deleted": len(stale)
+        }
+
+    @_timed('delete_items')
+    def delete_items(self, recreate=False, max_workers=8):
         """ This will clear the enitire database for the DynamoDB table that 
         the class connects to. Once this starts it will start to clear items 
         from the DynamoDB table.
 
+        The keys stream out of scan_items() into 25 key BatchWriteItem
+        deletes that run on max_workers threads, so the keys are never all
+        held in memory. With recreate=True the table is dropped and created
+        again instead, see recreate_table(), which is much cheaper than
+        deleting a large table row by row. The progress only counts rows
+        whose batch has gone through.
+
+        Args: recreate=True to drop and recreate the table, and the number of
+        threads for the batch deletes.
+
+        Returns: The number of items removed, or Null with recreate=True.
+        """
+        if recreate:
+            self.recreate_table()
+            return
+
+        removed = 0
+        reported = 0
+        in_flight = threading.BoundedSemaphore(2 * max_workers)
+
+        def delete_batch(batch):
+            try:
+                self._batch_write(batch)
+            finally:
+                in_flight.release()
+            return len(batch)
+
+        futures = []
+        with _thread_pool(max_workers=max_workers) as executor:
+            batch = []
+            for item in self.scan_items(ProjectionExpression="Unique_ID"):
+                batch.append({
+                    'DeleteRequest': {
+                        'Key': self._key(item['Unique_ID'])
+                    }
+                })
+                if len(batch) < 25:
+                    continue
+                in_flight.acquire()
+                futures.append(executor.submit(delete_batch, batch))
+                batch = []
+                # Count the finished batches, which also surfaces a failed
+                # one early.
+                finished = [future for future in futures if future.done()]
+                for future in finished:
+                    removed += future.result()
+                futures = [future for future in futures
+                           if future not in finished]
+                if removed - reported >= 1000:
+                    print('{} items removed'.format(removed))
+                    reported = removed
+            if batch:
+                in_flight.acquire()
+                futures.append(executor.submit(delete_batch, batch))
+            for future in futures:
+                removed += future.result()
+        self._invalidate()
+        self.seen_keys.clear()
+        if self.top_view is not None:
+            self.top_view.clear()
+        print('removed {} items'.format(removed))
+        return removed
+
+    def recreate_table(self):
+        """ This will drop the table and create it again with the same keys,
+        indexes and billing mode, then wait for it to become active. This
+        empties a table with one call instead of one per item.
+
         Args: Null
 
-        Returns: Null
+        Returns: The new Table.
+        """
+        table = self.table
+        table.load()
+        kwargs = {
+            'TableName': self.table_id,
+            'KeySchema': table.key_schema,
+            'AttributeDefinitions': table.attribute_definitions
+        }
+        billing_mode = (table.billing_mode_summary or {}).get(
+            'BillingMode', 'PROVISIONED')
+        throughput = None
+        if billing_mode == 'PAY_PER_REQUEST':
+            kwargs['BillingMode'] = 'PAY_PER_REQUEST'
+        else:
+            throughput = {
+                'ReadCapacityUnits':
+                    table.provisioned_throughput['ReadCapacityUnits'],
+                'WriteCapacityUnits':
+                    table.provisioned_throughput['WriteCapacityUnits']
+            }
+            kwargs['ProvisionedThroughput'] = throughput
+        indexes = []
+        for index in table.global_secondary_indexes or []:
+            new_index = {
+                'IndexName': index['IndexName'],
+                'KeySchema': index['KeySchema'],
+                'Projection': index['Projection']
+            }
+            if throughput is not None:
+                new_index['ProvisionedThroughput'] = {
+                    'ReadCapacityUnits':
+                        index['ProvisionedThroughput']['ReadCapacityUnits'],
+                    'WriteCapacityUnits':
+                        index['ProvisionedThroughput']['WriteCapacityUnits']
+                }
+            indexes.append(new_index)
+        if indexes:
+            kwargs['GlobalSecondaryIndexes'] = indexes
+
+        print('Dropping {}.'.format(self.table_id))
+        table.delete()
+        table.wait_until_not_exists()
+        new_table = self.dynamodb.create_table(**kwargs)
+        new_table.wait_until_exists()
+        print('{} has been recreated.'.format(self.table_id))
+
+        # Every cached Table and the generation belong to the old table.
+        self.table = self.dynamodb.Table(self.table_id)
+        self._local = threading.local()
+        self._generation = None
+        self._invalidate()
+        self.seen_keys.clear()
+        if self.top_view is not None:
+            self.top_view.clear()
+        return self.table
+
+    def migrate_table(self, destination):
+        """ This will copy every item in this table into the destination
+        table, changing the keys to the layout the destination uses. This is
+        how an existing Unique_ID table is moved to the sharded layout:
+
+            old = DynamoDB('PoE_items')
+            create_item_table('PoE_items_v2', shards=16, top_index=True)
+            old.migrate_table(DynamoDB('PoE_items_v2', shards=16, top_index=True))
+
+        Args: The DynamoDB object for the destination table.
+
+        Returns: The number of items copied.
         """
-        items = []
         counter = 0
-        response = self.table.scan()
-        for item in response['Items']:
-            items.append(item['Unique_ID'])
-        while 'LastEvaluatedKey' in response:
-            last_key = response['LastEvaluatedKey']
-            response = self.table.scan(
-                ExclusiveStartKey=last_key,
-            )
-            for item in response['Items']:
-                items.append(item['Unique_ID'])
+        generation = self.current_generation() if self.epochs else None
+        new_generation = None
+        if destination.epochs:
+            new_generation = destination.current_generation()
+        with destination.table.batch_writer() as batch:
+            for item in self.scan_items():
+                counter += 1
+                item['quantity'] = self._live_quantity(item, generation)
+                item.pop(SHARD_KEY, None)
+                item.pop(RANKED_KEY, None)
+                item.pop(GENERATION_KEY, None)
+                item.update(destination._key(item['Unique_ID']))
+                if destination.epochs:
+                    item[GENERATION_KEY] = new_generation
+                if destination.top_index and item['quantity'] > 0:
+                    item[RANKED_KEY] = destination._ranked_id(
+                        item['Unique_ID'], new_generation)
+                batch.put_item(Item=item)
+                if counter % 1000 == 0:
+                    print('{} items copied.'.format(counter))
+        destination._invalidate()
+        print('{} items copied to {}.'.format(counter, destination.table_id))
+        return counter
+
+    def live_items(self, total_segments=None, max_workers=None):
+        """ This is scan_items() for copying the table out: every row with
+        just its Unique_ID, item, ilvl and the quantity get_item() would
+        return. The scan uses strongly consistent reads, so every write that
+        finished before a segment reached a row is in the copy.
+
+        The copy is not of one point in time, though. The segments read
+        their rows at different moments while writers keep going, so a row
+        written during the scan may or may not be in it, and the rows of one
+        page can be read from before and after that page was added. Stop the
+        writers first when an exact copy matters.
+
+        Args: The number of segments and threads, see scan_items().
+
+        Returns: A generator of the rows, in no set order.
+        """
+        generation = self.current_generation() if self.epochs else None
+        for item in self.scan_items(
+            total_segments,
+            max_workers,
+            ProjectionExpression="Unique_ID, #it, ilvl, quantity, #gen",
+            ExpressionAttributeNames={
+                "#it": "item",
+                "#gen": GENERATION_KEY
+            },
+            ConsistentRead=True
+        ):
+            item['quantity'] = self._live_quantity(item, generation)
+            item.pop(GENERATION_KEY, None)
+            yield item
+
+    @_timed('put_rows')
+    def put_rows(self, rows, max_workers=8):
+        """ This writes whole rows, setting their quantity rather than adding
+        to it, in 25 row BatchWriteItem calls on max_workers threads. The rows
+        are put in the layout this table uses, so rows from live_items() of
+        one table can be loaded into a table with shards or a Top_items index.
+        Every Unique_ID must only be in rows once.
+
+        Args: The rows, each a Dict with a Unique_ID, item, ilvl and
+        quantity, and the number of threads.
+
+        Returns: The number of rows written.
+        """
+        counter = 0
+        generation = self.current_generation() if self.epochs else None
+        in_flight = threading.BoundedSemaphore(2 * max_workers)
+
+        def write_batch(batch):
+            try:
+                self._batch_write(batch)
+            finally:
+                in_flight.release()
+
+        futures = []
+        with _thread_pool(max_workers=max_workers) as executor:
+            batch = []
+            for row in rows:
+                unique = row['Unique_ID']
+                quantity = decimal.Decimal(row['quantity'])
+                item = {
+                    "item": row['item'],
+                    "ilvl": decimal.Decimal(row['ilvl']),
+                    "quantity": quantity
+                }
+                item.update(self._key(unique))
+                if self.epochs:
+                    item[GENERATION_KEY] = generation
+                if self.top_index and quantity > 0:
+                    item[RANKED_KEY] = self._ranked_id(unique, generation)
+                batch.append({'PutRequest': {'Item': item}})
+                if self.top_view is not None:
+                    self.top_view.apply(unique, row['item'], row['ilvl'],
+                                        quantity)
+                if len(batch) == 25:
+                    in_flight.acquire()
+                    futures.append(executor.submit(write_batch, batch))
+                    batch = []
+                counter += 1
+                if counter % 10000 == 0:
+                    print('{} rows written.'.format(counter))
+                    # Surface a failed batch early and forget finished ones.
+                    finished = [future for future in futures if future.done()]
+                    for future in finished:
+                        future.result()
+                    futures = [future for future in futures
+                               if future not in finished]
+            if batch:
+                in_flight.acquire()
+                futures.append(executor.submit(write_batch, batch))
+        for future in futures:
+            future.result()
+        self._invalidate()
+        self.metrics.count('put_rows', 'items', counter)
+        print('{} rows written to {}.'.format(counter, self.table_id))
+        return counter
+
+
+class StashCounts():
+    """ A compact store for adding up stash quantities over many pages.
+    get_stash_quantities() keeps a Dict of Dicts with a Decimal for every
+    item, which costs a few hundred bytes per item. Here every item name is
+    interned and stored once, and each (item, ilvl) pair is one slot in three
+    arrays: the name number, the ilvl and a native int quantity. Decimals
+    are only made by to_dict(), where the quantities go to DynamoDB.
+    An ilvl has to fit in 16 bits (0 to 65535), which every real one does.
+
+    Pages are added with add_page() or add_stream(), and the counts of two
+    stores are merged with update(). A store pickles to the arrays and the
+    name list alone, so it is cheap to send back from a worker process.
 
-        number_of_items_remove = len(items)
-        print('removing {} items'.format(number_of_items_remove))
-        for Unique_ID in items:
-            counter += 1
-            response = self.table.delete_item(
-                Key={
-                    'Unique_ID': Unique_ID
-                },
-                ReturnValues="ALL_OLD"
+    Args: Null
+    """
+
+    def __init__(self):
+        self.names = []
+        self.name_ids = {}
+        self.slots = {}
+        self.name_of = array.array('I')
+        self.ilvls = array.array('H')
+        self.quantities = array.array('q')
+        self.seen = 0
+
+    def __len__(self):
+        return len(self.quantities)
+
+    def __getstate__(self):
+        return (self.names, self.name_of, self.ilvls, self.quantities,
+                self.seen)
+
+    def __setstate__(self, state):
+        (self.names, self.name_of, self.ilvls, self.quantities,
+         self.seen) = state
+        self.name_ids = {name: number for number, name in enumerate(self.names)}
+        self.slots = {(self.name_of[slot] << 16) | self.ilvls[slot]: slot
+                      for slot in range(len(self.quantities))}
+
+    def add(self, item, ilvl, quantity=1):
+        """ This adds to the quantity of one item.
+
+        Args: The name of the item, its ilvl and the quantity to add.
+
+        Returns: True if the item was not in the store yet.
+        """
+        ilvl = int(ilvl)
+        # The ilvl is packed into the low 16 bits of the slot key.
+        if not 0 <= ilvl <= MAX_ILVL:
+            raise ValueError('ilvl {} of {} is not between 0 and {}.'.format(
+                ilvl, item, MAX_ILVL))
+        number = self.name_ids.get(item)
+        if number is None:
+            number = len(self.names)
+            item = sys.intern(item)
+            self.names.append(item)
+            self.name_ids[item] = number
+        key = (number << 16) | ilvl
+        slot = self.slots.get(key)
+        if slot is None:
+            self.slots[key] = len(self.quantities)
+            self.name_of.append(number)
+            self.ilvls.append(ilvl)
+            self.quantities.append(quantity)
+            return True
+        self.quantities[slot] += quantity
+        return False
+
+    def add_page(self, item_list):
+        """ This adds one stash page with count_stash_items(), so it skips
+        the same rows that get_stash_quantities() skips.
+
+        Args: A JSON object that contains the current PoE API Tab.
+
+        Returns: The number of items on the page.
+        """
+        counter = count_stash_items(stash_item_pairs(item_list), self.add)
+        self.seen += counter
+        return counter
+
+    def add_stream(self, stream):
+        """ This is add_page() for a page that is still being read, see
+        StashStream.
+
+        Args: A file like object with the page.
+
+        Returns: The next_change_id and the number of items on the page.
+        """
+        page = StashStream(stream)
+        counter = count_stash_items(page.items(), self.add)
+        self.seen += counter
+        return page.next_change_id, counter
+
+    def update(self, other):
+        """ This adds the quantities of another StashCounts, or of a Dict
+        from get_stash_quantities(), to this one.
+
+        Args: The StashCounts or Dict to add.
+
+        Returns: Null
+        """
+        if isinstance(other, StashCounts):
+            names = other.names
+            for slot in range(len(other.quantities)):
+                self.add(names[other.name_of[slot]], other.ilvls[slot],
+                         other.quantities[slot])
+            self.seen += other.seen
+        else:
+            for entry in other.values():
+                self.add(entry['item'], entry['ilvl'], int(entry['quantity']))
+
+    def split(self, uniques):
+        """ This splits the store in two by Unique_ID, keeping the order
+        the items were added in.
+
+        Args: The Unique_IDs to split off.
+
+        Returns: A StashCounts with the items in uniques and one with the
+        rest.
+        """
+        uniques = set(uniques)
+        inside = StashCounts()
+        outside = StashCounts()
+        for unique, item, ilvl, quantity in self.rows():
+            if unique in uniques:
+                inside.add(item, ilvl, quantity)
+            else:
+                outside.add(item, ilvl, quantity)
+        return inside, outside
+
+    def rows(self):
+        """ This lists the stored items in the order they were first added.
+
+        Args: Null
+
+        Returns: A generator of (Unique_ID, item, ilvl, quantity) tuples,
+        with the quantity as an int.
+        """
+        names = self.names
+        for slot in range(len(self.quantities)):
+            item = names[self.name_of[slot]]
+            ilvl = self.ilvls[slot]
+            yield (create_unique_ilvl_str(ilvl, item), item, ilvl,
+                   self.quantities[slot])
+
+    def to_dict(self):
+        """ This makes the Dict that get_stash_quantities() returns, for code
+        that still wants it.
+
+        Args: Null
+
+        Returns: A Dict of Unique_ID to item, ilvl and Decimal quantity.
+        """
+        return {
+            unique: {
+                "ilvl": ilvl,
+                "item": item,
+                "quantity": decimal.Decimal(quantity)
+            }
+            for unique, item, ilvl, quantity in self.rows()
+        }
+
+    def top_items(self, number_of_items=20):
+        """ This is find_top_quantity() on the stored counts instead of the
+        table.
+
+        Args: The number of items wanted.
+
+        Returns: The list take_top_items() returns.
+        """
+        rows = sorted(
+            ({"Unique_ID": unique, "item": item, "ilvl": ilvl,
+              "quantity": quantity}
+             for unique, item, ilvl, quantity in self.rows()),
+            key=lambda row: row['Unique_ID'])
+        return take_top_items(rows, number_of_items)
+
+
+class QuantityBuffer():
+    """ This merges the quantities of many stash pages before they are
+    written, keyed by the Unique_ID from create_unique_ilvl_str(). An item
+    that shows up on every page is then written once per flush instead of
+    once per page. The quantities are kept in a StashCounts until they are
+    written.
+
+    The buffer is flushed by add() when it holds max_items distinct items,
+    when its oldest delta is max_age seconds old or when it is estimated to
+    use max_bytes of memory. Call flush() before shutting down.
+
+    Every flush seals the buffered deltas into a batch with its own write
+    token (see DynamoDB.bulk_update_table()). Rows of a batch that fail to
+    write stay in that batch with the same token, and are not merged with
+    newer deltas. A row only remembers the token of its last write, so while
+    a row is waiting to be sent again, newer batches hold their delta for
+    that row back until the older one has gone through. Sending a row again
+    then never counts it twice, as long as this buffer is the only writer
+    of its rows. A journal function can be given to save the sealed batches
+    somewhere durable before they are written. It is called again with
+    whatever is left once the writes are done.
+
+    add() only holds the lock while it merges, so it does not wait for a
+    flush that another thread is writing. Flushes run one at a time.
+
+    Args: The DynamoDB object to write to, the flush thresholds, the number
+    of writer threads and an optional journal function.
+    """
+
+    # A rough size in bytes of one buffered item, for the max_bytes limit.
+    entry_bytes = 120
+
+    # Seconds to wait before sending failed rows again.
+    retry_interval = 5.0
+
+    def __init__(self, db, max_items=50000, max_age=60.0,
+                 max_bytes=64 * 1024 * 1024, max_workers=8, journal=None):
+        self.db = db
+        self.max_items = max_items
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.journal = journal
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()
+        self.pending = StashCounts()
+        self.pending_bytes = 0
+        self.oldest = None
+        self.batches = []
+        self.last_flush = 0.0
+        self.token_prefix = '{}-{}'.format(os.getpid(), int(time.time() * 1000))
+        self.sealed = 0
+        self.stats = {
+            "deltas": 0,
+            "flushes": 0,
+            "writes": 0,
+            "skipped": 0,
+            "failed": 0
+        }
+
+    def add(self, unique_items):
+        """ This merges the quantities from one page into the buffer and
+        flushes it if a threshold has been reached.
+
+        Args: The Dict from get_stash_quantities() or a StashCounts.
+
+        Returns: The summary of the flush, or None if it did not flush.
+        """
+        with self.lock:
+            before = len(self.pending)
+            self.pending.update(unique_items)
+            self.stats['deltas'] += len(unique_items)
+            self.pending_bytes += (len(self.pending) - before) * self.entry_bytes
+            if self.oldest is None and self.pending:
+                self.oldest = time.monotonic()
+        # A flush that is already running writes everything that is due.
+        if not self.flush_lock.locked() and self.due():
+            return self.flush()
+        return None
+
+    def due(self):
+        """ This checks the flush thresholds.
+
+        Args: Null
+
+        Returns: True if the buffer should be flushed.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.batches and now - self.last_flush >= self.retry_interval:
+                return True
+            if not self.pending:
+                return False
+            return (len(self.pending) >= self.max_items or
+                    self.pending_bytes >= self.max_bytes or
+                    now - self.oldest >= self.max_age)
+
+    def restore(self, batches):
+        """ This puts back batches saved by the journal, so they are sent
+        again, with their own tokens, by the next flush.
+
+        Args: A list of [token, unique_items] pairs.
+
+        Returns: Null
+        """
+        with self.lock:
+            for token, items in batches:
+                counts = StashCounts()
+                counts.update(items)
+                self.batches.append([token, counts])
+
+    def _journal(self, batches):
+        # The journal gets the batches as [token, unique_items] pairs with
+        # int quantities, which is what restore() takes back.
+        if self.journal is not None:
+            self.journal([
+                [token, {unique: {"ilvl": ilvl, "item": item,
+                                  "quantity": quantity}
+                         for unique, item, ilvl, quantity in items.rows()}]
+                for token, items in batches])
+
+    def flush(self):
+        """ This seals the buffered deltas into a batch and writes every
+        batch that has not been written yet, oldest first. A row that an
+        older batch still has to send again is held back in the newer
+        batches, see the class docstring.
+
+        Args: Null
+
+        Returns: A Dict with the writes, skipped rows, the Unique_IDs that are
+        still waiting to be written and the number of deltas merged away:
+        {
+            "writes": writes,
+            "skipped": skipped,
+            "failed": [Unique_ID],
+            "coalesced": coalesced
+        }
+        """
+        with self.flush_lock:
+            with self.lock:
+                coalesced = 0
+                if self.pending:
+                    self.sealed += 1
+                    token = '{}-{}'.format(self.token_prefix, self.sealed)
+                    coalesced = self.stats['deltas'] - len(self.pending)
+                    self.stats['deltas'] = 0
+                    self.batches.append([token, self.pending])
+                    self.pending = StashCounts()
+                    self.pending_bytes = 0
+                    self.oldest = None
+                batches = list(self.batches)
+                self._journal(batches)
+
+            # The writes are made without the lock, so add() can go on.
+            summary = {
+                "writes": 0,
+                "skipped": 0,
+                "failed": [],
+                "coalesced": coalesced
+            }
+            remaining = []
+            waiting = set()
+            for token, items in batches:
+                held, ready = items.split(waiting)
+                result = {"writes": 0, "skipped": 0, "failed": []}
+                if ready:
+                    result = self.db.update_table(
+                        ready, bulk=True, max_workers=self.max_workers,
+                        token=token)
+                summary['writes'] += result['writes']
+                summary['skipped'] += result['skipped']
+                if result['failed']:
+                    summary['failed'].extend(result['failed'])
+                    held.update(ready.split(result['failed'])[0])
+                    waiting.update(result['failed'])
+                if held:
+                    remaining.append([token, held])
+
+            with self.lock:
+                # restore() may have added batches while the writes ran.
+                self.batches = remaining + self.batches[len(batches):]
+                self.last_flush = time.monotonic()
+                self._journal(self.batches)
+
+                self.stats['flushes'] += 1
+                self.stats['writes'] += summary['writes']
+                self.stats['skipped'] += summary['skipped']
+                self.stats['failed'] = len(summary['failed'])
+            print('Flushed {} writes, {} deltas merged, {} waiting to be sent again.'.format(
+                summary['writes'], coalesced, len(summary['failed'])
+            )
             )
-            if counter % 100 == 0:
-                print('{} items left'.format(number_of_items_remove - counter))
+            return summary
 
 
 # These are the helper functions for the all the classes called here. These are
@@ -455,6 +3108,640 @@ def create_unique_ilvl_str(ilvl, item):
     return unique_ID
 
 
+def encode_cursor(unique_id):
+    """ This turns the last Unique_ID of a find_top_page() page into the
+    cursor for the next page. It is URL safe, so it can be passed straight
+    back as a query string parameter.
+
+    Args: The Unique_ID.
+
+    Returns: The cursor string.
+    """
+    return base64.urlsafe_b64encode(
+        unique_id.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ This turns a find_top_page() cursor back into its Unique_ID.
+
+    Args: The cursor string.
+
+    Returns: The Unique_ID. Raises ValueError if it is not a cursor.
+    """
+    cursor = cursor + '=' * (-len(cursor) % 4)
+    return base64.b64decode(cursor.encode('ascii'), altchars=b'-_',
+                            validate=True).decode('utf-8')
+
+
+def _page_size(page_size):
+    # The page size find_top_page() uses, or None if it is not a number.
+    try:
+        return max(1, min(int(page_size), TOP_PAGE_LIMIT))
+    except (TypeError, ValueError):
+        return None
+
+
+def _plain_numbers(values):
+    # Decimal to int, or to float when it has a fraction, for a whole column.
+    # Anything else is left as it is, like DecimalEncoder does.
+    plain = []
+    for value in values:
+        if isinstance(value, decimal.Decimal):
+            whole = int(value)
+            plain.append(whole if whole == value else float(value))
+        else:
+            plain.append(value)
+    return plain
+
+
+def encode_top_page(page):
+    """ This encodes a page from find_top_page() as compact JSON. The
+    ilvl and quantity Decimals are converted a column at a time before
+    encoding, so json can use its C encoder for the whole page instead of
+    calling DecimalEncoder.default() for every value.
+
+    Args: The Dict from find_top_page().
+
+    Returns: The JSON body as UTF-8 bytes.
+    """
+    items = page.get('items')
+    if items is None:
+        return json.dumps(page, cls=DecimalEncoder).encode('utf-8')
+    ilvls = _plain_numbers([row['ilvl'] for row in items])
+    quantities = _plain_numbers([row['quantity'] for row in items])
+    body = {
+        "items": [{
+            "item": row['item'],
+            "ilvl": ilvl,
+            "quantity": quantity
+        } for row, ilvl, quantity in zip(items, ilvls, quantities)],
+        "cursor": page['cursor']
+    }
+    return json.dumps(body, separators=(',', ':')).encode('utf-8')
+
+
+# The User-Agent load_url() has always sent.
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.3'
+
+# HTTP statuses that are worth retrying after a wait.
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class _GzipReader():
+    # Decompresses a gzip response as it is read.
+
+    def __init__(self, response):
+        self.response = response
+        self.inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.pending = b''
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        while size < 0 or len(self.pending) < size:
+            chunk = self.response.read(65536)
+            if not chunk:
+                self.pending += self.inflate.flush()
+                break
+            self.pending += self.inflate.decompress(chunk)
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+class StashResponse():
+    """ The body of a StashClient request. It is read like a file, and the
+    connection goes back to the pool when it is closed after being read to
+    the end. Use it with a with statement.
+    """
+
+    def __init__(self, client, key, connection, response, started):
+        self.client = client
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.status = response.status
+        self.headers = response.headers
+        self.started = started
+        self.bytes = 0
+        self.body = response
+        if (response.getheader('Content-Encoding') or '').lower() == 'gzip':
+            self.body = _GzipReader(response)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.body.read()
+        else:
+            data = self.body.read(size)
+        self.bytes += len(data)
+        return data
+
+    def close(self):
+        if self.connection is None:
+            return
+        reusable = self.response.isclosed() and not self.response.will_close
+        self.response.close()
+        self.client._release(self.key, self.connection, reusable)
+        self.client._record(self.started, self.bytes)
+        self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+class StashClient():
+    """ A small HTTP client for the public stash API that keeps connections
+    open between pages, asks for gzip and decompresses it as it is read.
+    It waits as long as a 429 or 503 response says with Retry-After, backs
+    off on other server errors, and slows down before the API has to throttle
+    it by reading the X-Rate-Limit-<rule> and X-Rate-Limit-<rule>-State
+    headers, which list "hits:period:penalty" per rule. No wait is longer
+    than max_wait seconds, whatever the headers say. It is thread safe.
+
+    Args: The User-Agent, the timeout in seconds, the number of idle
+    connections to keep per host, the number of retries, the share of a
+    rate limit to use before spacing the requests out and the longest wait
+    in seconds.
+    """
+
+    def __init__(self, user_agent=DEFAULT_USER_AGENT, timeout=30.0,
+                 pool_size=4, max_retries=5, headroom=0.75, max_wait=300.0):
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.headroom = headroom
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.pools = {}
+        self.next_request = 0.0
+        self.counts = {
+            "requests": 0,
+            "retries": 0,
+            "bytes": 0,
+            "seconds": 0.0,
+            "connections": 0
+        }
+        self.latencies = deque(maxlen=1000)
+
+    def _acquire(self, key):
+        with self.lock:
+            pool = self.pools.setdefault(key, [])
+            if pool:
+                return pool.pop()
+            self.counts['connections'] += 1
+        import http.client
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _release(self, key, connection, reusable):
+        with self.lock:
+            pool = self.pools.setdefault(key, [])
+            if reusable and len(pool) < self.pool_size:
+                pool.append(connection)
+                return
+        connection.close()
+
+    def _record(self, started, size):
+        seconds = time.monotonic() - started
+        with self.lock:
+            self.counts['requests'] += 1
+            self.counts['bytes'] += size
+            self.counts['seconds'] += seconds
+            self.latencies.append(seconds)
+
+    def _wait_turn(self):
+        with self.lock:
+            wait = self.next_request - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _pace(self, headers):
+        # Spread the requests out when a rate limit rule is getting close.
+        delay = 0.0
+        rules = headers.get('X-Rate-Limit-Rules') or ''
+        for rule in filter(None, (part.strip() for part in rules.split(','))):
+            limits = headers.get('X-Rate-Limit-{}'.format(rule)) or ''
+            states = headers.get('X-Rate-Limit-{}-State'.format(rule)) or ''
+            for limit, state in zip(limits.split(','), states.split(',')):
+                try:
+                    hits, period, _ = (float(part) for part in limit.split(':'))
+                    current, _, restricted = (float(part)
+                                              for part in state.split(':'))
+                except ValueError:
+                    continue
+                if restricted > 0:
+                    delay = max(delay, restricted)
+                elif hits and current >= hits * self.headroom:
+                    delay = max(delay, period / hits)
+        delay = min(delay, self.max_wait)
+        if delay:
+            with self.lock:
+                self.next_request = max(self.next_request,
+                                        time.monotonic() + delay)
+
+    def _retry_after(self, headers, retries):
+        # Retry-After is either seconds or an HTTP date. Anything else falls
+        # back to the jittered backoff. The wait is capped at max_wait.
+        value = headers.get('Retry-After')
+        if value:
+            try:
+                return min(max(0.0, float(value)), self.max_wait)
+            except ValueError:
+                pass
+            import datetime
+            import email.utils
+            try:
+                parsed = email.utils.parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                parsed = None
+            if parsed is not None:
+                if parsed.tzinfo is None:
+                    parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+                return min(max(0.0, parsed.timestamp() - time.time()),
+                           self.max_wait)
+        return random.uniform(0, min(30.0, self.max_wait, 0.5 * 2 ** retries))
+
+    def open(self, url, headers=None):
+        """ This sends a GET request and returns the response before its
+        body has been read.
+
+        Args: The URL and any extra headers.
+
+        Returns: A StashResponse.
+        """
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname,
+               parts.port or (443 if parts.scheme == 'https' else 80))
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        request_headers = {
+            'User-Agent': self.user_agent,
+            'Accept-Encoding': 'gzip',
+            'Connection': 'keep-alive'
+        }
+        request_headers.update(headers or {})
+        import http.client
+
+        retries = 0
+        while True:
+            self._wait_turn()
+            connection = self._acquire(key)
+            started = time.monotonic()
+            try:
+                connection.request('GET', path, headers=request_headers)
+                response = connection.getresponse()
+            except (http.client.HTTPException, OSError):
+                # Most often a kept alive connection the server has closed.
+                connection.close()
+                if retries >= self.max_retries:
+                    raise
+                retries += 1
+                with self.lock:
+                    self.counts['retries'] += 1
+                if retries > 1:
+                    time.sleep(random.uniform(0, min(30.0, 0.5 * 2 ** retries)))
+                continue
+
+            self._pace(response.headers)
+            result = StashResponse(self, key, connection, response, started)
+            if 200 <= response.status < 300:
+                return result
+            error_body = result.read()
+            result.close()
+            if response.status in RETRYABLE_STATUS and \
+                    retries < self.max_retries:
+                wait = self._retry_after(response.headers, retries)
+                retries += 1
+                with self.lock:
+                    self.counts['retries'] += 1
+                    self.next_request = max(self.next_request,
+                                            time.monotonic() + wait)
+                continue
+            from urllib.error import HTTPError
+            raise HTTPError(url, response.status, response.reason,
+                            response.headers, io.BytesIO(error_body))
+
+    def get(self, url, headers=None):
+        """ This reads a whole response body.
+
+        Args: The URL and any extra headers.
+
+        Returns: The decompressed body as bytes.
+        """
+        with self.open(url, headers) as response:
+            return response.read()
+
+    def stats(self):
+        """ This reports the requests made so far.
+
+        Args: Null
+
+        Returns: A Dict with the number of requests, retries and new
+        connections, the bytes read, the bytes per second while reading and
+        the p50/p99 latency in seconds of the recent requests.
+        """
+        with self.lock:
+            stats = dict(self.counts)
+            latencies = sorted(self.latencies)
+        stats['bytes_per_sec'] = (stats['bytes'] / stats['seconds']
+                                  if stats['seconds'] else 0.0)
+        for name, fraction in (('p50', 0.50), ('p99', 0.99)):
+            stats[name] = None
+            if latencies:
+                stats[name] = latencies[min(len(latencies) - 1,
+                                            int(fraction * len(latencies)))]
+        return stats
+
+    def close(self):
+        with self.lock:
+            pools, self.pools = self.pools, {}
+        for pool in pools.values():
+            for connection in pool:
+                connection.close()
+
+
+_stash_client = None
+_stash_client_lock = threading.Lock()
+
+
+def stash_client():
+    """ This is the StashClient shared by get_PoE_stash() and
+    get_next_stash(), made the first time it is needed.
+
+    Args: Null
+
+    Returns: The StashClient.
+    """
+    global _stash_client
+    client = _stash_client
+    if client is None:
+        with _stash_client_lock:
+            client = _stash_client
+            if client is None:
+                client = _stash_client = StashClient()
+    return client
+
+
+class _JSONScanner():
+    # Reads a JSON document from a stream a chunk at a time. Containers can
+    # be stepped into one token at a time and any value can be decoded
+    # whole with raw_decode() once enough of it has been read.
+
+    decoder = json.JSONDecoder()
+
+    def __init__(self, stream, chunk_size=65536):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            text = self.text.decode(b'', final=True)
+        elif isinstance(chunk, str):
+            text = chunk
+        else:
+            text = self.text.decode(chunk)
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and \
+                    self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def take(self, expected):
+        char = self.peek()
+        if char not in expected:
+            raise ValueError('Expected {} at {!r} in the stash page.'.format(
+                ' or '.join(expected), self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may go on in the next chunk.
+            if end == len(self.buffer) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        # Yields the keys of an object, the caller has to read each value.
+        self.take('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.take(':')
+            yield key
+            if self.take(',}') == '}':
+                return
+
+    def elements(self):
+        # Yields once per element of an array, the caller reads the element.
+        self.take('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.take(',]') == ']':
+                return
+
+
+class StashStream():
+    """ This parses a page of the public stash API straight from the HTTP
+    response (or any binary file) without building the whole JSON object.
+    Only one item is decoded at a time, so the memory used does not grow
+    with the size of the page, and the items can be counted while the rest
+    of the page is still downloading.
+
+    Args: A file like object with read() and the size of the chunks to read.
+    """
+
+    def __init__(self, stream, chunk_size=65536):
+        self.scanner = _JSONScanner(stream, chunk_size)
+        self.next_change_id = None
+
+    def items(self):
+        """ This walks stashes[].items[] and yields the fields that
+        get_stash_quantities() uses. next_change_id is set as soon as it has
+        been read, which is before the stashes in the public API.
+
+        Args: Null
+
+        Returns: A generator of (name, ilvl) for every item.
+        """
+        scanner = self.scanner
+        for key in scanner.members():
+            if key == 'next_change_id':
+                self.next_change_id = scanner.value()
+            elif key == 'stashes' and scanner.peek() == '[':
+                for _ in scanner.elements():
+                    if scanner.peek() != '{':
+                        scanner.value()
+                        continue
+                    for stash_key in scanner.members():
+                        if stash_key == 'items' and scanner.peek() == '[':
+                            for _ in scanner.elements():
+                                row = scanner.value()
+                                yield row.get('name', ''), row.get('ilvl', '')
+                        else:
+                            scanner.value()
+            else:
+                scanner.value()
+
+
+@functools.lru_cache(maxsize=4096)
+def _lookup_key(item, ilvl):
+    """ This is url_decode() and create_unique_ilvl_str() for a lookup,
+    memoised because API calls ask for the same items over and over.
+
+    Args: The item as it was passed to the API and its ilvl.
+
+    Returns: The decoded item and its Unique_ID.
+    """
+    item = url_decode(item)
+    return item, create_unique_ilvl_str(ilvl, item)
+
+
+def create_item_table(table_name, shards=None, top_index=False, resource=None):
+    """ This will create an item table and wait for it to become active.
+    Without shards it is the original layout, with Unique_ID as the only
+    key. With shards the partition key is a Shard number (see shard_of())
+    and Unique_ID is the sort key, so every shard keeps its items in reverse
+    ilvl order and the top items can be read with a Query instead of a full
+    scan. top_index adds the sparse Top_items index that only holds items
+    with quantity > 0.
+
+    Args: The name of the new table, the number of shards, if the
+    Top_items index should be created and an optional resource to use in
+    place of shared_resource().
+
+    Returns: The new Table.
+    """
+    key_schema = [{'AttributeName': 'Unique_ID', 'KeyType': 'HASH'}]
+    attributes = [{'AttributeName': 'Unique_ID', 'AttributeType': 'S'}]
+    kwargs = {}
+    if shards:
+        key_schema = [
+            {'AttributeName': SHARD_KEY, 'KeyType': 'HASH'},
+            {'AttributeName': 'Unique_ID', 'KeyType': 'RANGE'}
+        ]
+        attributes.append({'AttributeName': SHARD_KEY, 'AttributeType': 'N'})
+        if top_index:
+            attributes.append(
+                {'AttributeName': RANKED_KEY, 'AttributeType': 'S'})
+            kwargs['GlobalSecondaryIndexes'] = [{
+                'IndexName': TOP_INDEX,
+                'KeySchema': [
+                    {'AttributeName': SHARD_KEY, 'KeyType': 'HASH'},
+                    {'AttributeName': RANKED_KEY, 'KeyType': 'RANGE'}
+                ],
+                'Projection': {
+                    'ProjectionType': 'INCLUDE',
+                    'NonKeyAttributes': ['item', 'ilvl', 'quantity']
+                }
+            }]
+
+    if resource is None:
+        resource = shared_resource()
+    table = resource.create_table(
+        TableName=table_name,
+        KeySchema=key_schema,
+        AttributeDefinitions=attributes,
+        BillingMode='PAY_PER_REQUEST',
+        **kwargs
+    )
+    table.wait_until_exists()
+    return table
+
+
+def shard_of(unique_id, shards):
+    """ This picks the shard for a Unique_ID in the sharded layout. It uses
+    crc32 so that every process agrees on the shard.
+
+    Args: The Unique_ID and the number of shards.
+
+    Returns: The shard number.
+    """
+    return zlib.crc32(unique_id.encode('utf-8')) % shards
+
+
+def take_top_items(sorted_rows, number_of_items, verbose=False):
+    """ This will walk rows that are already in Unique_ID order (highest
+    ilvl first) and keep the ones with a quantity until either the count or
+    the total quantity reaches number_of_items. This is the cut off that
+    find_top_quantity() uses.
+
+    Args: The rows in Unique_ID order, each with an item, ilvl and quantity,
+    the number of items wanted and if every row should be printed.
+
+    Returns: A list of the form:
+    [
+        {
+        "item": item,
+        "ilvl": ilvl,
+        "quantity": quantity
+        }
+    ]
+    """
+    counter = 0
+    total = 0
+    json_list = []
+
+    for row in sorted_rows:
+        if row['quantity'] > 0:
+            total += int(row['quantity'])
+            counter += 1
+            json_list.append({
+                'item': row['item'],
+                'ilvl': row['ilvl'],
+                'quantity': row['quantity']
+            })
+            if verbose:
+                print("name: {},\t\t ilvl: {},\t quantity: {}".format(
+                    row['item'],
+                    row['ilvl'],
+                    row['quantity']
+                )
+                )
+        if total >= number_of_items or counter >= number_of_items:
+            break
+    return json_list
+
+
 def url_decode(string):
     """ This is used to decode the resources passed through the event. 
     We need to use this as any resource passed will not be able to use
@@ -468,20 +3755,33 @@ def url_decode(string):
     return urllib.parse.unquote(encoded_string)
 
 
-def load_url(url):
-    """ This will take an input of a http and create a false header to get
-        around the Forbiddin error and load the API.
+def open_url(url):
+    """ This will open a http with the same header as load_url() without
+        reading it, so the body can be read as it arrives.
 
         Args: A HTTP.
 
-        Returns: An API.
+        Returns: The response, a file like object.
     """
+    from urllib.request import urlopen, Request
     headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.3'
+        'User-Agent': DEFAULT_USER_AGENT
     }
     reg_url = url
     req = Request(url=reg_url, headers=headers)
-    html = urlopen(req).read()
+    return urlopen(req)
+
+
+def load_url(url):
+    """ This will take an input of a http and create a false header to get
+        around the Forbiddin error and load the API.
+
+        Args: A HTTP.
+
+        Returns: An API.
+    """
+    with open_url(url) as response:
+        html = response.read()
     return html
 
 
@@ -505,7 +3805,7 @@ def get_PoE_stash():
 
     Returns: The JSON object for the first PoE Tab.
     """
-    stash_api = load_url(
+    stash_api = stash_client().get(
         "https://www.pathofexile.com/api/public-stash-tabs?id=0"
     )
     return load_JSON(stash_api)
@@ -519,7 +3819,7 @@ def get_next_stash(next_id):
 
     Returns: The stash in JSON format.
     """
-    stash_api = load_url(
+    stash_api = stash_client().get(
         "https://www.pathofexile.com/api/public-stash-tabs?id={}".format(
             next_id)
     )
@@ -537,43 +3837,95 @@ def get_next_id(object):
     return object['next_change_id']
 
 
-def get_stash_quantities(item_list):
+def stash_item_pairs(item_list):
+    """ This walks stashes[].items[] of a page that has already been loaded,
+    the same way StashStream.items() walks a page that is still being read.
+
+    Args: A JSON object that contains the current PoE API Tab.
+
+    Returns: A generator of (name, ilvl) for every item.
+    """
+    for stash in item_list['stashes']:
+        for row in stash['items']:
+            yield row['name'], row['ilvl']
+
+
+def count_stash_items(pairs, add, verbose=False):
+    """ This holds the rules every stash count follows: items without a name
+    or an ilvl are skipped and every other item adds one to its (name, ilvl).
+    get_stash_quantities(), get_stash_quantities_stream() and StashCounts
+    only differ in where the counts are kept, which is the add function.
+
+    Args: The (name, ilvl) of every item, a function that adds one item and
+    returns True if it was not counted before, and if the progress should be
+    printed every 100 items.
+
+    Returns: The number of items, skipped ones included.
+    """
+    counter = 0
+    counter_unique = 0
+
+    for name, ilvl in pairs:
+        counter += 1
+        if name != '' and ilvl != '':
+            if add(name, ilvl):
+                counter_unique += 1
+
+        if verbose and counter % 100 == 0:
+            print(
+                "{} have been added to Unique_items of {} total items.".format(
+                    counter_unique, counter)
+            )
+    return counter
+
+
+def _quantity_adder(unique_items):
+    # The add function for count_stash_items() that fills the Dict
+    # get_stash_quantities() returns.
+    def add(name, ilvl):
+        unique_ = create_unique_ilvl_str(ilvl, name)
+        if unique_ in unique_items:
+            unique_items[unique_]['quantity'] += 1
+            return False
+        unique_items[unique_] = {
+            "ilvl": ilvl,
+            "item": name,
+            "quantity": decimal.Decimal(1)
+        }
+        return True
+    return add
+
+
+def get_stash_quantities(item_list, verbose=False):
     """ This will be used to get the unique ids for the PoE API stash that is 
     passed as an argument for this function. This is used to avoid to much 
     read/write for a DynamoDB table. This will only process one tab at a time
 
-    Args: A JSON object that contains the current PoE API Tab.
+    Args: A JSON object that contains the current PoE API Tab, and if the
+    progress should be printed every 100 items.
 
     Returns: A Dict that contains the Unique_ID (as the primary key), item, ilvl
     and quantity.
     """
-    # Variables for the totals for prints.
-    counter = 0
-    counter_unique = 0
     unique_items = {}
+    count_stash_items(stash_item_pairs(item_list),
+                      _quantity_adder(unique_items), verbose)
+    return unique_items
 
-    for stash in item_list['stashes']:
-        for row in stash['items']:
-            counter += 1
 
-            if row['name'] != '' and row['ilvl'] != '':
-                unique_ = create_unique_ilvl_str(row['ilvl'], row['name'])
-                level_ = row['ilvl']
-                item_ = row['name']
+def get_stash_quantities_stream(stream, verbose=False):
+    """ This is get_stash_quantities() for a page that is still being read,
+    see StashStream. The quantities are added up item by item as the page
+    comes in.
 
-                if unique_ in unique_items:
-                    unique_items[unique_]['quantity'] += 1
-                else:
-                    counter_unique += 1
-                    unique_items[unique_] = {
-                        "ilvl": level_,
-                        "item": item_,
-                        "quantity": decimal.Decimal(1)
-                    }
+    Args: A file like object with the page, like the response from
+    open_url(), and if the progress should be printed every 100 items.
 
-            if counter % 100 == 0:
-                print(
-                    "{} have been added to Unique_items of {} total items.".format(
-                        counter_unique, counter)
-                )
-    return unique_items
+    Returns: The Dict from get_stash_quantities(), the next_change_id and
+    the number of items on the page.
+    """
+    unique_items = {}
+    page = StashStream(stream)
+    counter = count_stash_items(page.items(), _quantity_adder(unique_items),
+                                verbose)
+    return unique_items, page.next_change_id, counter
@@ -0,0 +1,517 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+from AWS_Classes import (
+    DynamoDB,
+    create_item_table,
+    get_stash_quantities
+)
+from Local_Backends import MemoryResource, SQLiteResource
+
+
+# The paths that can be benchmarked, in the order they are run.
+PATHS = (
+    'get_stash_quantities',
+    'upload_stash',
+    'update_table',
+    'update_table_bulk',
+    'find_top_quantity',
+    'reset_table'
+)
+
+# Table operations that are timed and counted by LatencyResource.
+OPERATIONS = (
+    'get_item',
+    'put_item',
+    'update_item',
+    'delete_item',
+    'scan',
+    'query',
+    'batch_write_item',
+    'batch_get_item'
+)
+
+
+def make_pages(pages=10, stashes=50, items=20, names=2000, min_ilvl=60,
+               max_ilvl=100, skew=1.1, seed=0):
+    """ This will make synthetic pages in the shape of the public stash API.
+    Item names are picked with a Zipf like skew, so a few items show up in
+    most stashes like they do in the real API, and about one item in ten has
+    no name, like currency does.
+
+    Args: The number of pages, stashes per page, items per stash, distinct
+    item names, the ilvl range, the skew of the name distribution and the
+    random seed.
+
+    Returns: A list of pages, each a JSON object like get_next_stash()
+    returns.
+    """
+    generator = random.Random(seed)
+    item_names = ['Synthetic Item {}'.format(number) for number in range(names)]
+    weights = [1.0 / (rank + 1) ** skew for rank in range(names)]
+    result = []
+    for page_number in range(pages):
+        page_stashes = []
+        for stash_number in range(stashes):
+            rows = []
+            chosen = generator.choices(item_names, weights, k=items)
+            for name in chosen:
+                if generator.random() < 0.1:
+                    name = ''
+                rows.append({
+                    'id': '{:016x}'.format(generator.getrandbits(64)),
+                    'name': name,
+                    'typeLine': 'Synthetic Base',
+                    'ilvl': generator.randint(min_ilvl, max_ilvl),
+                    'frameType': 3 if name else 5
+                })
+            page_stashes.append({
+                'id': '{:016x}'.format(generator.getrandbits(64)),
+                'public': True,
+                'accountName': 'account{}'.format(stash_number),
+                'stash': 'Stash {}'.format(stash_number),
+                'stashType': 'PremiumStash',
+                'league': 'Standard',
+                'items': rows
+            })
+        result.append({
+            'next_change_id': '{}-{}'.format(seed, page_number + 1),
+            'stashes': page_stashes
+        })
+    return result
+
+
+def percentile(values, fraction):
+    """ This is the nearest rank percentile of a list of numbers.
+
+    Args: The values and the percentile as a fraction (0.99 for p99).
+
+    Returns: The percentile, or None for an empty list.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1,
+                       int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class Recorder():
+    """ This collects the latency of every table request, grouped by the
+    logical operation (the benchmark path) that was running when it was
+    made.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phase = None
+        self.requests = {}
+
+    def record(self, operation, seconds):
+        with self.lock:
+            phase = self.requests.setdefault(self.phase, {})
+            phase.setdefault(operation, []).append(seconds)
+
+    def summary(self, phase):
+        """ This summarises the requests made during one phase.
+
+        Args: The name of the phase.
+
+        Returns: A Dict of operation to {"count", "p50_ms", "p99_ms"}.
+        """
+        with self.lock:
+            requests = dict(self.requests.get(phase, {}))
+        return {
+            operation: {
+                "count": len(latencies),
+                "p50_ms": percentile(latencies, 0.50) * 1000.0,
+                "p99_ms": percentile(latencies, 0.99) * 1000.0
+            }
+            for operation, latencies in sorted(requests.items())
+        }
+
+
+class _Timed():
+    # Wraps a table or resource and sleeps/records around every operation.
+
+    def __init__(self, target, owner):
+        self._target = target
+        self._owner = owner
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if name not in OPERATIONS:
+            return attribute
+        owner = self._owner
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            owner.wait()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                owner.recorder.record(name, time.perf_counter() - started)
+        return timed
+
+
+class LatencyResource(_Timed):
+    """ A local resource that adds a network like delay to every request and
+    records how long each one took.
+
+    Args: The resource to wrap (a MemoryResource or SQLiteResource), the
+    Recorder, the latency in seconds and the random jitter added to it.
+    """
+
+    def __init__(self, target, recorder, latency=0.0, jitter=0.0, seed=0):
+        super(LatencyResource, self).__init__(target, self)
+        self.recorder = recorder
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+
+    def wait(self):
+        delay = self.latency
+        if self.jitter:
+            delay += self._random.uniform(0.0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def Table(self, name):
+        return _Timed(self._target.Table(name), self)
+
+    def create_table(self, **kwargs):
+        return _Timed(self._target.create_table(**kwargs), self)
+
+
+class _Quiet():
+    # Sends the per item prints of the class nowhere while a path runs.
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        self.devnull = open(os.devnull, 'w')
+        sys.stdout = self.devnull
+        return self
+
+    def __exit__(self, *exc_info):
+        sys.stdout = self.stdout
+        self.devnull.close()
+        return False
+
+
+def run_benchmark(pages, paths=PATHS, backend='memory', sqlite_path=':memory:',
+                  latency=0.0, jitter=0.0, max_workers=8, top=20, shards=None,
+                  epochs=False, seed=0, memory=False):
+    """ This runs every path in paths against a fresh local table and
+    measures it.
+
+    With memory=True every path is also traced with tracemalloc, and
+    peak_alloc is the most memory Python had allocated at once while that
+    path ran, counting only the allocations made after it started (by any
+    thread). The peak RSS of the process can not tell the paths apart,
+    since it never goes down. Tracing
+    makes every path a lot slower, so the times of such a run are not
+    comparable with a normal one.
+
+    Args: The pages from make_pages(), the paths to run, the backend
+    ('memory' or 'sqlite') and its path, the injected latency and jitter in
+    seconds, the number of bulk writer threads, the number of top items,
+    the sharded layout and epoch mode options, the random seed and if the
+    memory of every path should be traced.
+
+    Returns: A Dict with a result per path of the form:
+    {
+        "seconds": seconds,
+        "items": items,
+        "items_per_sec": items_per_sec,
+        "calls": calls,
+        "call_p50_ms": p50,
+        "call_p99_ms": p99,
+        "requests": {operation: {"count", "p50_ms", "p99_ms"}},
+        "peak_alloc": bytes (None without memory=True),
+        "error": None or the error message
+    }
+    """
+    if backend == 'sqlite':
+        local = SQLiteResource(sqlite_path)
+    else:
+        local = MemoryResource()
+    recorder = Recorder()
+    resource = LatencyResource(local, recorder, latency, jitter, seed)
+    table_name = 'Benchmark_items_{}'.format(seed)
+    if shards:
+        create_item_table(table_name, shards=shards, top_index=True,
+                          resource=resource)
+    db = DynamoDB(table_name, shards=shards, top_index=bool(shards),
+                  epochs=epochs, resource=resource)
+
+    quantities = []
+    rows = sum(len(stash['items']) for page in pages
+               for stash in page['stashes'])
+    results = {}
+    for path in paths:
+        recorder.phase = path
+        calls = []
+        items = rows
+        error = None
+        if memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            with _Quiet():
+                if path == 'get_stash_quantities':
+                    quantities = []
+                    for page in pages:
+                        call = time.perf_counter()
+                        quantities.append(get_stash_quantities(page))
+                        calls.append(time.perf_counter() - call)
+                elif path == 'upload_stash':
+                    for page in pages:
+                        call = time.perf_counter()
+                        db.upload_stash(page)
+                        calls.append(time.perf_counter() - call)
+                elif path in ('update_table', 'update_table_bulk'):
+                    if not quantities:
+                        quantities = [get_stash_quantities(page)
+                                      for page in pages]
+                    items = sum(len(unique_items)
+                                for unique_items in quantities)
+                    for unique_items in quantities:
+                        call = time.perf_counter()
+                        db.update_table(unique_items,
+                                        bulk=path == 'update_table_bulk',
+                                        max_workers=max_workers)
+                        calls.append(time.perf_counter() - call)
+                elif path == 'find_top_quantity':
+                    items = top
+                    call = time.perf_counter()
+                    db.find_top_quantity(top)
+                    calls.append(time.perf_counter() - call)
+                elif path == 'reset_table':
+                    items = db.table.item_count
+                    call = time.perf_counter()
+                    db.reset_table()
+                    calls.append(time.perf_counter() - call)
+                else:
+                    raise ValueError('Unknown path {}'.format(path))
+        except Exception as exception:
+            error = '{}: {}'.format(type(exception).__name__, exception)
+        seconds = time.perf_counter() - started
+        peak_alloc = None
+        if memory:
+            peak_alloc = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        results[path] = {
+            "seconds": seconds,
+            "items": items,
+            "items_per_sec": items / seconds if seconds else None,
+            "calls": len(calls),
+            "call_p50_ms": _ms(percentile(calls, 0.50)),
+            "call_p99_ms": _ms(percentile(calls, 0.99)),
+            "requests": recorder.summary(path),
+            "peak_alloc": peak_alloc,
+            "error": error
+        }
+    if backend == 'sqlite':
+        local.close()
+    return results
+
+
+def _ms(seconds):
+    if seconds is None:
+        return None
+    return seconds * 1000.0
+
+
+# Runs in a fresh interpreter for every startup_benchmark() run.
+_STARTUP_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import AWS_Classes
+imported = time.perf_counter()
+lazy = 'boto3' not in sys.modules
+kwargs = {}
+if sys.argv[2] == 'memory':
+    from Local_Backends import MemoryResource
+    kwargs['resource'] = MemoryResource()
+db = AWS_Classes.DynamoDB(sys.argv[1], **kwargs)
+constructed = time.perf_counter()
+db.get_item('Startup Item', 80)
+first = time.perf_counter()
+db = AWS_Classes.DynamoDB(sys.argv[1], **kwargs)
+again = time.perf_counter()
+db.get_item('Startup Item', 80)
+warm = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "boto3_lazy": lazy,
+    "construct": constructed - imported,
+    "first_request": first - constructed,
+    "construct_again": again - first,
+    "warm_request": warm - again
+}))
+'''
+
+
+def startup_benchmark(runs=5, table='Benchmark_startup', backend='boto3'):
+    """ This measures what a cold Lambda container pays before its first
+    answer: importing AWS_Classes, making the first DynamoDB object and its
+    first get_item(), and then the same again once the shared resource
+    exists. Every run is a new interpreter.
+
+    Args: The number of runs, the table to read from and the backend
+    ('boto3' for the real table or 'memory' for the import cost alone).
+
+    Returns: A Dict of each measurement to its p50 and max in
+    milliseconds, and if boto3 was still unimported after the import.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [here, environment.get('PYTHONPATH')]))
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', _STARTUP_SCRIPT, table, backend],
+            check=True, capture_output=True, env=environment, text=True
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    result = {"boto3_lazy": all(sample['boto3_lazy'] for sample in samples)}
+    for name in ('import', 'construct', 'first_request', 'construct_again',
+                 'warm_request'):
+        values = [sample[name] for sample in samples]
+        result[name] = {
+            "p50_ms": percentile(values, 0.50) * 1000.0,
+            "max_ms": max(values) * 1000.0
+        }
+    return result
+
+
+def format_results(results):
+    """ This turns the results of run_benchmark() into a short report.
+
+    Args: The results.
+
+    Returns: The report as a string.
+    """
+    lines = []
+    for path, result in results.items():
+        if result['error']:
+            lines.append('{}: failed with {}'.format(path, result['error']))
+            continue
+        requests = ', '.join(
+            '{} {}'.format(summary['count'], operation)
+            for operation, summary in result['requests'].items()
+        ) or 'no requests'
+        if result['peak_alloc'] is not None:
+            requests += ', peak {:.1f} MiB allocated'.format(
+                result['peak_alloc'] / 1048576.0)
+        lines.append(
+            '{}: {:.3f}s, {:.0f} items/sec, p50 {:.2f}ms, p99 {:.2f}ms, '
+            '{}.'.format(path, result['seconds'], result['items_per_sec'] or 0,
+                         result['call_p50_ms'] or 0, result['call_p99_ms'] or 0,
+                         requests)
+        )
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the ingest, scan and top N paths of '
+                    'AWS_Classes.py against a local table.')
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--stashes', type=int, default=50,
+                        help='stashes per page')
+    parser.add_argument('--items', type=int, default=20,
+                        help='items per stash')
+    parser.add_argument('--names', type=int, default=2000,
+                        help='distinct item names')
+    parser.add_argument('--min-ilvl', type=int, default=60)
+    parser.add_argument('--max-ilvl', type=int, default=100)
+    parser.add_argument('--skew', type=float, default=1.1,
+                        help='Zipf exponent of the item names')
+    parser.add_argument('--backend', choices=('memory', 'sqlite'),
+                        default='memory')
+    parser.add_argument('--sqlite-path', default=':memory:')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='milliseconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='random milliseconds added on top of latency')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--shards', type=int, default=None)
+    parser.add_argument('--epochs', action='store_true')
+    parser.add_argument('--paths', default=','.join(PATHS),
+                        help='comma separated paths to run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--memory', action='store_true',
+                        help='trace the peak memory of every path (slow)')
+    parser.add_argument('--output', default=None,
+                        help='write the JSON results to this file')
+    parser.add_argument('--startup', action='store_true',
+                        help='only measure the import and first request time')
+    parser.add_argument('--startup-backend', choices=('boto3', 'memory'),
+                        default='boto3')
+    parser.add_argument('--table', default='Benchmark_startup',
+                        help='the table the startup benchmark reads from')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        report = {
+            "created": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "arguments": vars(args),
+            "startup": startup_benchmark(args.runs, args.table,
+                                         args.startup_backend)
+        }
+        output = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w') as output_file:
+                output_file.write(output)
+        else:
+            print(output)
+        return report
+
+    pages = make_pages(args.pages, args.stashes, args.items, args.names,
+                       args.min_ilvl, args.max_ilvl, args.skew, args.seed)
+    results = run_benchmark(
+        pages,
+        paths=[path for path in args.paths.split(',') if path],
+        backend=args.backend,
+        sqlite_path=args.sqlite_path,
+        latency=args.latency / 1000.0,
+        jitter=args.jitter / 1000.0,
+        max_workers=args.workers,
+        top=args.top,
+        shards=args.shards,
+        epochs=args.epochs,
+        seed=args.seed,
+        memory=args.memory
+    )
+    report = {
+        "created": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "arguments": vars(args),
+        "results": results
+    }
+    print(format_results(results), file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1128 @@
+import base64
+import bisect
+import decimal
+import json
+import re
+import sqlite3
+import threading
+import zlib
+
+try:
+    from botocore.exceptions import ClientError
+except ImportError:
+    class ClientError(Exception):
+        """ Used in place of botocore's ClientError when boto3 is not
+        installed.
+        """
+
+        def __init__(self, error_response, operation_name):
+            self.response = error_response
+            self.operation_name = operation_name
+            super(ClientError, self).__init__(
+                "An error occurred ({}) when calling the {} operation: "
+                "{}".format(error_response['Error']['Code'], operation_name,
+                            error_response['Error']['Message'])
+            )
+
+
+# Local stand-ins for the boto3 DynamoDB resource. These implement the part of
+# the resource/Table API that the DynamoDB class in AWS_Classes.py uses, so the
+# scan, update and top-N logic can be run and profiled without the network:
+#
+#   db = DynamoDB('PoE_items', resource=MemoryResource())
+#   db = DynamoDB('PoE_items', resource=SQLiteResource('poe.sqlite'))
+#
+# Only the expression syntax used by this repo is supported: SET/ADD/REMOVE
+# update clauses, comparisons, BETWEEN, IN, AND/OR/NOT, attribute_exists,
+# attribute_not_exists, begins_with and if_not_exists.
+class BackendError(ClientError):
+    """ Raised by the local backends. It is a ClientError with the same
+    response shape, so the code that handles boto3 errors handles these too.
+    """
+
+    def __init__(self, code, message, operation):
+        super(BackendError, self).__init__({
+            'Error': {
+                'Code': code,
+                'Message': message
+            }
+        }, operation)
+
+
+class Backend():
+    """ The interface the DynamoDB class expects from a storage backend. This
+    mirrors the subset of boto3.resource('dynamodb') that the class uses, so
+    a real boto3 resource is also a valid backend.
+
+    Methods:
+        Table(name): Returns a table object with scan, query, get_item,
+            put_item, update_item and delete_item.
+        create_table(**kwargs): Same arguments as the boto3 call.
+        batch_write_item(RequestItems): Put and delete requests.
+        batch_get_item(RequestItems): Keys to fetch per table.
+    """
+
+    def Table(self, name):
+        raise NotImplementedError
+
+    def create_table(self, **kwargs):
+        raise NotImplementedError
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        unprocessed = {}
+        consumed = []
+        for table_name, requests in RequestItems.items():
+            table = self.Table(table_name)
+            units = 0.0
+            for request in requests:
+                if 'PutRequest' in request:
+                    table.put_item(Item=request['PutRequest']['Item'])
+                else:
+                    table.delete_item(Key=request['DeleteRequest']['Key'])
+                units += 1.0
+            consumed.append({
+                'TableName': table_name,
+                'CapacityUnits': units
+            })
+        response = {'UnprocessedItems': unprocessed}
+        if kwargs.get('ReturnConsumedCapacity', 'NONE') != 'NONE':
+            response['ConsumedCapacity'] = consumed
+        return response
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {}
+        consumed = []
+        for table_name, request in RequestItems.items():
+            table = self.Table(table_name)
+            found = []
+            for key in request['Keys']:
+                response = table.get_item(
+                    Key=key,
+                    ProjectionExpression=request.get('ProjectionExpression'),
+                    ExpressionAttributeNames=request.get(
+                        'ExpressionAttributeNames')
+                )
+                if 'Item' in response:
+                    found.append(response['Item'])
+            responses[table_name] = found
+            consumed.append({
+                'TableName': table_name,
+                'CapacityUnits': 0.5 * len(request['Keys'])
+            })
+        response = {'Responses': responses, 'UnprocessedKeys': {}}
+        if kwargs.get('ReturnConsumedCapacity', 'NONE') != 'NONE':
+            response['ConsumedCapacity'] = consumed
+        return response
+
+
+# Expression handling shared by both backends.
+_TOKEN = re.compile(
+    r'\s*(?:(?P<op><>|<=|>=|=|<|>|\(|\)|,|\+|-)'
+    r'|(?P<value>:[A-Za-z0-9_]+)'
+    r'|(?P<name>#?[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*))'
+)
+_KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'SET', 'ADD', 'REMOVE'}
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if match is None or match.end() == position:
+            raise BackendError(
+                'ValidationException',
+                'Invalid expression near: {}'.format(expression[position:]),
+                'Expression'
+            )
+        position = match.end()
+        if match.group('op'):
+            tokens.append(('op', match.group('op')))
+        elif match.group('value'):
+            tokens.append(('value', match.group('value')))
+        elif match.group('name').upper() in _KEYWORDS:
+            tokens.append(('kw', match.group('name').upper()))
+        else:
+            tokens.append(('name', match.group('name')))
+    return tokens
+
+
+class _Parser():
+    """ Small recursive descent parser for DynamoDB expressions. Names and
+    values are resolved against ExpressionAttributeNames/Values as they are
+    parsed, so the resulting tree only holds attribute names and Python
+    values.
+    """
+
+    def __init__(self, expression, names, values):
+        self.tokens = _tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self, kind=None, text=None):
+        token = self.peek()
+        if (kind and token[0] != kind) or (text and token[1] != text):
+            raise BackendError(
+                'ValidationException',
+                'Unexpected token {} in expression'.format(token[1]),
+                'Expression'
+            )
+        self.position += 1
+        return token
+
+    def path(self):
+        name = self.take('name')[1]
+        if name.startswith('#'):
+            return self.names[name]
+        return name
+
+    def value(self):
+        return _python_value(self.values[self.take('value')[1]])
+
+    def operand(self):
+        kind, text = self.peek()
+        if kind == 'value':
+            return ('value', self.value())
+        if kind == 'name' and text == 'if_not_exists':
+            self.take('name')
+            self.take('op', '(')
+            path = self.path()
+            self.take('op', ',')
+            default = self.operand()
+            self.take('op', ')')
+            return ('if_not_exists', path, default)
+        return ('path', self.path())
+
+    # Conditions, filters and key conditions.
+    def condition(self):
+        node = self.conjunction()
+        while self.peek() == ('kw', 'OR'):
+            self.take()
+            node = ('or', node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.peek() == ('kw', 'AND'):
+            self.take()
+            node = ('and', node, self.negation())
+        return node
+
+    def negation(self):
+        if self.peek() == ('kw', 'NOT'):
+            self.take()
+            return ('not', self.negation())
+        return self.comparison()
+
+    def comparison(self):
+        kind, text = self.peek()
+        if kind == 'op' and text == '(':
+            self.take()
+            node = self.condition()
+            self.take('op', ')')
+            return node
+        if kind == 'name' and text in ('attribute_exists',
+                                       'attribute_not_exists'):
+            self.take()
+            self.take('op', '(')
+            path = self.path()
+            self.take('op', ')')
+            return (text, path)
+        if kind == 'name' and text == 'begins_with':
+            self.take()
+            self.take('op', '(')
+            path = self.path()
+            self.take('op', ',')
+            prefix = self.value()
+            self.take('op', ')')
+            return ('begins_with', path, prefix)
+        left = self.operand()
+        kind, text = self.peek()
+        if (kind, text) == ('kw', 'BETWEEN'):
+            self.take()
+            low = self.operand()
+            self.take('kw', 'AND')
+            high = self.operand()
+            return ('between', left, low, high)
+        if (kind, text) == ('kw', 'IN'):
+            self.take()
+            self.take('op', '(')
+            options = [self.operand()]
+            while self.peek() == ('op', ','):
+                self.take()
+                options.append(self.operand())
+            self.take('op', ')')
+            return ('in', left, options)
+        comparator = self.take('op')[1]
+        return ('compare', comparator, left, self.operand())
+
+    # Update expressions.
+    def update(self):
+        actions = []
+        while self.peek()[0] is not None:
+            clause = self.take('kw')[1]
+            while True:
+                path = self.path()
+                if clause == 'SET':
+                    self.take('op', '=')
+                    value = self.operand()
+                    if self.peek() in (('op', '+'), ('op', '-')):
+                        sign = self.take()[1]
+                        value = ('math', sign, value, self.operand())
+                    actions.append(('SET', path, value))
+                elif clause == 'ADD':
+                    actions.append(('ADD', path, self.operand()))
+                else:
+                    actions.append(('REMOVE', path, None))
+                if self.peek() != ('op', ','):
+                    break
+                self.take()
+        return actions
+
+    def projection(self):
+        paths = [self.path()]
+        while self.peek() == ('op', ','):
+            self.take()
+            paths.append(self.path())
+        return paths
+
+
+def _python_value(value):
+    # boto3 turns every number into a Decimal, and so do we.
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        return decimal.Decimal(value)
+    if isinstance(value, float):
+        raise TypeError('Float types are not supported. Use Decimal types '
+                        'instead.')
+    return value
+
+
+def _resolve(operand, item):
+    kind = operand[0]
+    if kind == 'value':
+        return operand[1]
+    if kind == 'path':
+        return item.get(operand[1])
+    if kind == 'if_not_exists':
+        if operand[1] in item:
+            return item[operand[1]]
+        return _resolve(operand[2], item)
+    left = _resolve(operand[2], item)
+    right = _resolve(operand[3], item)
+    if left is None or right is None:
+        raise BackendError(
+            'ValidationException',
+            'The provided expression refers to an attribute that does not '
+            'exist in the item',
+            'UpdateItem'
+        )
+    if operand[1] == '+':
+        return left + right
+    return left - right
+
+
+def _compare(comparator, left, right):
+    if left is None or right is None:
+        return comparator == '<>' and left is not right
+    if type(left) is not type(right):
+        return comparator == '<>'
+    if comparator == '=':
+        return left == right
+    if comparator == '<>':
+        return left != right
+    if comparator == '<':
+        return left < right
+    if comparator == '<=':
+        return left <= right
+    if comparator == '>':
+        return left > right
+    return left >= right
+
+
+def _evaluate(node, item):
+    kind = node[0]
+    if kind == 'or':
+        return _evaluate(node[1], item) or _evaluate(node[2], item)
+    if kind == 'and':
+        return _evaluate(node[1], item) and _evaluate(node[2], item)
+    if kind == 'not':
+        return not _evaluate(node[1], item)
+    if kind == 'attribute_exists':
+        return node[1] in item
+    if kind == 'attribute_not_exists':
+        return node[1] not in item
+    if kind == 'begins_with':
+        value = item.get(node[1])
+        return isinstance(value, str) and value.startswith(node[2])
+    if kind == 'between':
+        value = _resolve(node[1], item)
+        return (_compare('>=', value, _resolve(node[2], item)) and
+                _compare('<=', value, _resolve(node[3], item)))
+    if kind == 'in':
+        value = _resolve(node[1], item)
+        return any(_compare('=', value, _resolve(option, item))
+                   for option in node[2])
+    return _compare(node[1], _resolve(node[2], item), _resolve(node[3], item))
+
+
+def _apply_update(actions, item):
+    for action, path, operand in actions:
+        if action == 'REMOVE':
+            item.pop(path, None)
+        elif action == 'SET':
+            item[path] = _resolve(operand, item)
+        else:
+            value = _resolve(operand, item)
+            if path in item:
+                item[path] = item[path] + value
+            else:
+                item[path] = value
+    return item
+
+
+def _project(item, paths):
+    if paths is None:
+        return dict(item)
+    return {path: item[path] for path in paths if path in item}
+
+
+class MemoryTable():
+    """ A thread safe, in-memory table with the same method signatures as a
+    boto3 Table. Items are kept in a dict keyed by their primary key and a
+    lazily rebuilt sorted key list gives scans and queries a stable
+    Unique_ID (reverse ilvl) order.
+    """
+
+    # Number of items evaluated per scan/query page, in place of the 1MB
+    # page limit that DynamoDB applies.
+    page_size = 1000
+
+    def __init__(self, resource, name, key_schema, attribute_definitions,
+                 global_secondary_indexes=None, billing_mode='PAY_PER_REQUEST',
+                 provisioned_throughput=None):
+        self.resource = resource
+        self.name = name
+        self.table_name = name
+        self.key_schema = key_schema
+        self.attribute_definitions = attribute_definitions
+        self.global_secondary_indexes = global_secondary_indexes
+        self.billing_mode_summary = {'BillingMode': billing_mode}
+        self.provisioned_throughput = provisioned_throughput
+        self.table_status = 'ACTIVE'
+        self.hash_key = key_schema[0]['AttributeName']
+        self.range_key = None
+        if len(key_schema) > 1:
+            self.range_key = key_schema[1]['AttributeName']
+        self.lock = threading.RLock()
+        self._items = {}
+        self._order = []
+        self._dirty = False
+        # Index name to a sorted list of (index key, primary key), built the
+        # first time the index is read and then kept up to date by writes.
+        self._indexes = {}
+
+    # Storage hooks, overridden by the SQLite table.
+    def _load(self, key):
+        return self._items.get(key)
+
+    def _store(self, key, item):
+        if key not in self._items:
+            self._dirty = True
+        self._items[key] = item
+
+    def _remove(self, key):
+        self._items.pop(key, None)
+
+    def _ordered_keys(self, start=None):
+        if self._dirty:
+            self._order = sorted(self._items)
+            self._dirty = False
+        index = 0
+        if start is not None:
+            index = bisect.bisect_right(self._order, start)
+        for key in self._order[index:]:
+            if key in self._items:
+                yield key
+
+    def _count(self):
+        return len(self._items)
+
+    def _clear(self):
+        self._items = {}
+        self._order = []
+        self._dirty = False
+        self._indexes = {}
+
+    # Secondary index helpers.
+    def _index_schema(self, index_name):
+        for index in self.global_secondary_indexes or []:
+            if index['IndexName'] == index_name:
+                return [part['AttributeName'] for part in index['KeySchema']]
+        raise BackendError(
+            'ValidationException',
+            'The table does not have the specified index: {}'.format(
+                index_name),
+            'Query'
+        )
+
+    def _index_entry(self, schema, key, item):
+        # Items without every index key attribute are not in the index.
+        if item is None or any(name not in item for name in schema):
+            return None
+        return (tuple(item[name] for name in schema), key)
+
+    def _index_entries(self, index_name):
+        entries = self._indexes.get(index_name)
+        if entries is None:
+            schema = self._index_schema(index_name)
+            entries = []
+            for key in self._ordered_keys():
+                entry = self._index_entry(schema, key, self._load(key))
+                if entry is not None:
+                    entries.append(entry)
+            entries.sort()
+            self._indexes[index_name] = entries
+        return entries
+
+    def _reindex(self, key, old, new):
+        for index_name, entries in self._indexes.items():
+            schema = self._index_schema(index_name)
+            old_entry = self._index_entry(schema, key, old)
+            new_entry = self._index_entry(schema, key, new)
+            if old_entry == new_entry:
+                continue
+            if old_entry is not None:
+                position = bisect.bisect_left(entries, old_entry)
+                if position < len(entries) and entries[position] == old_entry:
+                    del entries[position]
+            if new_entry is not None:
+                bisect.insort(entries, new_entry)
+
+    # Key helpers.
+    def _key_of(self, item):
+        try:
+            hash_value = _python_value(item[self.hash_key])
+            if self.range_key is None:
+                return (hash_value,)
+            return (hash_value, _python_value(item[self.range_key]))
+        except KeyError as error:
+            raise BackendError(
+                'ValidationException',
+                'Missing the key {} in the item'.format(error.args[0]),
+                'PutItem'
+            )
+
+    def _key_dict(self, key):
+        key_dict = {self.hash_key: key[0]}
+        if self.range_key is not None:
+            key_dict[self.range_key] = key[1]
+        return key_dict
+
+    def _consumed(self, kwargs, units):
+        if kwargs.get('ReturnConsumedCapacity', 'NONE') == 'NONE':
+            return {}
+        return {
+            'ConsumedCapacity': {
+                'TableName': self.name,
+                'CapacityUnits': units
+            }
+        }
+
+    def _check(self, kwargs, item, operation):
+        expression = kwargs.get('ConditionExpression')
+        if expression is None:
+            return
+        node = _Parser(
+            expression,
+            kwargs.get('ExpressionAttributeNames'),
+            kwargs.get('ExpressionAttributeValues')
+        ).condition()
+        if not _evaluate(node, item or {}):
+            raise BackendError(
+                'ConditionalCheckFailedException',
+                'The conditional request failed',
+                operation
+            )
+
+    def _return(self, kwargs, old, new, updated=()):
+        mode = kwargs.get('ReturnValues', 'NONE')
+        if mode == 'ALL_OLD' and old is not None:
+            return {'Attributes': dict(old)}
+        if mode == 'ALL_NEW' and new is not None:
+            return {'Attributes': dict(new)}
+        if mode in ('UPDATED_NEW', 'UPDATED_OLD'):
+            # Like DynamoDB, every attribute the update expression names is
+            # returned, whether or not its value changed.
+            source = new if mode == 'UPDATED_NEW' else old
+            attributes = {
+                path: source[path] for path in updated
+                if source is not None and path in source
+            }
+            if attributes:
+                return {'Attributes': attributes}
+        return {}
+
+    # The boto3 Table API.
+    @property
+    def item_count(self):
+        with self.lock:
+            return self._count()
+
+    def get_item(self, Key, **kwargs):
+        paths = None
+        if kwargs.get('ProjectionExpression'):
+            paths = _Parser(
+                kwargs['ProjectionExpression'],
+                kwargs.get('ExpressionAttributeNames'),
+                None
+            ).projection()
+        with self.lock:
+            item = self._load(self._key_of(Key))
+        response = self._consumed(kwargs, 0.5)
+        if item is not None:
+            response['Item'] = _project(item, paths)
+        return response
+
+    def put_item(self, Item, **kwargs):
+        item = {name: _python_value(value) for name, value in Item.items()}
+        key = self._key_of(item)
+        with self.lock:
+            old = self._load(key)
+            self._check(kwargs, old, 'PutItem')
+            self._store(key, item)
+            self._reindex(key, old, item)
+        response = self._consumed(kwargs, 1.0)
+        response.update(self._return(kwargs, old, None))
+        return response
+
+    def update_item(self, Key, **kwargs):
+        key = self._key_of(Key)
+        actions = []
+        if kwargs.get('UpdateExpression'):
+            actions = _Parser(
+                kwargs['UpdateExpression'],
+                kwargs.get('ExpressionAttributeNames'),
+                kwargs.get('ExpressionAttributeValues')
+            ).update()
+        with self.lock:
+            old = self._load(key)
+            self._check(kwargs, old, 'UpdateItem')
+            new = dict(old) if old is not None else self._key_dict(key)
+            _apply_update(actions, new)
+            self._store(key, new)
+            self._reindex(key, old, new)
+        response = self._consumed(kwargs, 1.0)
+        response.update(self._return(
+            kwargs, old, new, [path for _, path, _ in actions]))
+        return response
+
+    def delete_item(self, Key, **kwargs):
+        key = self._key_of(Key)
+        with self.lock:
+            old = self._load(key)
+            self._check(kwargs, old, 'DeleteItem')
+            if old is not None:
+                self._remove(key)
+                self._reindex(key, old, None)
+        response = self._consumed(kwargs, 1.0)
+        response.update(self._return(kwargs, old, None))
+        return response
+
+    def _page(self, keys, kwargs, match_key=None):
+        paths = None
+        names = kwargs.get('ExpressionAttributeNames')
+        values = kwargs.get('ExpressionAttributeValues')
+        if kwargs.get('ProjectionExpression'):
+            paths = _Parser(kwargs['ProjectionExpression'], names,
+                            None).projection()
+        condition = None
+        if kwargs.get('FilterExpression'):
+            condition = _Parser(kwargs['FilterExpression'], names,
+                                values).condition()
+        limit = min(kwargs.get('Limit') or self.page_size, self.page_size)
+
+        items = []
+        scanned = 0
+        last_key = None
+        with self.lock:
+            for key in keys:
+                if match_key is not None and not match_key(key):
+                    continue
+                item = self._load(key)
+                if item is None:
+                    continue
+                scanned += 1
+                last_key = key
+                if condition is None or _evaluate(condition, item):
+                    items.append(_project(item, paths))
+                if scanned >= limit:
+                    break
+            # Only keys this scan would return again mean there is more.
+            more = scanned >= limit and any(
+                match_key is None or match_key(key) for key in keys)
+        if kwargs.get('Select') == 'COUNT':
+            response = {'Count': len(items), 'ScannedCount': scanned}
+        else:
+            response = {
+                'Items': items,
+                'Count': len(items),
+                'ScannedCount': scanned
+            }
+        if more:
+            response['LastEvaluatedKey'] = self._key_dict(last_key)
+        response.update(self._consumed(kwargs, max(0.5, scanned / 8.0)))
+        return response
+
+    def scan(self, **kwargs):
+        start = None
+        if kwargs.get('ExclusiveStartKey'):
+            start = self._key_of(kwargs['ExclusiveStartKey'])
+        segment = kwargs.get('Segment', 0)
+        total_segments = kwargs.get('TotalSegments', 1)
+
+        def in_segment(key):
+            if total_segments == 1:
+                return True
+            return _segment_of(key[0], total_segments) == segment
+
+        if kwargs.get('IndexName'):
+            return self._index(kwargs['IndexName']).scan(**kwargs)
+        with self.lock:
+            keys = self._ordered_keys(start)
+            return self._page(keys, kwargs, in_segment)
+
+    def query(self, **kwargs):
+        if kwargs.get('IndexName'):
+            return self._index(kwargs['IndexName']).query(**kwargs)
+        names = kwargs.get('ExpressionAttributeNames')
+        values = kwargs.get('ExpressionAttributeValues')
+        condition = _Parser(kwargs['KeyConditionExpression'], names,
+                            values).condition()
+        start = None
+        if kwargs.get('ExclusiveStartKey'):
+            start = self._key_of(kwargs['ExclusiveStartKey'])
+        hash_value = _hash_condition(condition, self.hash_key)
+
+        def in_partition(key):
+            return key[0] == hash_value and _evaluate(
+                condition, self._key_dict(key))
+
+        with self.lock:
+            if kwargs.get('ScanIndexForward', True):
+                keys = self._ordered_keys(start)
+            else:
+                keys = [key for key in self._ordered_keys()
+                        if start is None or key < start]
+                keys = iter(reversed(keys))
+            return self._page(keys, kwargs, in_partition)
+
+    def _index(self, index_name):
+        return _IndexView(self, index_name, self._index_schema(index_name))
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return _BatchWriter(self)
+
+    def wait_until_exists(self):
+        return None
+
+    def wait_until_not_exists(self):
+        return None
+
+    def delete(self):
+        self.resource._drop(self.name)
+        return {'TableDescription': {'TableName': self.name}}
+
+    def load(self):
+        return None
+
+
+class _BatchWriter():
+    """ The local version of Table.batch_writer(). Requests are applied
+    straight away since there is no network round trip to batch up.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def put_item(self, Item):
+        self.table.put_item(Item=Item)
+
+    def delete_item(self, Key):
+        self.table.delete_item(Key=Key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _IndexView():
+    """ A read-only view of a global secondary index. Like DynamoDB, items
+    that do not carry the index key attributes are left out, which is what
+    makes an index sparse. The entries are the table's sorted index list, so
+    a query only bisects to its partition instead of sorting the table.
+    """
+
+    def __init__(self, table, index_name, schema):
+        self.table = table
+        self.index_name = index_name
+        self.hash_key = schema[0]
+        self.range_key = schema[1] if len(schema) > 1 else None
+
+    def _start(self, kwargs):
+        # The index keys of the start key go first, as they do in the entries.
+        start_item = kwargs['ExclusiveStartKey']
+        start = (_python_value(start_item[self.hash_key]),)
+        if self.range_key is not None:
+            start = start + (_python_value(start_item[self.range_key]),)
+        return (start, self.table._key_of(start_item))
+
+    def query(self, **kwargs):
+        kwargs = dict(kwargs)
+        kwargs.pop('IndexName')
+        names = kwargs.get('ExpressionAttributeNames')
+        values = kwargs.get('ExpressionAttributeValues')
+        condition = _Parser(kwargs['KeyConditionExpression'], names,
+                            values).condition()
+        hash_value = _hash_condition(condition, self.hash_key)
+        if hash_value is None:
+            raise BackendError(
+                'ValidationException',
+                'Query condition missed key schema element: {}'.format(
+                    self.hash_key),
+                'Query'
+            )
+        forward = kwargs.get('ScanIndexForward', True)
+        with self.table.lock:
+            index = self.table._index_entries(self.index_name)
+            low = bisect.bisect_left(index, ((hash_value,),))
+            high = low
+            while high < len(index) and index[high][0][0] == hash_value:
+                high += 1
+            if kwargs.get('ExclusiveStartKey'):
+                start = self._start(kwargs)
+                if forward:
+                    low = max(low, bisect.bisect_right(index, start))
+                else:
+                    high = min(high, bisect.bisect_left(index, start))
+            partition = index[low:high]
+        entries = []
+        for index_key, key in partition:
+            item = {self.hash_key: index_key[0]}
+            if self.range_key is not None:
+                item[self.range_key] = index_key[1]
+            if _evaluate(condition, item):
+                entries.append((index_key, key))
+        if not forward:
+            entries.reverse()
+        return self._finish(entries, kwargs)
+
+    def scan(self, **kwargs):
+        kwargs = dict(kwargs)
+        kwargs.pop('IndexName')
+        with self.table.lock:
+            index = self.table._index_entries(self.index_name)
+            low = 0
+            if kwargs.get('ExclusiveStartKey'):
+                low = bisect.bisect_right(index, self._start(kwargs))
+            entries = index[low:]
+        return self._finish(entries, kwargs)
+
+    def _finish(self, entries, kwargs):
+        response = self.table._page(iter([key for _, key in entries]), kwargs)
+        if 'LastEvaluatedKey' in response:
+            item = self.table._load(
+                self.table._key_of(response['LastEvaluatedKey']))
+            response['LastEvaluatedKey'][self.hash_key] = item[self.hash_key]
+            if self.range_key is not None:
+                response['LastEvaluatedKey'][self.range_key] = \
+                    item[self.range_key]
+        return response
+
+
+def _segment_of(value, total_segments):
+    return zlib.crc32(str(value).encode('utf-8')) % total_segments
+
+
+def _hash_condition(node, hash_key):
+    # Pull the "hash_key = :value" term out of a key condition.
+    if node[0] == 'and':
+        found = _hash_condition(node[1], hash_key)
+        if found is not None:
+            return found
+        return _hash_condition(node[2], hash_key)
+    if (node[0] == 'compare' and node[1] == '=' and
+            node[2] == ('path', hash_key)):
+        return node[3][1]
+    return None
+
+
+class MemoryResource(Backend):
+    """ An in-memory stand in for boto3.resource('dynamodb'). Tables live as
+    long as the resource object does. Tables that are used without being
+    created first get the single Unique_ID hash key the class has always
+    used.
+    """
+
+    table_class = MemoryTable
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {}
+
+    def Table(self, name):
+        with self.lock:
+            if name not in self.tables:
+                self.tables[name] = self._new_table(
+                    name,
+                    [{'AttributeName': 'Unique_ID', 'KeyType': 'HASH'}],
+                    [{'AttributeName': 'Unique_ID', 'AttributeType': 'S'}]
+                )
+            return self.tables[name]
+
+    def _new_table(self, name, key_schema, attribute_definitions, **kwargs):
+        return self.table_class(self, name, key_schema,
+                                attribute_definitions, **kwargs)
+
+    def create_table(self, TableName, KeySchema, AttributeDefinitions,
+                     GlobalSecondaryIndexes=None, BillingMode='PROVISIONED',
+                     ProvisionedThroughput=None, **kwargs):
+        with self.lock:
+            if TableName in self.tables:
+                raise BackendError(
+                    'ResourceInUseException',
+                    'Table already exists: {}'.format(TableName),
+                    'CreateTable'
+                )
+            table = self._new_table(
+                TableName, KeySchema, AttributeDefinitions,
+                global_secondary_indexes=GlobalSecondaryIndexes,
+                billing_mode=BillingMode,
+                provisioned_throughput=ProvisionedThroughput
+            )
+            self.tables[TableName] = table
+            return table
+
+    def _drop(self, name):
+        with self.lock:
+            table = self.tables.pop(name, None)
+        if table is not None:
+            with table.lock:
+                table._clear()
+
+
+# Items are stored by the SQLite backend in the DynamoDB JSON format, so
+# Decimals, sets and binary values come back exactly as they went in.
+def _encode(value):
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, decimal.Decimal):
+        return {'N': str(value)}
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': base64.b64encode(bytes(value)).decode('ascii')}
+    if isinstance(value, (set, frozenset)):
+        values = sorted(value, key=str)
+        if all(isinstance(member, str) for member in values):
+            return {'SS': values}
+        if all(isinstance(member, (bytes, bytearray)) for member in values):
+            return {'BS': [base64.b64encode(bytes(member)).decode('ascii')
+                           for member in values]}
+        return {'NS': [str(_python_value(member)) for member in values]}
+    if isinstance(value, dict):
+        return {'M': {name: _encode(member) for name, member in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [_encode(member) for member in value]}
+    return _encode(_python_value(value))
+
+
+def _decode(value):
+    kind, data = next(iter(value.items()))
+    if kind == 'N':
+        return decimal.Decimal(data)
+    if kind == 'B':
+        return base64.b64decode(data)
+    if kind == 'SS':
+        return set(data)
+    if kind == 'NS':
+        return set(decimal.Decimal(member) for member in data)
+    if kind == 'BS':
+        return set(base64.b64decode(member) for member in data)
+    if kind == 'M':
+        return {name: _decode(member) for name, member in data.items()}
+    if kind == 'L':
+        return [_decode(member) for member in data]
+    if kind == 'NULL':
+        return None
+    return data
+
+
+def _column(value):
+    # Key values as SQLite sees them, so ORDER BY gives the DynamoDB order.
+    if isinstance(value, decimal.Decimal):
+        if value == value.to_integral_value():
+            return int(value)
+        return float(value)
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    return value
+
+
+class SQLiteTable(MemoryTable):
+    """ A MemoryTable that keeps its items in a SQLite table instead of a
+    dict. The keys are columns of the primary key, so scans and queries read
+    the items in the same Unique_ID (reverse ilvl) order straight from the
+    index, and a table can be much larger than memory.
+    """
+
+    def __init__(self, resource, name, key_schema, attribute_definitions,
+                 **kwargs):
+        super(SQLiteTable, self).__init__(
+            resource, name, key_schema, attribute_definitions, **kwargs)
+        # One connection is shared by every table of the resource.
+        self.lock = resource.lock
+        self.connection = resource.connection
+        self.sql_name = '"items_{}"'.format(name.replace('"', '""'))
+        self._prefetched = None
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS {} ('
+            'h NOT NULL, r NOT NULL DEFAULT \'\', body TEXT NOT NULL, '
+            'PRIMARY KEY (h, r)) WITHOUT ROWID'.format(self.sql_name)
+        )
+
+    def _where(self, key):
+        if self.range_key is None:
+            return (_column(key[0]), '')
+        return (_column(key[0]), _column(key[1]))
+
+    def _load(self, key):
+        if self._prefetched is not None and self._prefetched[0] == key:
+            return self._prefetched[1]
+        row = self.connection.execute(
+            'SELECT body FROM {} WHERE h = ? AND r = ?'.format(self.sql_name),
+            self._where(key)
+        ).fetchone()
+        if row is None:
+            return None
+        return _decode({'M': json.loads(row[0])})
+
+    def _store(self, key, item):
+        self._prefetched = None
+        self.connection.execute(
+            'INSERT OR REPLACE INTO {} (h, r, body) VALUES (?, ?, ?)'.format(
+                self.sql_name),
+            self._where(key) + (json.dumps(_encode(item)['M']),)
+        )
+
+    def _remove(self, key):
+        self._prefetched = None
+        self.connection.execute(
+            'DELETE FROM {} WHERE h = ? AND r = ?'.format(self.sql_name),
+            self._where(key)
+        )
+
+    def _ordered_keys(self, start=None):
+        sql = 'SELECT body FROM {}'.format(self.sql_name)
+        params = ()
+        if start is not None:
+            h, r = self._where(start)
+            sql += ' WHERE h > ? OR (h = ? AND r > ?)'
+            params = (h, h, r)
+        rows = self.connection.execute(sql + ' ORDER BY h, r', params)
+        for (body,) in rows:
+            item = _decode({'M': json.loads(body)})
+            key = self._key_of(item)
+            # _page() loads every key it is given, so save it a lookup.
+            self._prefetched = (key, item)
+            yield key
+
+    def _count(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM {}'.format(self.sql_name)).fetchone()[0]
+
+    def _clear(self):
+        self._prefetched = None
+        self._indexes = {}
+        self.connection.execute('DROP TABLE IF EXISTS {}'.format(self.sql_name))
+
+
+class SQLiteResource(MemoryResource):
+    """ A stand in for boto3.resource('dynamodb') backed by a SQLite file, so
+    the tables outlive the process and can hold millions of rows. Table
+    definitions are kept in the file too. A path of ':memory:' gives a
+    private database that is dropped with the resource.
+
+    Args: The path of the SQLite database.
+    """
+
+    table_class = SQLiteTable
+
+    def __init__(self, path=':memory:'):
+        self.lock = threading.RLock()
+        self.tables = {}
+        self.path = path
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS tables ('
+            'name TEXT PRIMARY KEY, definition TEXT NOT NULL)'
+        )
+        for name, definition in self.connection.execute(
+                'SELECT name, definition FROM tables').fetchall():
+            definition = json.loads(definition)
+            self.tables[name] = super(SQLiteResource, self)._new_table(
+                name, definition.pop('key_schema'),
+                definition.pop('attribute_definitions'), **definition)
+
+    def _new_table(self, name, key_schema, attribute_definitions, **kwargs):
+        table = super(SQLiteResource, self)._new_table(
+            name, key_schema, attribute_definitions, **kwargs)
+        definition = dict(kwargs, key_schema=key_schema,
+                          attribute_definitions=attribute_definitions)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO tables (name, definition) VALUES (?, ?)',
+            (name, json.dumps(definition))
+        )
+        return table
+
+    def _drop(self, name):
+        with self.lock:
+            super(SQLiteResource, self)._drop(name)
+            self.connection.execute('DELETE FROM tables WHERE name = ?',
+                                    (name,))
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        # A batch is one transaction, which is much faster than committing
+        # every request on its own.
+        with self.lock:
+            self.connection.execute('BEGIN')
+            try:
+                response = super(SQLiteResource, self).batch_write_item(
+                    RequestItems, **kwargs)
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                # The indexes may hold writes that were just rolled back.
+                for table in self.tables.values():
+                    table._indexes = {}
+                raise
+            self.connection.execute('COMMIT')
+        return response
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
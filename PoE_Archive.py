@@ -0,0 +1,308 @@
+import io
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from AWS_Classes import (
+    DynamoDB,
+    QuantityBuffer,
+    StashClient,
+    StashCounts,
+    StashStream
+)
+
+
+# The public stash API. A page is fetched with ?id=<next_change_id>.
+STASH_URL = "https://www.pathofexile.com/api/public-stash-tabs"
+
+
+class StashArchive():
+    """ An append only archive of raw public stash pages. Every page is
+    zlib compressed on its own and appended to <path>, and one line of
+    JSON per page is appended to <path>.idx with its change id, the
+    next_change_id, where it is in the data file and how many items it has.
+    A page can then be read back by its change id without decompressing
+    anything else.
+
+    The data is written before its index line, so a crash can only leave
+    data without an index line, and that is cut off the next time the
+    archive is opened for writing.
+
+    The empty page the API sends back once it has caught up is never
+    archived, because the real page for that change id comes later.
+
+    Args: The path of the data file and the zlib compression level.
+    """
+
+    def __init__(self, path, level=6):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.level = level
+        self.lock = threading.Lock()
+        self.entries = []
+        self.positions = {}
+        self._load_index()
+
+    def _load_index(self):
+        good = 0
+        try:
+            with open(self.index_path, 'rb') as index:
+                for line in index:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    if not line.endswith(b'\n'):
+                        break
+                    good += len(line)
+                    if _caught_up(entry['id'], entry['next'], entry['items']):
+                        # Older archives saved these, the next append
+                        # writes over its data.
+                        continue
+                    self.positions[entry['id']] = len(self.entries)
+                    self.entries.append(entry)
+        except FileNotFoundError:
+            return
+        if good != os.path.getsize(self.index_path):
+            with open(self.index_path, 'r+b') as index:
+                index.truncate(good)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, change_id):
+        return change_id in self.positions
+
+    def append(self, change_id, raw, next_id=None, items=None):
+        """ This adds one page to the archive. Pages that are already in the
+        archive are skipped, and so is the empty page the API sends when it
+        has caught up (its next_change_id is its own change id).
+
+        Args: The change id the page was fetched with, the page as bytes
+        exactly as the API sent it, and its next_change_id and number of
+        items if they are already known.
+
+        Returns: The index entry of the page, or None for a caught up page.
+        """
+        if next_id is None or items is None:
+            page = StashStream(io.BytesIO(raw))
+            items = sum(1 for _ in page.items())
+            next_id = page.next_change_id
+        if _caught_up(change_id, next_id, items):
+            return None
+        data = zlib.compress(raw, self.level)
+        with self.lock:
+            if change_id in self.positions:
+                return self.entries[self.positions[change_id]]
+            offset = 0
+            if self.entries:
+                offset = self.entries[-1]['offset'] + self.entries[-1]['length']
+            with open(self.path, 'ab') as archive:
+                archive.truncate(offset)
+                archive.write(data)
+                archive.flush()
+                os.fsync(archive.fileno())
+            entry = {
+                'id': change_id,
+                'next': next_id,
+                'offset': offset,
+                'length': len(data),
+                'items': items,
+                'size': len(raw),
+                'saved': time.time()
+            }
+            with open(self.index_path, 'a') as index:
+                index.write(json.dumps(entry) + '\n')
+            self.positions[change_id] = len(self.entries)
+            self.entries.append(entry)
+        return entry
+
+    def read(self, change_id):
+        """ This reads one page back.
+
+        Args: The change id of the page.
+
+        Returns: The page as the bytes the API sent.
+        """
+        entry = self.entries[self.positions[change_id]]
+        with open(self.path, 'rb') as archive:
+            archive.seek(entry['offset'])
+            return zlib.decompress(archive.read(entry['length']))
+
+    def chain(self, start_id=None, max_pages=None):
+        """ This lists the pages in the order they were archived, starting
+        from start_id.
+
+        Args: The change id to start from (the first page by default) and
+        the most pages to list.
+
+        Returns: A list of index entries.
+        """
+        start = 0
+        if start_id is not None:
+            start = self.positions[start_id]
+        entries = self.entries[start:]
+        if max_pages is not None:
+            entries = entries[:max_pages]
+        return entries
+
+    def last_id(self):
+        """ This is the change id to carry on recording from.
+
+        Args: Null
+
+        Returns: The next_change_id of the newest page, or None if the
+        archive is empty.
+        """
+        if not self.entries:
+            return None
+        return self.entries[-1]['next']
+
+
+def _caught_up(change_id, next_id, items):
+    # The API answers with an empty page pointing at itself when there is
+    # nothing newer yet.
+    return next_id == change_id and not items
+
+
+def record(archive, start_id='0', max_pages=None, client=None,
+           stash_url=STASH_URL, poll_interval=2.0):
+    """ This follows the public stash API and appends every page to the
+    archive, carrying on from the newest archived page if there is one.
+
+    Args: The StashArchive, the change id to start from for an empty
+    archive, the most pages to fetch (None to run until interrupted), the
+    StashClient, the API URL and how long to wait when there are no new
+    pages.
+
+    Returns: The number of pages recorded.
+    """
+    client = client if client is not None else StashClient()
+    change_id = archive.last_id() or start_id
+    recorded = 0
+    try:
+        while max_pages is None or recorded < max_pages:
+            raw = client.get("{}?id={}".format(stash_url, change_id))
+            entry = archive.append(change_id, raw)
+            if entry is None:
+                time.sleep(poll_interval)
+                continue
+            recorded += 1
+            change_id = entry['next']
+            if recorded % 100 == 0:
+                print('{} pages recorded.'.format(recorded))
+    except KeyboardInterrupt:
+        pass
+    print('{} pages recorded, next id {}.'.format(recorded, change_id))
+    return recorded
+
+
+def _aggregate(path, entries):
+    # Runs in a worker process: adds up the quantities of a run of pages.
+    counts = StashCounts()
+    with open(path, 'rb') as archive:
+        for entry in entries:
+            archive.seek(entry['offset'])
+            counts.add_stream(io.BytesIO(
+                zlib.decompress(archive.read(entry['length']))))
+    return counts
+
+
+def replay(archive, db, start_id=None, max_pages=None, processes=None,
+           pages_per_task=50, max_workers=8, attempts=5):
+    """ This loads archived pages into the table without the public API.
+    Runs of pages_per_task pages are added up in a process pool with the
+    same rules as get_stash_quantities(), and the results are merged in a
+    QuantityBuffer and written with bulk_update_table(), so an item is
+    written about once per flush however many pages it is on. Only two
+    tasks per process are handed to the pool at a time, and each result is
+    dropped as soon as it has been merged, so a long archive does not pile
+    up pending tasks or finished counts in memory.
+
+    Args: The StashArchive, the DynamoDB object, the change id to start
+    from, the most pages to replay, the number of processes (one per CPU by
+    default), the pages each process adds up at a time, the number of
+    writer threads and how many times to send failed rows again.
+
+    Returns: A Dict with the pages and items replayed, the writes made and
+    the seconds it took.
+    """
+    started = time.monotonic()
+    entries = archive.chain(start_id, max_pages)
+    tasks = (entries[start:start + pages_per_task]
+             for start in range(0, len(entries), pages_per_task))
+    max_in_flight = 2 * (processes or os.cpu_count() or 1)
+    buffer = QuantityBuffer(db, max_workers=max_workers)
+    items = 0
+    writes = 0
+
+    def count(summary):
+        return summary['writes'] if summary is not None else 0
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        in_flight = deque()
+        while True:
+            # Tops the pool up, carrying on where the last top up stopped.
+            for task in tasks:
+                in_flight.append(
+                    executor.submit(_aggregate, archive.path, task))
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+            counts = in_flight.popleft().result()
+            items += counts.seen
+            writes += count(buffer.add(counts))
+
+    for _ in range(attempts):
+        summary = buffer.flush()
+        writes += count(summary)
+        if not buffer.batches:
+            break
+        time.sleep(buffer.retry_interval)
+    if buffer.batches:
+        raise RuntimeError('{} batches could not be written.'.format(
+            len(buffer.batches)))
+
+    result = {
+        "pages": len(entries),
+        "items": items,
+        "writes": writes,
+        "seconds": time.monotonic() - started
+    }
+    print('Replayed {} pages ({} items) with {} writes in {:.1f} seconds.'.format(
+        result['pages'], result['items'], result['writes'], result['seconds']
+    )
+    )
+    return result
+
+
+if __name__ == '__main__':
+    # python PoE_Archive.py record <archive> [start id] [pages]
+    # python PoE_Archive.py replay <archive> <table> [processes]
+    usage = ('usage: python PoE_Archive.py record <archive> [start id] [pages]\n'
+             '       python PoE_Archive.py replay <archive> <table> [processes]')
+    if len(sys.argv) < 3 or sys.argv[1] not in ('record', 'replay'):
+        print(usage)
+        sys.exit(1)
+    stash_archive = StashArchive(sys.argv[2])
+    if sys.argv[1] == 'record':
+        record(
+            stash_archive,
+            start_id=sys.argv[3] if len(sys.argv) > 3 else '0',
+            max_pages=int(sys.argv[4]) if len(sys.argv) > 4 else None
+        )
+    else:
+        if len(sys.argv) < 4:
+            print(usage)
+            sys.exit(1)
+        replay(
+            stash_archive,
+            DynamoDB(sys.argv[3]),
+            processes=int(sys.argv[4]) if len(sys.argv) > 4 else None
+        )
@@ -0,0 +1,475 @@
+import decimal
+import io
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+from AWS_Classes import (
+    DecimalEncoder,
+    DynamoDB,
+    QuantityBuffer,
+    RateController,
+    StashClient,
+    StashCounts,
+    get_next_id,
+    load_JSON
+)
+
+
+# The public stash API. A page is fetched with ?id=<next_change_id>.
+STASH_URL = "https://www.pathofexile.com/api/public-stash-tabs"
+
+# Marks the end of the stream in the pipeline queues.
+_DONE = object()
+
+
+class FileCheckpoint():
+    """ This keeps the next_change_id to resume from in a small JSON file,
+    along with any QuantityBuffer batches that were not written yet. The
+    file is replaced atomically, so a crash never leaves a half written
+    checkpoint behind.
+
+    Args: The path of the checkpoint file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _read(self):
+        try:
+            with open(self.path) as checkpoint:
+                return json.load(checkpoint)
+        except FileNotFoundError:
+            return {}
+
+    def load(self):
+        """ This reads the saved next_change_id.
+
+        Args: Null
+
+        Returns: The next_change_id, or None if nothing has been saved yet.
+        """
+        return self._read().get('next_change_id')
+
+    def load_batches(self):
+        """ This reads the buffered batches that were saved with the
+        checkpoint but not confirmed as written.
+
+        Args: Null
+
+        Returns: A list of [token, unique_items] pairs.
+        """
+        batches = self._read().get('batches', [])
+        for _, items in batches:
+            for entry in items.values():
+                entry['quantity'] = decimal.Decimal(entry['quantity'])
+        return batches
+
+    def save(self, next_change_id, batches=None):
+        """ This writes the next_change_id (and the unwritten batches) to a
+        temporary file, flushes it to disk and then moves it over the old
+        checkpoint.
+
+        Args: The next_change_id to resume from and the batches that every
+        page before it is waiting on.
+
+        Returns: Null
+        """
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as checkpoint:
+            json.dump({
+                'next_change_id': next_change_id,
+                'batches': batches or [],
+                'saved': time.time()
+            }, checkpoint, cls=DecimalEncoder)
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.replace(temp_path, self.path)
+
+
+class StashPipeline():
+    """ A long running ingestion of the public stash API in three stages,
+    each on its own thread:
+
+        fetcher: follows next_change_id and downloads the pages.
+        parser: adds the quantities of every page up in a StashCounts.
+        writer: adds the quantities to the table with update_table(bulk=True)
+            and then checkpoints the next_change_id.
+
+    The stages are joined by bounded queues, so a slow writer makes the
+    fetcher wait instead of piling pages up in memory. Every page is written
+    with its own change id as the write token, so if the process dies half
+    way through a page, the page is sent again on restart and the rows that
+    were already written are skipped instead of counted twice.
+
+    With a QuantityBuffer the writer merges pages in the buffer instead and
+    only writes when it flushes. The sealed batches are saved with the
+    checkpoint before they are written, and a restart sends them again with
+    their own tokens before reading any new pages.
+
+    With a top_table the writer also keeps the smaller PoE_top_items table
+    up to date after every write, from the TopItemsView of the db.
+
+    With stream=True the fetcher adds the quantities up while each page is
+    downloading (see StashStream) and hands them straight to the writer, so
+    a page is never held in memory as a whole and the parser stage is idle.
+
+    With an archive (see PoE_Archive.StashArchive) every page is also saved
+    as it was downloaded, so it can be replayed later without the API.
+
+    Args: The DynamoDB object (or anything with the same update_table), a
+    checkpoint with load()/save(), the change id to start from when there is
+    no checkpoint, the API URL, the size of the queues, the number of writer
+    threads, how long to wait when the API has no new pages, an optional
+    QuantityBuffer, an optional DynamoDB object for the top items table,
+    if the pages should be parsed as they are downloaded, the StashClient
+    to download them with and an optional archive to save the pages in.
+    """
+
+    def __init__(self, db, checkpoint, start_id='0', stash_url=STASH_URL,
+                 queue_size=4, max_workers=8, poll_interval=2.0, buffer=None,
+                 top_table=None, stream=False, client=None, archive=None):
+        self.db = db
+        self.archive = archive
+        self.stream = stream
+        self.client = client if client is not None else StashClient()
+        self.top_table = top_table
+        if top_table is not None and db.top_view is None:
+            db.track_top_items()
+        self.buffer = buffer
+        self.buffered_id = None
+        if buffer is not None:
+            buffer.journal = self._journal
+        self.checkpoint = checkpoint
+        self.start_id = start_id
+        self.stash_url = stash_url
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.pages = queue.Queue(maxsize=queue_size)
+        self.quantities = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.error = None
+        self.lock = threading.Lock()
+        self.counts = {
+            "pages": 0,
+            "items": 0,
+            "writes": 0,
+            "skipped": 0
+        }
+        self.next_change_id = None
+        self.started = None
+
+    def fetch_page(self, change_id):
+        """ This downloads one page of the public stash API.
+
+        Args: The change id of the page.
+
+        Returns: The page as a JSON object.
+        """
+        raw = self.client.get("{}?id={}".format(self.stash_url, change_id))
+        page = load_JSON(raw)
+        if self.archive is not None:
+            self.archive.append(
+                change_id, raw, get_next_id(page),
+                sum(len(stash['items']) for stash in page['stashes']))
+        return page
+
+    def fetch_quantities(self, change_id):
+        """ This downloads one page and adds its quantities up as it
+        arrives.
+
+        Args: The change id of the page.
+
+        Returns: The next change id, a StashCounts with the quantities and
+        the number of items on the page.
+        """
+        url = "{}?id={}".format(self.stash_url, change_id)
+        unique_items = StashCounts()
+        if self.archive is not None:
+            # The page has to be kept whole to be archived.
+            raw = self.client.get(url)
+            next_id, items = unique_items.add_stream(io.BytesIO(raw))
+            self.archive.append(change_id, raw, next_id, items)
+        else:
+            with self.client.open(url) as response:
+                next_id, items = unique_items.add_stream(response)
+        if next_id is None:
+            raise ValueError('Page {} has no next_change_id.'.format(change_id))
+        return next_id, unique_items, items
+
+    def _put(self, stage_queue, value):
+        # Blocks while the next stage is busy, but still notices a stop.
+        while not self.stop_event.is_set():
+            try:
+                stage_queue.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, stage_queue, on_idle=None):
+        while not self.stop_event.is_set():
+            try:
+                return stage_queue.get(timeout=0.1)
+            except queue.Empty:
+                if on_idle is not None:
+                    on_idle()
+        return _DONE
+
+    def _fail(self, error):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.stop_event.set()
+
+    def _fetcher(self, max_pages):
+        try:
+            change_id = self.checkpoint.load() or self.start_id
+            fetched = 0
+            while not self.stop_event.is_set():
+                if max_pages is not None and fetched >= max_pages:
+                    break
+                if self.stream:
+                    next_id, unique_items, items = self.fetch_quantities(
+                        change_id)
+                    if next_id == change_id and not items:
+                        self.stop_event.wait(self.poll_interval)
+                        continue
+                    # Already parsed, so it goes straight to the writer.
+                    if not self._put(self.quantities,
+                                     (change_id, next_id, unique_items, items)):
+                        break
+                    fetched += 1
+                    change_id = next_id
+                    continue
+                page = self.fetch_page(change_id)
+                next_id = get_next_id(page)
+                if next_id == change_id and not page.get('stashes'):
+                    # We have caught up with the API.
+                    self.stop_event.wait(self.poll_interval)
+                    continue
+                if not self._put(self.pages, (change_id, next_id, page)):
+                    break
+                fetched += 1
+                change_id = next_id
+        except Exception as error:
+            self._fail(error)
+        finally:
+            self._put(self.pages, _DONE)
+
+    def _parser(self):
+        try:
+            while True:
+                entry = self._get(self.pages)
+                if entry is _DONE:
+                    break
+                change_id, next_id, page = entry
+                unique_items = StashCounts()
+                items = unique_items.add_page(page)
+                if not self._put(self.quantities,
+                                 (change_id, next_id, unique_items, items)):
+                    break
+        except Exception as error:
+            self._fail(error)
+        finally:
+            self._put(self.quantities, _DONE)
+
+    def _writer(self):
+        try:
+            if self.buffer is not None:
+                self.buffered_id = self.checkpoint.load() or self.start_id
+                self.buffer.restore(self.checkpoint.load_batches())
+                if self.buffer.batches:
+                    self._count(self.buffer.flush())
+            while True:
+                entry = self._get(self.quantities, self._flush_if_due)
+                if entry is _DONE:
+                    break
+                change_id, next_id, unique_items, items = entry
+                if self.buffer is None:
+                    summary = self.write(unique_items, change_id)
+                    self.checkpoint.save(next_id)
+                    with self.lock:
+                        self.next_change_id = next_id
+                else:
+                    self.buffered_id = next_id
+                    summary = self.buffer.add(unique_items)
+                self._count(summary, items)
+            if self.buffer is not None:
+                summary = self.buffer.flush()
+                self._count(summary)
+                if summary['failed']:
+                    raise RuntimeError(
+                        '{} buffered items could not be written, they are '
+                        'saved in the checkpoint.'.format(
+                            len(summary['failed'])))
+        except Exception as error:
+            self._fail(error)
+
+    def _flush_if_due(self):
+        if self.buffer is not None and self.buffer.due():
+            self._count(self.buffer.flush())
+
+    def _journal(self, batches):
+        # Called by the buffer before and after every flush.
+        self.checkpoint.save(self.buffered_id, batches)
+        if not batches:
+            with self.lock:
+                self.next_change_id = self.buffered_id
+
+    def _count(self, summary, items=None):
+        with self.lock:
+            if items is not None:
+                self.counts['pages'] += 1
+                self.counts['items'] += items
+            if summary is not None:
+                self.counts['writes'] += summary['writes']
+                self.counts['skipped'] += summary['skipped']
+        if summary and summary['writes'] and self.top_table is not None:
+            self.db.top_view.sync(self.db, self.top_table)
+
+    def write(self, unique_items, token, attempts=5):
+        """ This writes the quantities of one page and sends any rows that
+        failed again. The token makes sending them again safe.
+
+        Args: The StashCounts of the page, the write token and how many times
+        to try.
+
+        Returns: The summary from update_table(bulk=True), added up over the
+        attempts.
+        """
+        total = {"writes": 0, "skipped": 0, "failed": []}
+        pending = unique_items
+        for _ in range(attempts):
+            summary = self.db.update_table(
+                pending, bulk=True, max_workers=self.max_workers, token=token)
+            total['writes'] += summary['writes']
+            total['skipped'] += summary['skipped']
+            total['failed'] = summary['failed']
+            if not total['failed']:
+                return total
+            pending = pending.split(total['failed'])[0]
+        raise RuntimeError('{} items on page {} could not be written.'.format(
+            len(total['failed']), token))
+
+    def start(self, max_pages=None):
+        """ This starts the three stages in the background.
+
+        Args: Stop after this many pages, or None to run until stop().
+
+        Returns: Null
+        """
+        self.started = time.monotonic()
+        self.threads = [
+            threading.Thread(target=self._fetcher, args=(max_pages,),
+                             name='stash-fetcher', daemon=True),
+            threading.Thread(target=self._parser,
+                             name='stash-parser', daemon=True),
+            threading.Thread(target=self._writer,
+                             name='stash-writer', daemon=True)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """ This asks every stage to stop. A page that is being written is
+        not checkpointed, so it is written again on the next run.
+
+        Args: Null
+
+        Returns: Null
+        """
+        self.stop_event.set()
+
+    def join(self, timeout=None):
+        """ This waits for the stages to finish and raises the first error
+        any of them hit.
+
+        Args: An optional timeout in seconds.
+
+        Returns: Null
+        """
+        for thread in self.threads:
+            thread.join(timeout)
+        if self.error is not None:
+            raise self.error
+
+    def run(self, max_pages=None, report_every=30.0):
+        """ This runs the pipeline in the foreground and prints the stats
+        every report_every seconds until it stops or is interrupted.
+
+        Args: Stop after this many pages, or None to run until interrupted,
+        and the number of seconds between reports.
+
+        Returns: The final stats().
+        """
+        self.start(max_pages)
+        try:
+            while any(thread.is_alive() for thread in self.threads):
+                self.threads[-1].join(report_every)
+                print(self.format_stats())
+        except KeyboardInterrupt:
+            self.stop()
+        self.join()
+        return self.stats()
+
+    def stats(self):
+        """ This reports the progress of the pipeline.
+
+        Args: Null
+
+        Returns: A Dict of the form:
+        {
+            "pages": pages,
+            "items": items,
+            "writes": writes,
+            "skipped": skipped,
+            "pages_per_sec": pages_per_sec,
+            "items_per_sec": items_per_sec,
+            "elapsed": seconds,
+            "next_change_id": next_change_id,
+            "http": client.stats()
+        }
+        """
+        with self.lock:
+            stats = dict(self.counts)
+            stats['next_change_id'] = self.next_change_id
+        elapsed = 0.0
+        if self.started is not None:
+            elapsed = time.monotonic() - self.started
+        stats['elapsed'] = elapsed
+        stats['pages_per_sec'] = stats['pages'] / elapsed if elapsed else 0.0
+        stats['items_per_sec'] = stats['items'] / elapsed if elapsed else 0.0
+        stats['http'] = self.client.stats()
+        return stats
+
+    def format_stats(self):
+        stats = self.stats()
+        return "{} pages ({:.2f}/sec), {} items ({:.1f}/sec), next id {}.".format(
+            stats['pages'], stats['pages_per_sec'],
+            stats['items'], stats['items_per_sec'],
+            stats['next_change_id']
+        )
+
+
+if __name__ == '__main__':
+    # python PoE_Ingest.py <table> <checkpoint file> [start id] [top table]
+    if len(sys.argv) < 3:
+        print('usage: python PoE_Ingest.py <table> <checkpoint file> '
+              '[start id] [top table]')
+        sys.exit(1)
+    db = DynamoDB(sys.argv[1])
+    db.rate_controller = RateController.for_table(db.table)
+    pipeline = StashPipeline(
+        db,
+        FileCheckpoint(sys.argv[2]),
+        start_id=sys.argv[3] if len(sys.argv) > 3 else '0',
+        buffer=QuantityBuffer(db),
+        top_table=DynamoDB(sys.argv[4]) if len(sys.argv) > 4 else None,
+        stream=True
+    )
+    print(pipeline.run())
@@ -0,0 +1,293 @@
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+from AWS_Classes import (
+    DynamoDB,
+    StashCounts,
+    create_unique_ilvl_str,
+    take_top_items
+)
+
+
+# The first bytes of every snapshot file, then the length of the JSON header.
+MAGIC = b'POESNAP1'
+PREFIX = struct.Struct('<8sQ')
+
+# Columns start on a multiple of this, so they can be cast in place.
+ALIGN = 8
+
+
+def _pad(length):
+    return -length % ALIGN
+
+
+def write_snapshot(path, counts, table=None):
+    """ This writes the rows of a StashCounts to a snapshot file, sorted by
+    Unique_ID like the table's top items. The file is a JSON header and then
+    one column per field: the item column holds numbers into a zlib
+    compressed list of the distinct names, and the ilvl and quantity columns
+    are plain arrays, so a reader can memory map them without decompressing
+    anything. Unique_ID is not stored because create_unique_ilvl_str() makes
+    it from the item and ilvl.
+
+    The file is written next to path and renamed over it once it is
+    complete, so a reader never sees half of a snapshot.
+
+    Args: The path of the file, the StashCounts and the name of the table
+    the rows came from.
+
+    Returns: The header of the snapshot.
+    """
+    names = counts.names
+    order = sorted(
+        range(len(counts)),
+        key=lambda slot: create_unique_ilvl_str(
+            counts.ilvls[slot], names[counts.name_of[slot]])
+    )
+    item_type = 'H' if len(names) <= 0xFFFF else 'I'
+    blocks = [
+        ('names', zlib.compress(json.dumps(names).encode('utf-8'))),
+        ('item', array.array(item_type,
+                             (counts.name_of[slot] for slot in order))),
+        ('ilvl', array.array('H', (counts.ilvls[slot] for slot in order))),
+        ('quantity', array.array('q',
+                                 (counts.quantities[slot] for slot in order)))
+    ]
+    header = {
+        "version": 1,
+        "table": table,
+        "created": time.time(),
+        "rows": len(order),
+        "byteorder": sys.byteorder,
+        "columns": {}
+    }
+    offset = 0
+    for name, block in blocks:
+        length = len(block) * getattr(block, 'itemsize', 1)
+        header['columns'][name] = {
+            "offset": offset,
+            "length": length,
+            "type": getattr(block, 'typecode', None)
+        }
+        offset += length + _pad(length)
+    encoded = json.dumps(header).encode('utf-8')
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as snapshot:
+        snapshot.write(PREFIX.pack(MAGIC, len(encoded)))
+        snapshot.write(encoded + b'\0' * _pad(PREFIX.size + len(encoded)))
+        for name, block in blocks:
+            data = block if isinstance(block, bytes) else block.tobytes()
+            snapshot.write(data + b'\0' * _pad(len(data)))
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(temp_path, path)
+    return header
+
+
+class Snapshot():
+    """ A snapshot file opened for reading. The columns are memory mapped,
+    so opening a snapshot of millions of rows only reads the header and the
+    name list, and the OS pages the columns in as they are walked. The rows
+    are in Unique_ID order (highest ilvl first), the order find_top_quantity()
+    reads the table in, so the top items are the first rows of the file.
+
+    Args: The path of the snapshot file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = PREFIX.unpack_from(self.map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('{} is not a snapshot file.'.format(path))
+        self.header = json.loads(
+            self.map[PREFIX.size:PREFIX.size + header_length])
+        if self.header['byteorder'] != sys.byteorder:
+            self.close()
+            raise ValueError('{} was written on a {} endian machine.'.format(
+                path, self.header['byteorder']))
+        start = PREFIX.size + header_length
+        start += _pad(start)
+        # Every view of the map has to be released before it can be closed.
+        self.views = [memoryview(self.map)]
+        self.columns = {}
+        for name, column in self.header['columns'].items():
+            begin = start + column['offset']
+            self.views.append(self.views[0][begin:begin + column['length']])
+            if column['type'] is None:
+                self.columns[name] = self.views[-1]
+            else:
+                self.views.append(self.views[-1].cast(column['type']))
+                self.columns[name] = self.views[-1]
+        self.names = json.loads(zlib.decompress(self.columns.pop('names')))
+
+    def __len__(self):
+        return self.header['rows']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ This releases the memory map and closes the file.
+
+        Args: Null
+
+        Returns: Null
+        """
+        for view in reversed(getattr(self, 'views', [])):
+            view.release()
+        self.views = []
+        self.columns = {}
+        if not self.map.closed:
+            self.map.close()
+        self.file.close()
+
+    def rows(self, start=0):
+        """ This walks the rows in Unique_ID order.
+
+        Args: The position of the first row.
+
+        Returns: A generator of Dicts with a Unique_ID, item, ilvl and
+        quantity.
+        """
+        names = self.names
+        items = self.columns['item']
+        ilvls = self.columns['ilvl']
+        quantities = self.columns['quantity']
+        for row in range(start, len(self)):
+            item = names[items[row]]
+            ilvl = ilvls[row]
+            yield {
+                "Unique_ID": create_unique_ilvl_str(ilvl, item),
+                "item": item,
+                "ilvl": ilvl,
+                "quantity": quantities[row]
+            }
+
+    def top_items(self, number_of_items=20):
+        """ This is find_top_quantity() answered from the snapshot. Only the
+        rows up to the cut off are read.
+
+        Args: The number of items wanted.
+
+        Returns: The list take_top_items() returns.
+        """
+        return take_top_items(self.rows(), number_of_items)
+
+    def totals(self, by='ilvl'):
+        """ This adds up the quantity of every row by ilvl or by item.
+
+        Args: 'ilvl' or 'item'.
+
+        Returns: A Dict of ilvl or item name to its total quantity.
+        """
+        if by not in ('ilvl', 'item'):
+            raise ValueError("by must be 'ilvl' or 'item'.")
+        sums = {}
+        for key, quantity in zip(self.columns[by], self.columns['quantity']):
+            sums[key] = sums.get(key, 0) + quantity
+        if by == 'item':
+            return {self.names[key]: total for key, total in sums.items()}
+        return sums
+
+    def summary(self):
+        """ This describes the snapshot.
+
+        Args: Null
+
+        Returns: A Dict with the table, when it was taken, the number of rows
+        and distinct item names, the rows in stock and the total quantity.
+        """
+        quantities = self.columns['quantity']
+        return {
+            "table": self.header['table'],
+            "created": self.header['created'],
+            "rows": len(self),
+            "names": len(self.names),
+            "in_stock": sum(1 for quantity in quantities if quantity > 0),
+            "quantity": sum(quantities)
+        }
+
+
+def export_snapshot(db, path, total_segments=None, max_workers=None):
+    """ This copies the table into a snapshot file with a parallel scan, see
+    DynamoDB.live_items(). The rows are gathered in a StashCounts, so the
+    names are interned and the table is never held as Dicts. Like
+    live_items() the copy is not of one point in time, so the table should
+    not be written to while it runs if the snapshot has to be exact.
+
+    Args: The DynamoDB object, the path of the file and the number of scan
+    segments and threads.
+
+    Returns: The header of the snapshot.
+    """
+    started = time.monotonic()
+    counts = StashCounts()
+    for row in db.live_items(total_segments, max_workers):
+        counts.add(row['item'], row['ilvl'], int(row['quantity']))
+        if len(counts) % 100000 == 0:
+            print('{} rows read.'.format(len(counts)))
+    header = write_snapshot(path, counts, table=db.table_id)
+    print('{} rows from {} saved to {} in {:.1f} seconds.'.format(
+        header['rows'], db.table_id, path, time.monotonic() - started
+    )
+    )
+    return header
+
+
+def import_snapshot(path, db, max_workers=8):
+    """ This loads a snapshot into a table with batched writes, see
+    DynamoDB.put_rows(). Rows in the table that are not in the snapshot are
+    left alone, so empty the table first to get an exact copy.
+
+    Args: The path of the file, the DynamoDB object and the number of writer
+    threads.
+
+    Returns: The number of rows written.
+    """
+    with Snapshot(path) as snapshot:
+        return db.put_rows(snapshot.rows(), max_workers=max_workers)
+
+
+if __name__ == '__main__':
+    # python PoE_Snapshot.py export <table> <snapshot>
+    # python PoE_Snapshot.py import <snapshot> <table>
+    # python PoE_Snapshot.py top <snapshot> [number of items] [top table]
+    usage = ('usage: python PoE_Snapshot.py export <table> <snapshot>\n'
+             '       python PoE_Snapshot.py import <snapshot> <table>\n'
+             '       python PoE_Snapshot.py top <snapshot> [number of items] [top table]')
+    if len(sys.argv) < 3 or sys.argv[1] not in ('export', 'import', 'top'):
+        print(usage)
+        sys.exit(1)
+    if sys.argv[1] == 'export':
+        if len(sys.argv) < 4:
+            print(usage)
+            sys.exit(1)
+        export_snapshot(DynamoDB(sys.argv[2]), sys.argv[3])
+    elif sys.argv[1] == 'import':
+        if len(sys.argv) < 4:
+            print(usage)
+            sys.exit(1)
+        import_snapshot(sys.argv[2], DynamoDB(sys.argv[3]))
+    else:
+        with Snapshot(sys.argv[2]) as stash_snapshot:
+            top_items = stash_snapshot.top_items(
+                int(sys.argv[3]) if len(sys.argv) > 3 else 20)
+        if len(sys.argv) > 4:
+            # Re-seeds a top items table without emptying it first, see
+            # DynamoDB.replace_top_items().
+            DynamoDB(sys.argv[4]).replace_top_items(top_items)
+        else:
+            print(json.dumps(top_items, indent=2))
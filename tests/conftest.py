@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# The modules live in the top of the repo, not in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from AWS_Classes import DynamoDB, create_item_table  # noqa: E402
+from Local_Backends import MemoryResource  # noqa: E402
+
+
+@pytest.fixture
+def make_db():
+    """ Makes a DynamoDB object for a new PoE_items table on its own
+    MemoryResource. The options are passed to DynamoDB(), and shards and
+    top_index to create_item_table() as well.
+    """
+    def make(**options):
+        resource = MemoryResource()
+        create_item_table('PoE_items', shards=options.get('shards'),
+                          top_index=options.get('top_index', False),
+                          resource=resource)
+        return DynamoDB('PoE_items', resource=resource, **options)
+    return make
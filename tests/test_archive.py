@@ -0,0 +1,135 @@
+import json
+
+import PoE_Archive
+from PoE_Archive import StashArchive, record, replay
+
+
+def page(next_id, names=()):
+    return json.dumps({
+        "next_change_id": next_id,
+        "stashes": [{"items": [{"name": name, "ilvl": 80} for name in names]}]
+        if names else []
+    }).encode('utf-8')
+
+
+class FakeClient():
+    """ Hands out the pages for each change id in order, repeating the
+    last one. """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def get(self, url):
+        change_id = url.rsplit('=', 1)[1]
+        self.calls.append(change_id)
+        responses = self.pages[change_id]
+        return responses.pop(0) if len(responses) > 1 else responses[0]
+
+
+def test_append_and_read_back(tmp_path):
+    archive = StashArchive(str(tmp_path / 'stash'))
+    raw = page('2', ['Kaom\'s Heart', 'Tabula Rasa'])
+    entry = archive.append('1', raw)
+    assert entry['next'] == '2' and entry['items'] == 2
+    assert archive.append('1', raw) == entry
+    assert archive.read('1') == raw
+    assert StashArchive(str(tmp_path / 'stash')).last_id() == '2'
+
+
+def test_caught_up_page_is_not_archived(tmp_path):
+    archive = StashArchive(str(tmp_path / 'stash'))
+    assert archive.append('5', page('5')) is None
+    assert len(archive) == 0 and '5' not in archive
+    assert archive.append('5', page('6', ['Headhunter']))['items'] == 1
+
+
+def test_record_waits_for_the_real_page(tmp_path):
+    archive = StashArchive(str(tmp_path / 'stash'))
+    client = FakeClient({
+        '0': [page('1', ['Mageblood'])],
+        '1': [page('1'), page('1'), page('2', ['Headhunter'])],
+        '2': [page('3', ['Tabula Rasa'])]
+    })
+    assert record(archive, client=client, max_pages=3, poll_interval=0) == 3
+    assert client.calls == ['0', '1', '1', '1', '2']
+    assert [entry['id'] for entry in archive.chain()] == ['0', '1', '2']
+    assert archive.read('1') == page('2', ['Headhunter'])
+
+
+def test_old_caught_up_entry_is_ignored(tmp_path):
+    path = str(tmp_path / 'stash')
+    archive = StashArchive(path)
+    archive.append('0', page('1', ['Mageblood']))
+    # An archive written before caught up pages were skipped.
+    first = archive.entries[0]
+    raw = page('1')
+    with open(path, 'ab') as data:
+        data.write(b'junk')
+    with open(path + '.idx', 'a') as index:
+        index.write(json.dumps({'id': '1', 'next': '1',
+                                'offset': first['offset'] + first['length'],
+                                'length': 4, 'items': 0, 'size': len(raw),
+                                'saved': 0}) + '\n')
+    archive = StashArchive(path)
+    assert archive.last_id() == '1' and '1' not in archive
+    archive.append('1', page('2', ['Headhunter']))
+    archive = StashArchive(path)
+    assert archive.read('1') == page('2', ['Headhunter'])
+    assert [entry['id'] for entry in archive.chain()] == ['0', '1']
+
+
+
+class InlineExecutor():
+    """ Stands in for the process pool: runs every task as it is submitted
+    and records the most results that were waiting to be collected. """
+
+    def __init__(self, max_workers=None):
+        self.waiting = set()
+        self.most_waiting = 0
+
+    def submit(self, function, *args):
+        result = InlineResult(self, function(*args))
+        self.waiting.add(result)
+        self.most_waiting = max(self.most_waiting, len(self.waiting))
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class InlineResult():
+    """ The finished task of an InlineExecutor. """
+
+    def __init__(self, executor, value):
+        self.executor = executor
+        self.value = value
+
+    def result(self):
+        self.executor.waiting.discard(self)
+        return self.value
+
+
+def test_replay_keeps_few_tasks_in_flight(tmp_path, monkeypatch, make_db):
+    executors = []
+
+    def make_executor(max_workers):
+        executor = InlineExecutor(max_workers)
+        executors.append(executor)
+        return executor
+
+    monkeypatch.setattr(PoE_Archive, 'ProcessPoolExecutor', make_executor)
+    archive = StashArchive(str(tmp_path / 'stash'))
+    for number in range(10):
+        archive.append(str(number), page(str(number + 1),
+                                         ['Mageblood', 'Headhunter']))
+    db = make_db()
+    result = replay(archive, db, '0', processes=2, pages_per_task=1)
+    assert result['pages'] == 10 and result['items'] == 20
+    assert db.get_item('Mageblood', 80)['quantity'] == 10
+    # Two tasks per process at most, and every result was collected.
+    assert executors[0].most_waiting == 4
+    assert not executors[0].waiting
@@ -0,0 +1,79 @@
+import pytest
+
+import AWS_Classes
+from AWS_Classes import TOP_INDEX, create_unique_ilvl_str
+
+
+def fill(db, count):
+    db.update_table({
+        create_unique_ilvl_str(80, 'Item {}'.format(number)): {
+            "item": 'Item {}'.format(number), "ilvl": 80, "quantity": 1}
+        for number in range(count)}, bulk=True)
+
+
+def batch_sizes(db, unprocessed=0):
+    # Records the size of every BatchWriteItem call, and hands the last
+    # unprocessed requests of the first call back like a busy table.
+    sizes = []
+    batch_write_item = db.dynamodb.batch_write_item
+
+    def recording_batch_write_item(RequestItems, **kwargs):
+        requests = RequestItems[db.table_id]
+        sizes.append(len(requests))
+        if len(sizes) == 1 and unprocessed:
+            response = batch_write_item(
+                RequestItems={db.table_id: requests[:-unprocessed]}, **kwargs)
+            response['UnprocessedItems'] = {
+                db.table_id: requests[-unprocessed:]}
+            return response
+        return batch_write_item(RequestItems=RequestItems, **kwargs)
+
+    db.dynamodb.batch_write_item = recording_batch_write_item
+    return sizes
+
+
+def test_deletes_in_batches_of_25(make_db, capsys):
+    db = make_db()
+    fill(db, 60)
+    sizes = batch_sizes(db)
+    assert db.delete_items(max_workers=2) == 60
+    assert sorted(sizes) == [10, 25, 25]
+    assert list(db.scan_items()) == []
+    assert capsys.readouterr().out.splitlines()[-1] == 'removed 60 items'
+
+
+def test_unprocessed_deletes_are_sent_again(make_db, monkeypatch):
+    monkeypatch.setattr(AWS_Classes, '_backoff', lambda retries: None)
+    db = make_db()
+    fill(db, 25)
+    sizes = batch_sizes(db, unprocessed=5)
+    assert db.delete_items() == 25
+    assert sizes == [25, 5]
+    assert list(db.scan_items()) == []
+
+
+def test_a_failed_batch_is_raised(make_db, monkeypatch):
+    monkeypatch.setattr(AWS_Classes, '_backoff', lambda retries: None)
+    db = make_db()
+    fill(db, 3)
+
+    def busy_batch_write_item(RequestItems, **kwargs):
+        return {'UnprocessedItems': RequestItems}
+
+    db.dynamodb.batch_write_item = busy_batch_write_item
+    with pytest.raises(RuntimeError):
+        db.delete_items()
+
+
+def test_recreate_keeps_the_top_index(make_db):
+    db = make_db(shards=4, top_index=True)
+    fill(db, 10)
+    old_table = db.table
+    db.delete_items(recreate=True)
+    assert db.table is not old_table
+    assert [index['IndexName']
+            for index in db.table.global_secondary_indexes] == [TOP_INDEX]
+    assert list(db.scan_items()) == []
+    fill(db, 3)
+    assert [row['item'] for row in db.find_top_page()['items']] == [
+        'Item 0', 'Item 1', 'Item 2']
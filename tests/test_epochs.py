@@ -0,0 +1,45 @@
+import pytest
+
+from AWS_Classes import DynamoDB, create_unique_ilvl_str
+
+
+def deltas(quantity):
+    return {create_unique_ilvl_str(80, 'Mageblood'): {
+        "item": 'Mageblood', "ilvl": 80, "quantity": quantity}}
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_write_after_another_writers_reset(make_db, bulk):
+    first = make_db(epochs=True, generation_ttl=3600)
+    second = DynamoDB('PoE_items', resource=first.dynamodb, epochs=True,
+                      generation_ttl=3600)
+    second.update_table(deltas(3), bulk=bulk)
+    assert second.current_generation() == 0
+
+    first.reset_table()
+    first.update_table(deltas(5), bulk=bulk)
+    # second still has generation 0 cached.
+    second.update_table(deltas(1), bulk=bulk)
+    assert first.get_item('Mageblood', 80)['quantity'] == 6
+    assert second.current_generation() == 1
+
+
+def test_put_item_after_another_writers_reset(make_db):
+    first = make_db(epochs=True, generation_ttl=3600)
+    second = DynamoDB('PoE_items', resource=first.dynamodb, epochs=True,
+                      generation_ttl=3600)
+    second.put_item('Mageblood', 80, 3)
+    first.reset_table()
+    first.update_table(deltas(5))
+    second.put_item('Mageblood', 80, 7)
+    assert first.get_item('Mageblood', 80)['quantity'] == 7
+    assert second.current_generation() == 1
+
+
+def test_reset_rows_start_over(make_db):
+    db = make_db(epochs=True)
+    db.update_table(deltas(4))
+    db.reset_table()
+    assert db.get_item('Mageblood', 80)['quantity'] == 0
+    db.update_table(deltas(2))
+    assert db.get_item('Mageblood', 80)['quantity'] == 2
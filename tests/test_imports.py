@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+
+LAZY = ['asyncio', 'concurrent.futures', 'email.utils', 'http.client',
+        'logging', 'urllib.request']
+
+# Runs in a fresh interpreter, since the other tests import these modules.
+# botocore is imported first when it is installed, as it loads some of them
+# itself.
+CODE = '''
+import sys
+try:
+    import botocore.exceptions
+except ImportError:
+    pass
+before = set(sys.modules)
+import AWS_Classes
+print(" ".join(name for name in {!r}
+               if name in sys.modules and name not in before))
+'''
+
+
+def test_heavy_modules_are_imported_lazily():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', CODE.format(LAZY)],
+                            cwd=root, capture_output=True, text=True,
+                            check=True)
+    assert output.stdout.split() == []
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from AWS_Classes import DynamoDB, ItemCache, create_unique_ilvl_str
+
+
+def count_reads(db):
+    reads = []
+    get_item = db.table.get_item
+
+    def counting_get_item(**kwargs):
+        if kwargs['Key']['Unique_ID'] != '#generation':
+            reads.append(kwargs['Key']['Unique_ID'])
+        return get_item(**kwargs)
+
+    db.table.get_item = counting_get_item
+    return reads
+
+
+def deltas(quantity, name='Mageblood'):
+    return {create_unique_ilvl_str(80, name): {
+        "item": name, "ilvl": 80, "quantity": quantity}}
+
+
+def test_hits_and_missing_items_are_cached(make_db):
+    db = make_db(cache_size=16)
+    db.put_item('Mageblood', 80, 2)
+    reads = count_reads(db)
+    assert db.get_item('Mageblood', 80)['quantity'] == 2
+    assert db.get_item('Mageblood', 80)['quantity'] == 2
+    assert 'message' in db.get_item('Headhunter', 80)
+    assert 'message' in db.get_item('Headhunter', 80)
+    assert len(reads) == 2
+    assert db.cache_stats()['hits'] == 2
+
+
+def test_entries_expire():
+    cache = ItemCache(max_size=4, ttl=0.01)
+    _, version = cache.get('a')
+    cache.put('a', {'quantity': 1}, version)
+    assert cache.get('a') == (True, {'quantity': 1})
+    time.sleep(0.02)
+    assert cache.get('a')[0] is False
+
+
+def test_least_recently_used_is_evicted():
+    cache = ItemCache(max_size=2, ttl=60)
+    for key in 'abc':
+        cache.put(key, key, cache.get(key)[1])
+    assert cache.get('a')[0] is False
+    assert cache.get('c') == (True, 'c')
+    assert cache.stats()['evictions'] == 1
+
+
+def test_lookup_that_races_a_write_is_not_stored():
+    cache = ItemCache()
+    _, version = cache.get('a')
+    # A write clears the key while the read is on its way back.
+    cache.invalidate(['a'])
+    cache.put('a', {'quantity': 1}, version)
+    assert cache.get('a')[0] is False
+
+
+@pytest.mark.parametrize('write', [
+    lambda db: db.put_item('Mageblood', 80, 7),
+    lambda db: db.delete_item('Mageblood', 80),
+    lambda db: db.update_table(deltas(1)),
+    lambda db: db.update_table(deltas(1), bulk=True),
+    lambda db: db.reset_table(),
+    lambda db: db.delete_items(),
+    lambda db: db.put_rows([{'Unique_ID': create_unique_ilvl_str(
+        80, 'Mageblood'), 'item': 'Mageblood', 'ilvl': 80, 'quantity': 7}])
+])
+@pytest.mark.parametrize('options', [
+    {}, {'epochs': True, 'generation_ttl': 0}])
+def test_writes_from_another_object_clear_the_cache(make_db, write, options):
+    api = make_db(cache_size=16, **options)
+    writer = DynamoDB('PoE_items', resource=api.dynamodb, **options)
+    writer.put_item('Mageblood', 80, 1)
+    before = api.get_item('Mageblood', 80)
+    write(writer)
+    reads = count_reads(api)
+    after = api.get_item('Mageblood', 80)
+    assert reads == [create_unique_ilvl_str(80, 'Mageblood')]
+    assert after != before
+
+
+def test_objects_for_one_table_share_a_cache(make_db):
+    first = make_db(cache_size=16)
+    second = DynamoDB('PoE_items', resource=first.dynamodb, cache_size=16)
+    assert first.cache is second.cache
+    first.put_item('Mageblood', 80, 1)
+    first.get_item('Mageblood', 80)
+    reads = count_reads(second)
+    second.get_item('Mageblood', 80)
+    assert reads == []
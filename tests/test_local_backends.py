@@ -0,0 +1,256 @@
+import decimal
+
+import pytest
+
+from Local_Backends import BackendError, MemoryResource, SQLiteResource
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def resource(request):
+    if request.param == 'memory':
+        yield MemoryResource()
+    else:
+        sqlite_resource = SQLiteResource(':memory:')
+        yield sqlite_resource
+        sqlite_resource.close()
+
+
+def _create(resource):
+    return resource.create_table(
+        TableName='items',
+        KeySchema=[{'AttributeName': 'Unique_ID', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'Unique_ID', 'AttributeType': 'S'},
+            {'AttributeName': 'shard', 'AttributeType': 'N'},
+            {'AttributeName': 'quantity', 'AttributeType': 'N'}
+        ],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'top',
+            'KeySchema': [
+                {'AttributeName': 'shard', 'KeyType': 'HASH'},
+                {'AttributeName': 'quantity', 'KeyType': 'RANGE'}
+            ],
+            'Projection': {'ProjectionType': 'ALL'}
+        }]
+    )
+
+
+@pytest.fixture
+def table(resource):
+    table = _create(resource)
+    for number, name in enumerate(['Mageblood', 'Headhunter', 'Tabula Rasa',
+                                   'Goldrim', 'Wanderlust']):
+        table.put_item(Item={
+            'Unique_ID': '{:02d}{}'.format(number, name),
+            'item': name,
+            'ilvl': 80 + number,
+            'quantity': decimal.Decimal(number * 10),
+            'shard': number % 2
+        })
+    return table
+
+
+def _filter(table, expression, values=None, names=None):
+    kwargs = {'FilterExpression': expression}
+    if values:
+        kwargs['ExpressionAttributeValues'] = values
+    if names:
+        kwargs['ExpressionAttributeNames'] = names
+    return sorted(item['item'] for item in table.scan(**kwargs)['Items'])
+
+
+def test_comparisons(table):
+    assert _filter(table, 'ilvl >= :l', {':l': 83}) == [
+        'Goldrim', 'Wanderlust']
+    assert _filter(table, 'ilvl <> :l', {':l': 80}) == [
+        'Goldrim', 'Headhunter', 'Tabula Rasa', 'Wanderlust']
+    assert _filter(table, '#q < :q', {':q': 10}, {'#q': 'quantity'}) == [
+        'Mageblood']
+    # Different types never compare equal.
+    assert _filter(table, 'ilvl = :l', {':l': '80'}) == []
+
+
+def test_between_in_and_functions(table):
+    assert _filter(table, 'ilvl BETWEEN :a AND :b', {':a': 81, ':b': 82}) == [
+        'Headhunter', 'Tabula Rasa']
+    assert _filter(table, 'item IN (:a, :b)',
+                   {':a': 'Goldrim', ':b': 'Nothing'}) == ['Goldrim']
+    assert _filter(table, 'begins_with(Unique_ID, :p)', {':p': '04'}) == [
+        'Wanderlust']
+    assert _filter(table, 'attribute_not_exists(price)') == [
+        'Goldrim', 'Headhunter', 'Mageblood', 'Tabula Rasa', 'Wanderlust']
+
+
+def test_and_or_not_and_parentheses(table):
+    values = {':a': 80, ':b': 84, ':s': 1}
+    assert _filter(table, 'ilvl = :a OR ilvl = :b AND shard = :s',
+                   values) == ['Mageblood']
+    assert _filter(table, '(ilvl = :a OR ilvl = :b) AND NOT shard = :s',
+                   values) == ['Mageblood', 'Wanderlust']
+
+
+def test_bad_expressions_raise(table):
+    with pytest.raises(BackendError):
+        table.scan(FilterExpression='ilvl ! :l',
+                   ExpressionAttributeValues={':l': 80})
+    with pytest.raises(BackendError):
+        table.scan(FilterExpression='ilvl = ')
+
+
+def test_condition_expression(table):
+    key = {'Unique_ID': '00Mageblood'}
+    table.put_item(Item={'Unique_ID': '05Kaom', 'quantity': 1},
+                   ConditionExpression='attribute_not_exists(Unique_ID)')
+    with pytest.raises(BackendError) as error:
+        table.put_item(Item={'Unique_ID': '05Kaom', 'quantity': 2},
+                       ConditionExpression='attribute_not_exists(Unique_ID)')
+    assert error.value.response['Error']['Code'] == \
+        'ConditionalCheckFailedException'
+    with pytest.raises(BackendError):
+        table.update_item(Key=key, UpdateExpression='SET ilvl = :l',
+                          ConditionExpression='quantity > :q',
+                          ExpressionAttributeValues={':l': 1, ':q': 5})
+    assert table.get_item(Key=key)['Item']['ilvl'] == 80
+
+
+def test_set_add_remove_and_if_not_exists(table):
+    key = {'Unique_ID': '01Headhunter'}
+    table.update_item(
+        Key=key,
+        UpdateExpression='SET quantity = quantity + :one, '
+                         'price = if_not_exists(price, :p) '
+                         'ADD seen :one REMOVE shard',
+        ExpressionAttributeValues={':one': 1, ':p': 7}
+    )
+    table.update_item(
+        Key=key,
+        UpdateExpression='SET price = if_not_exists(price, :p) ADD seen :one',
+        ExpressionAttributeValues={':one': 1, ':p': 99}
+    )
+    item = table.get_item(Key=key)['Item']
+    assert item['quantity'] == 11
+    assert item['price'] == 7
+    assert item['seen'] == 2
+    assert 'shard' not in item
+    assert isinstance(item['quantity'], decimal.Decimal)
+
+    with pytest.raises(BackendError):
+        table.update_item(Key=key, UpdateExpression='SET missing = nope + :one',
+                          ExpressionAttributeValues={':one': 1})
+
+
+def test_return_values(table):
+    key = {'Unique_ID': '02Tabula Rasa'}
+    response = table.update_item(
+        Key=key, UpdateExpression='SET ilvl = :l, quantity = :q',
+        ExpressionAttributeValues={':l': 82, ':q': 25},
+        ReturnValues='UPDATED_NEW'
+    )
+    # ilvl did not change, but it was set, so it comes back too.
+    assert response['Attributes'] == {'ilvl': 82, 'quantity': 25}
+    response = table.update_item(
+        Key=key, UpdateExpression='SET quantity = :q REMOVE shard',
+        ExpressionAttributeValues={':q': 30}, ReturnValues='UPDATED_OLD'
+    )
+    assert response['Attributes'] == {'quantity': 25, 'shard': 0}
+    response = table.update_item(
+        Key={'Unique_ID': '09New'}, UpdateExpression='SET quantity = :q',
+        ExpressionAttributeValues={':q': 1}, ReturnValues='UPDATED_OLD'
+    )
+    assert 'Attributes' not in response
+    response = table.delete_item(Key=key, ReturnValues='ALL_OLD')
+    assert response['Attributes']['quantity'] == 30
+    assert 'Item' not in table.get_item(Key=key)
+
+
+def test_scan_pages_in_key_order(table):
+    seen = []
+    kwargs = {'Limit': 2}
+    while True:
+        response = table.scan(**kwargs)
+        seen.extend(item['Unique_ID'] for item in response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    assert seen == sorted(seen)
+    assert len(seen) == 5
+
+
+def test_segment_ends_without_a_last_key(table):
+    seen = []
+    for segment in range(3):
+        kwargs = {'Segment': segment, 'TotalSegments': 3}
+        count = len(table.scan(**kwargs)['Items'])
+        if not count:
+            continue
+        # A page that holds the rest of the segment is its last one, even
+        # when other segments have keys after it.
+        response = table.scan(Limit=count, **kwargs)
+        assert 'LastEvaluatedKey' not in response
+        seen.extend(item['Unique_ID'] for item in response['Items'])
+    assert len(seen) == 5
+
+
+def _query_index(table, shard, forward=True, limit=None, condition='',
+                 values=None):
+    kwargs = {
+        'IndexName': 'top',
+        'KeyConditionExpression': 'shard = :s' + condition,
+        'ExpressionAttributeValues': dict(values or {}, **{':s': shard}),
+        'ScanIndexForward': forward
+    }
+    if limit:
+        kwargs['Limit'] = limit
+    found = []
+    while True:
+        response = table.query(**kwargs)
+        found.extend(item['item'] for item in response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return found
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def test_index_query_order_and_pages(table):
+    assert _query_index(table, 0) == ['Mageblood', 'Tabula Rasa', 'Wanderlust']
+    assert _query_index(table, 0, forward=False, limit=1) == [
+        'Wanderlust', 'Tabula Rasa', 'Mageblood']
+    assert _query_index(table, 0, limit=2) == [
+        'Mageblood', 'Tabula Rasa', 'Wanderlust']
+    assert _query_index(table, 1, condition=' AND quantity > :q',
+                        values={':q': 10}) == ['Goldrim']
+    assert _query_index(table, 7) == []
+    with pytest.raises(BackendError):
+        table.query(IndexName='top', KeyConditionExpression='quantity > :q',
+                    ExpressionAttributeValues={':q': 1})
+
+
+def test_index_follows_writes(table):
+    assert _query_index(table, 0) == ['Mageblood', 'Tabula Rasa', 'Wanderlust']
+    table.update_item(Key={'Unique_ID': '00Mageblood'},
+                      UpdateExpression='SET quantity = :q',
+                      ExpressionAttributeValues={':q': 100})
+    table.update_item(Key={'Unique_ID': '02Tabula Rasa'},
+                      UpdateExpression='REMOVE shard')
+    table.delete_item(Key={'Unique_ID': '04Wanderlust'})
+    table.put_item(Item={'Unique_ID': '05Kaom', 'item': 'Kaom',
+                         'quantity': 5, 'shard': 0})
+    assert _query_index(table, 0) == ['Kaom', 'Mageblood']
+    response = table.scan(IndexName='top')
+    assert [item['item'] for item in response['Items']] == [
+        'Kaom', 'Mageblood', 'Headhunter', 'Goldrim']
+
+
+def test_index_is_rebuilt_from_a_reopened_sqlite_file(tmp_path):
+    path = str(tmp_path / 'items.db')
+    first = SQLiteResource(path)
+    table = _create(first)
+    table.put_item(Item={'Unique_ID': 'a', 'item': 'A', 'quantity': 2,
+                         'shard': 0})
+    table.put_item(Item={'Unique_ID': 'b', 'item': 'B', 'quantity': 1,
+                         'shard': 0})
+    first.close()
+    second = SQLiteResource(path)
+    try:
+        assert _query_index(second.Table('items'), 0) == ['B', 'A']
+    finally:
+        second.close()
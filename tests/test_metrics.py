@@ -0,0 +1,85 @@
+import logging
+
+import pytest
+
+from AWS_Classes import (
+    LoggingSink,
+    MemorySink,
+    Metrics,
+    SummarySink,
+    create_unique_ilvl_str
+)
+
+
+def deltas(*names):
+    return {create_unique_ilvl_str(80, name): {
+        "item": name, "ilvl": 80, "quantity": 1} for name in names}
+
+
+def test_memory_sink_adds_up_the_requests(make_db):
+    sink = MemorySink()
+    db = make_db(metrics=Metrics([sink]))
+    db.update_table(deltas('Mageblood', 'Headhunter'))
+    db.find_top_quantity(5)
+    totals = sink.snapshot(reset=True)
+    assert totals['update_table']['items'] == 2
+    assert totals['update_table']['calls'] == 1
+    assert totals['update_item']['requests'] == 2
+    assert totals['find_top_quantity']['items'] == 2
+    assert totals['find_top_quantity']['max_seconds'] >= 0.0
+    assert sink.snapshot() == {}
+
+
+def test_sinks_get_every_call():
+    records = []
+    memory = MemorySink()
+    metrics = Metrics()
+    assert not metrics.enabled
+    metrics.count('get_item', 'requests')
+    metrics.add_sink(memory)
+    metrics.add_sink(SummarySink(interval=3600.0, emit=records.append))
+    metrics.count('get_item', 'requests')
+    metrics.count('get_item', 'requests', 2)
+    # A count of nothing is not passed on.
+    metrics.count('get_item', 'errors', 0)
+    metrics.timing('get_item', 0.5)
+    assert memory.snapshot() == {'get_item': {
+        'requests': 3, 'calls': 1, 'seconds': 0.5, 'max_seconds': 0.5}}
+    assert records == []
+    metrics.flush()
+    assert records == [
+        'get_item: calls 1, max_seconds 0.5, requests 3, seconds 0.5']
+    metrics.flush()
+    assert len(records) == 1
+
+
+def test_summary_sink_emits_every_interval():
+    records = []
+    sink = SummarySink(interval=0.0, emit=records.append)
+    sink.count('scan', 'requests', 1)
+    sink.count('scan', 'requests', 1)
+    assert records == ['scan: requests 1', 'scan: requests 1']
+
+
+def test_logging_sink(caplog):
+    logger = logging.getLogger('test_metrics')
+    sink = LoggingSink(logger, logging.INFO)
+    with caplog.at_level(logging.INFO, logger='test_metrics'):
+        Metrics([sink]).count('put_item', 'retries', 2)
+        sink.timing('put_item', 0.25)
+    assert caplog.messages == ['put_item retries 2', 'put_item took 0.250s']
+
+
+@pytest.mark.parametrize('verbose', [False, True])
+def test_per_item_prints_need_verbose(make_db, capsys, verbose):
+    db = make_db(verbose=verbose)
+    db.update_table(deltas('Mageblood', 'Headhunter'))
+    db.find_top_quantity(5)
+    db.upload_stash({"stashes": [{"items": [{"name": "Goldrim",
+                                             "ilvl": 80}]}]})
+    lines = capsys.readouterr().out.splitlines()
+    assert 'Total number of writes to the table 2.' in lines
+    assert '1 new items inserted of 1 total items.' in lines
+    per_item = [line for line in lines
+                if line.startswith(('Item:', 'name:'))]
+    assert len(per_item) == (5 if verbose else 0)
@@ -0,0 +1,120 @@
+import io
+import json
+
+import pytest
+
+from AWS_Classes import (
+    QuantityBuffer,
+    create_unique_ilvl_str
+)
+from Local_Backends import BackendError
+from PoE_Ingest import FileCheckpoint, StashPipeline
+
+
+def page(next_id, names=()):
+    return json.dumps({
+        "next_change_id": next_id,
+        "stashes": [{"items": [{"name": name, "ilvl": 80} for name in names]}]
+    }).encode('utf-8')
+
+
+# A short chain of pages, ending with the API caught up at '3'.
+PAGES = {
+    '0': page('1', ['Mageblood', 'Headhunter']),
+    '1': page('2', ['Mageblood', 'Tabula Rasa', 'Mageblood']),
+    '2': page('3', ['Headhunter']),
+    '3': json.dumps({"next_change_id": '3', "stashes": []}).encode('utf-8')
+}
+
+
+class FakeClient():
+    """ Serves PAGES by change id, like StashClient does the API. """
+
+    def __init__(self):
+        self.calls = []
+
+    def get(self, url):
+        change_id = url.rsplit('=', 1)[1]
+        self.calls.append(change_id)
+        return PAGES[change_id]
+
+    def open(self, url):
+        return io.BytesIO(self.get(url))
+
+    def stats(self):
+        return {}
+
+
+def quantities(db):
+    return {row['item']: row['quantity'] for row in db.live_items()}
+
+
+def run(db, checkpoint, max_pages, **options):
+    pipeline = StashPipeline(db, checkpoint, client=FakeClient(),
+                             poll_interval=0.01, **options)
+    pipeline.start(max_pages)
+    pipeline.join(10)
+    return pipeline
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_checkpoint_and_resume(tmp_path, stream, make_db):
+    db = make_db()
+    checkpoint = FileCheckpoint(str(tmp_path / 'checkpoint.json'))
+    first = run(db, checkpoint, 2, stream=stream)
+    assert checkpoint.load() == '2'
+    assert first.stats()['pages'] == 2
+    second = run(db, checkpoint, 1, stream=stream)
+    assert second.client.calls == ['2']
+    assert checkpoint.load() == '3'
+    assert quantities(db) == {'Mageblood': 3, 'Headhunter': 2,
+                              'Tabula Rasa': 1}
+
+
+def test_failed_page_is_resent_without_double_counting(tmp_path, make_db):
+    db = make_db()
+    checkpoint = FileCheckpoint(str(tmp_path / 'checkpoint.json'))
+    table = db.table
+    update_item = table.update_item
+    tabula = create_unique_ilvl_str(80, 'Tabula Rasa')
+
+    def failing_update_item(**kwargs):
+        if kwargs['Key']['Unique_ID'] == tabula:
+            raise BackendError('ValidationException', 'Down.', 'UpdateItem')
+        return update_item(**kwargs)
+
+    table.update_item = failing_update_item
+    with pytest.raises(RuntimeError):
+        run(db, checkpoint, 3, max_workers=1)
+    # Page '1' was half written, so it is where the next run starts.
+    assert checkpoint.load() == '1'
+    assert quantities(db)['Mageblood'] == 3
+
+    table.update_item = update_item
+    resumed = run(db, checkpoint, 2, max_workers=1)
+    assert resumed.client.calls == ['1', '2']
+    assert resumed.stats()['skipped'] == 1
+    assert quantities(db) == {'Mageblood': 3, 'Headhunter': 2,
+                              'Tabula Rasa': 1}
+
+
+def test_buffered_batches_survive_a_restart(tmp_path, make_db):
+    db = make_db()
+    checkpoint = FileCheckpoint(str(tmp_path / 'checkpoint.json'))
+    mageblood = create_unique_ilvl_str(80, 'Mageblood')
+    headhunter = create_unique_ilvl_str(80, 'Headhunter')
+    batch = {
+        mageblood: {"item": 'Mageblood', "ilvl": 80, "quantity": 1},
+        headhunter: {"item": 'Headhunter', "ilvl": 80, "quantity": 1}
+    }
+    # The process died after writing half of a sealed batch.
+    db.update_table({mageblood: batch[mageblood]}, bulk=True, token='old-1')
+    checkpoint.save('1', [['old-1', batch]])
+    assert checkpoint.load_batches()[0][0] == 'old-1'
+
+    buffer = QuantityBuffer(db, max_age=3600)
+    pipeline = run(db, checkpoint, 2, buffer=buffer)
+    assert pipeline.client.calls == ['1', '2']
+    assert checkpoint.load() == '3' and checkpoint.load_batches() == []
+    assert quantities(db) == {'Mageblood': 3, 'Headhunter': 2,
+                              'Tabula Rasa': 1}
@@ -0,0 +1,146 @@
+import pickle
+import threading
+
+import pytest
+
+from AWS_Classes import (
+    MAX_ILVL,
+    QuantityBuffer,
+    StashCounts,
+    WRITE_TOKEN_KEY,
+    create_unique_ilvl_str
+)
+from Local_Backends import BackendError
+
+
+def deltas(*names):
+    unique_items = {}
+    for name in names:
+        unique = create_unique_ilvl_str(80, name)
+        entry = unique_items.setdefault(
+            unique, {"item": name, "ilvl": 80, "quantity": 0})
+        entry['quantity'] += 1
+    return unique_items
+
+
+def quantity(db, name):
+    return db.get_item(name, 80)['quantity']
+
+
+def test_same_token_is_skipped(make_db):
+    db = make_db()
+    first = db.update_table(deltas('Mageblood', 'Headhunter'), bulk=True,
+                            token='page-1')
+    again = db.update_table(deltas('Mageblood', 'Headhunter'), bulk=True,
+                            token='page-1')
+    assert first['writes'] == 2 and again['skipped'] == 2
+    assert quantity(db, 'Mageblood') == 1
+    db.update_table(deltas('Mageblood'), bulk=True, token='page-2')
+    assert quantity(db, 'Mageblood') == 2
+
+
+def test_ambiguous_failure_is_not_counted_twice(make_db):
+    db = make_db()
+    table = db.table
+    update_item = table.update_item
+    failures = []
+    headhunter = create_unique_ilvl_str(80, 'Headhunter')
+
+    def flaky_update_item(**kwargs):
+        # The first write fails, the second one is made but its response
+        # is lost, like a timeout after DynamoDB applied it.
+        if kwargs['Key']['Unique_ID'] == headhunter and len(failures) < 2:
+            failures.append(kwargs['ExpressionAttributeValues'][':t'])
+            if len(failures) == 2:
+                update_item(**kwargs)
+            raise BackendError('ValidationException', 'Lost.', 'UpdateItem')
+        return update_item(**kwargs)
+
+    table.update_item = flaky_update_item
+    buffer = QuantityBuffer(db, max_workers=2)
+    buffer.add(deltas('Headhunter', 'Mageblood'))
+    assert buffer.flush()['failed'] == [headhunter]
+    buffer.add(deltas('Headhunter'))
+    # The older batch is sent again and its write is applied but lost, so
+    # the newer batch has to hold its Headhunter delta back.
+    summary = buffer.flush()
+    assert summary['failed'] == [headhunter]
+    assert failures[0] == failures[1]
+    assert quantity(db, 'Headhunter') == 1
+    summary = buffer.flush()
+    assert summary['failed'] == [] and summary['skipped'] == 1
+    assert not buffer.batches
+    assert quantity(db, 'Headhunter') == 2
+    assert quantity(db, 'Mageblood') == 1
+    assert table.get_item(Key={'Unique_ID': headhunter})['Item'][
+        WRITE_TOKEN_KEY] != failures[0]
+
+
+def test_add_does_not_wait_for_a_flush(make_db):
+    db = make_db()
+    table = db.table
+    update_item = table.update_item
+    writing = threading.Event()
+    release = threading.Event()
+
+    def slow_update_item(**kwargs):
+        writing.set()
+        release.wait(5)
+        return update_item(**kwargs)
+
+    table.update_item = slow_update_item
+    buffer = QuantityBuffer(db, max_workers=1)
+    buffer.add(deltas('Mageblood'))
+    flusher = threading.Thread(target=buffer.flush)
+    flusher.start()
+    assert writing.wait(5)
+    done = threading.Event()
+    adder = threading.Thread(
+        target=lambda: (buffer.add(deltas('Headhunter')), done.set()))
+    adder.start()
+    assert done.wait(1)
+    release.set()
+    flusher.join()
+    adder.join()
+    table.update_item = update_item
+    buffer.flush()
+    assert quantity(db, 'Mageblood') == 1
+    assert quantity(db, 'Headhunter') == 1
+
+
+def test_pending_quantities_stay_counts(make_db):
+    db = make_db()
+    batches = []
+    buffer = QuantityBuffer(db, journal=batches.append)
+    counts = StashCounts()
+    counts.add('Mageblood', 80, 2)
+    buffer.add(counts)
+    buffer.add(deltas('Mageblood', 'Headhunter'))
+    assert isinstance(buffer.pending, StashCounts)
+    assert buffer.pending.to_dict() == {
+        create_unique_ilvl_str(80, 'Mageblood'): {
+            "item": 'Mageblood', "ilvl": 80, "quantity": 3},
+        create_unique_ilvl_str(80, 'Headhunter'): {
+            "item": 'Headhunter', "ilvl": 80, "quantity": 1}
+    }
+    buffer.flush()
+    # The journal gets plain ints it can save, and restore() takes them.
+    token, items = batches[0][0]
+    assert items[create_unique_ilvl_str(80, 'Mageblood')]['quantity'] == 3
+    assert type(items[create_unique_ilvl_str(80, 'Mageblood')][
+        'quantity']) is int
+    assert batches[-1] == []
+    assert quantity(db, 'Mageblood') == 3
+
+
+def test_ilvl_out_of_range():
+    counts = StashCounts()
+    counts.add('Mageblood', MAX_ILVL)
+    for ilvl in (MAX_ILVL + 1, -1):
+        with pytest.raises(ValueError):
+            counts.add('Mageblood', ilvl)
+    # Nothing was stored for the rejected ilvls.
+    assert len(counts) == 1
+    again = pickle.loads(pickle.dumps(counts))
+    again.add('Headhunter', 80)
+    assert again.to_dict() == dict(counts.to_dict(), **deltas('Headhunter'))
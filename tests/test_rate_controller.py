@@ -0,0 +1,68 @@
+import pytest
+
+import AWS_Classes
+from AWS_Classes import RateController, create_unique_ilvl_str
+from Local_Backends import BackendError
+
+
+def test_cuts_and_adds_back_up_to_the_target():
+    controller = RateController(write_capacity=100.0, cooldown=0)
+    controller.throttled('write')
+    assert controller.rates()['write'] == pytest.approx(70.0)
+    controller.throttled('write')
+    assert controller.rates()['write'] == pytest.approx(49.0)
+    # A tenth of the rate before the last cut is added back per second.
+    controller.record('write', 1.0, 49.0)
+    assert controller.rates()['write'] == pytest.approx(56.0)
+    for _ in range(100):
+        controller.record('write', 1.0, 10.0)
+    assert controller.rates()['write'] == 100.0
+    assert controller.rates()['read'] is None
+
+
+def test_throttles_within_the_cooldown_count_once():
+    controller = RateController(read_capacity=100.0, cooldown=60.0)
+    for _ in range(5):
+        controller.throttled('read')
+    assert controller.rates()['read'] == pytest.approx(70.0)
+
+
+def test_without_a_target_it_starts_from_the_observed_rate():
+    controller = RateController(cooldown=0)
+    # Nothing has gone through yet, so there is no rate to start from.
+    controller.throttled('write')
+    assert controller.rates()['write'] is None
+    controller.record('write', 1.0, 40.0)
+    assert controller.rates()['write'] is None
+    controller.throttled('write')
+    assert controller.rates()['write'] == pytest.approx(28.0)
+
+    slow = RateController(min_rate=5.0)
+    slow.record('read', 1.0, 2.0)
+    slow.throttled('read')
+    assert slow.rates()['read'] == 5.0
+
+
+def test_throttled_requests_are_retried(make_db, monkeypatch):
+    monkeypatch.setattr(AWS_Classes, '_backoff', lambda retries: None)
+    controller = RateController(min_rate=50.0, cooldown=0)
+    db = make_db(rate_controller=controller)
+    db.update_table({create_unique_ilvl_str(80, 'Mageblood'): {
+        "item": 'Mageblood', "ilvl": 80, "quantity": 2}})
+    get_item = db.table.get_item
+    calls = []
+
+    def busy_get_item(**kwargs):
+        calls.append(kwargs['Key'])
+        if len(calls) <= 2:
+            raise BackendError('ProvisionedThroughputExceededException',
+                               'Slow down.', 'GetItem')
+        return get_item(**kwargs)
+
+    db.table.get_item = busy_get_item
+    assert db.get_item('Mageblood', 80)['quantity'] == 2
+    assert len(calls) == 3
+    # The read of update_table() is the rate the cuts start from, they
+    # stop at min_rate and the read that went through adds 0.5 back.
+    assert controller.rates()['read'] == pytest.approx(50.5)
+    assert controller.rates()['write'] is None
@@ -0,0 +1,45 @@
+import AWS_Classes
+from AWS_Classes import DynamoDB, create_item_table, create_unique_ilvl_str
+from Local_Backends import MemoryResource
+
+
+def test_worker_threads_reuse_resources(monkeypatch):
+    backend = MemoryResource()
+    create_item_table('PoE_items', resource=backend)
+    made = []
+
+    class CountedResource():
+        """ Stands in for a boto3 resource, counting how many are made. """
+
+        def __init__(self):
+            made.append(self)
+
+        def Table(self, name):
+            return backend.Table(name)
+
+        def batch_write_item(self, **kwargs):
+            return backend.batch_write_item(**kwargs)
+
+        def batch_get_item(self, **kwargs):
+            return backend.batch_get_item(**kwargs)
+
+    monkeypatch.setattr(AWS_Classes, '_new_resource',
+                        lambda region_name, options: CountedResource())
+    monkeypatch.setattr(AWS_Classes, '_resources', {})
+    monkeypatch.setattr(AWS_Classes, '_idle_resources', {})
+    db = DynamoDB('PoE_items')
+    unique_items = {
+        create_unique_ilvl_str(80, 'Item {}'.format(number)): {
+            "item": 'Item {}'.format(number),
+            "ilvl": 80,
+            "quantity": 1
+        } for number in range(200)
+    }
+    for _ in range(5):
+        db.bulk_update_table(unique_items, max_workers=8)
+    for _ in range(2):
+        assert len(list(db.scan_items(total_segments=4))) == 200
+    pairs = [('Item {}'.format(number), 80) for number in range(450)]
+    assert db.get_items(pairs, max_workers=5)[0]['quantity'] == 5
+    # The shared resource plus at most one per worker running at once.
+    assert len(made) <= 1 + 8
@@ -0,0 +1,96 @@
+import pytest
+
+from AWS_Classes import (
+    DynamoDB,
+    RANKED_KEY,
+    SHARD_KEY,
+    create_item_table,
+    create_unique_ilvl_str,
+    shard_of
+)
+
+LAYOUTS = [{}, {'shards': 4}, {'shards': 4, 'top_index': True}]
+
+PAGE = {"stashes": [{"items": [
+    {"name": "Mageblood", "ilvl": 86},
+    {"name": "Headhunter", "ilvl": 84},
+    {"name": "Tabula Rasa", "ilvl": 70}
+]}]}
+
+
+def deltas(*rows):
+    return {create_unique_ilvl_str(ilvl, name): {
+        "item": name, "ilvl": ilvl, "quantity": quantity}
+        for name, ilvl, quantity in rows}
+
+
+@pytest.mark.parametrize('options', LAYOUTS)
+def test_empty_table_and_nothing_in_stock(make_db, options):
+    db = make_db(**options)
+    assert 'message' in db.find_top_quantity(5)
+    db.upload_stash(PAGE)
+    assert db.find_top_quantity(5) == []
+    assert db.find_top_page()['items'] == []
+
+
+@pytest.mark.parametrize('options', LAYOUTS)
+def test_nothing_in_stock_after_an_epoch_reset(make_db, options):
+    db = make_db(epochs=True, **options)
+    db.update_table(deltas(('Mageblood', 86, 2)))
+    db.reset_table()
+    assert db.find_top_quantity(5) == []
+
+
+@pytest.mark.parametrize('options', LAYOUTS)
+def test_layouts_agree(make_db, options):
+    db = make_db(epochs=True, **options)
+    rows = [('Item {}'.format(number), 40 + number, number % 3)
+            for number in range(40)]
+    db.update_table(deltas(*rows), bulk=True)
+    db.update_table(deltas(('Item 39', 79, 2)))
+    top = db.find_top_quantity(12)
+    # The cut off is the first of 12 rows or a total quantity of 12.
+    assert [row['item'] for row in top] == [
+        'Item 39', 'Item 38', 'Item 37', 'Item 35', 'Item 34', 'Item 32',
+        'Item 31', 'Item 29']
+    assert top[0]['quantity'] == 2
+
+    seen = []
+    cursor = None
+    while True:
+        page = db.find_top_page(cursor, page_size=5)
+        seen.extend(row['item'] for row in page['items'])
+        cursor = page['cursor']
+        if cursor is None:
+            break
+    assert seen == ['Item {}'.format(number) for number in range(39, 0, -1)
+                    if number % 3 or number == 39]
+
+
+def test_shards_spread_the_rows(make_db):
+    db = make_db(shards=4, top_index=True)
+    db.update_table(deltas(*[('Item {}'.format(number), 80, number % 2)
+                             for number in range(20)]))
+    rows = list(db.table.scan()['Items'])
+    assert {row[SHARD_KEY] for row in rows} == {0, 1, 2, 3}
+    for row in rows:
+        assert row[SHARD_KEY] == shard_of(row['Unique_ID'], 4)
+        # Every row in stock is in the sparse Top_items index.
+        if row['quantity'] > 0:
+            assert RANKED_KEY in row
+
+
+def test_migrate_table(make_db):
+    old = make_db(epochs=True)
+    old.update_table(deltas(('Mageblood', 86, 2), ('Goldrim', 84, 1)))
+    old.reset_table()
+    old.update_table(deltas(('Headhunter', 84, 3)))
+    create_item_table('PoE_items_v2', shards=4, top_index=True,
+                      resource=old.dynamodb)
+    new = DynamoDB('PoE_items_v2', shards=4, top_index=True,
+                   resource=old.dynamodb)
+    assert old.migrate_table(new) == 3
+    assert new.get_item('Mageblood', 86)['quantity'] == 0
+    assert new.get_item('Headhunter', 84)['quantity'] == 3
+    assert new.find_top_quantity(5) == [
+        {'item': 'Headhunter', 'ilvl': 84, 'quantity': 3}]
@@ -0,0 +1,47 @@
+from AWS_Classes import DynamoDB, StashCounts, create_unique_ilvl_str
+from Local_Backends import MemoryResource
+from PoE_Snapshot import Snapshot, write_snapshot
+
+
+def test_snapshot_round_trip(tmp_path):
+    counts = StashCounts()
+    counts.add('Tabula Rasa', 70, 5)
+    counts.add('Mageblood', 86, 2)
+    counts.add('Goldrim', 84, 0)
+    path = str(tmp_path / 'items.snap')
+    write_snapshot(path, counts, table='PoE_items')
+    with Snapshot(path) as snapshot:
+        assert [row['item'] for row in snapshot.rows()] == [
+            'Mageblood', 'Goldrim', 'Tabula Rasa']
+        assert snapshot.top_items(3) == [
+            {'item': 'Mageblood', 'ilvl': 86, 'quantity': 2},
+            {'item': 'Tabula Rasa', 'ilvl': 70, 'quantity': 5}
+        ]
+
+
+def test_replace_top_items_never_empties_the_table():
+    top_db = DynamoDB('PoE_top_items', resource=MemoryResource())
+    top_db.upload_top_items([
+        {'item': 'Mageblood', 'ilvl': 86, 'quantity': 2},
+        {'item': 'Goldrim', 'ilvl': 84, 'quantity': 1}
+    ])
+    sizes = []
+    batch_write = top_db._batch_write
+
+    def counting_batch_write(requests, *args, **kwargs):
+        result = batch_write(requests, *args, **kwargs)
+        sizes.append(top_db.table.item_count)
+        return result
+
+    top_db._batch_write = counting_batch_write
+    summary = top_db.replace_top_items([
+        {'item': 'Mageblood', 'ilvl': 86, 'quantity': 3},
+        {'item': 'Tabula Rasa', 'ilvl': 70, 'quantity': 5}
+    ])
+    assert summary == {'put': 2, 'deleted': 1}
+    assert sizes and min(sizes) > 0
+    rows = {row['Unique_ID']: row['quantity'] for row in top_db.scan_items()}
+    assert rows == {
+        create_unique_ilvl_str(86, 'Mageblood'): 3,
+        create_unique_ilvl_str(70, 'Tabula Rasa'): 5
+    }
@@ -0,0 +1,152 @@
+import gzip
+import json
+import threading
+import time
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import AWS_Classes
+from AWS_Classes import StashClient, StashStream, stash_client
+
+PAGE = json.dumps({
+    "next_change_id": "2",
+    "stashes": [{"items": [{"name": "Mageblood", "ilvl": 86}]}]
+}).encode('utf-8')
+
+
+class StashHandler(BaseHTTPRequestHandler):
+    """ Answers from the server's script: a list of (status, headers) to
+    send before the page itself. """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            status, headers = (server.script.pop(0) if server.script
+                               else (200, {}))
+        body = PAGE if status == 200 else b'{"error": "busy"}'
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and status == 200:
+            body = gzip.compress(body)
+            headers = dict(headers, **{'Content-Encoding': 'gzip'})
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StashHandler)
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.script = []
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,),
+                              daemon=True)
+    thread.start()
+    httpd.url = 'http://127.0.0.1:{}/api?id='.format(httpd.server_port)
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_gzip_and_keep_alive(server):
+    client = StashClient()
+    assert client.get(server.url + '1') == PAGE
+    assert client.get(server.url + '2') == PAGE
+    with client.open(server.url + '3') as response:
+        page = StashStream(response)
+        assert list(page.items()) == [('Mageblood', 86)]
+        assert page.next_change_id == '2'
+    stats = client.stats()
+    assert stats['requests'] == 3 and stats['connections'] == 1
+    client.close()
+
+
+def test_retry_after(server):
+    server.script = [(429, {'Retry-After': '0'}),
+                     (503, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})]
+    client = StashClient()
+    assert client.get(server.url + '1') == PAGE
+    assert client.stats()['retries'] == 2
+    assert len(server.requests) == 3
+
+
+def test_bad_retry_after_falls_back_to_backoff(server):
+    server.script = [(503, {'Retry-After': 'soon'})]
+    client = StashClient()
+    assert client.get(server.url + '1') == PAGE
+    assert client.stats()['retries'] == 1
+
+
+def test_errors_are_raised(server):
+    server.script = [(404, {})]
+    client = StashClient()
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client.get(server.url + '1')
+    assert error.value.code == 404
+    server.script = [(500, {'Retry-After': '0'})] * 3
+    client = StashClient(max_retries=2)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client.get(server.url + '1')
+    assert error.value.code == 500 and len(server.requests) == 4
+
+
+def test_rate_limit_headers_space_requests(server):
+    client = StashClient(headroom=0.5)
+    client._pace({
+        'X-Rate-Limit-Rules': 'Ip',
+        'X-Rate-Limit-Ip': '10:5:60',
+        'X-Rate-Limit-Ip-State': '6:5:0'
+    })
+    assert client.next_request > 0
+    client.next_request = 0.0
+    client._pace({
+        'X-Rate-Limit-Rules': 'Ip',
+        'X-Rate-Limit-Ip': '10:5:60',
+        'X-Rate-Limit-Ip-State': '1:5:0'
+    })
+    assert client.next_request == 0.0
+
+
+@pytest.mark.parametrize('value', ['inf', '1e9', 'Fri, 01 Jan 9999 00:00:00 GMT'])
+def test_waits_are_capped(value):
+    client = StashClient(max_wait=2.0)
+    assert client._retry_after({'Retry-After': value}, 0) == 2.0
+    assert client._retry_after({'Retry-After': 'nan'}, 0) == 0.0
+    assert client._retry_after({}, 30) <= 2.0
+    client._pace({
+        'X-Rate-Limit-Rules': 'Ip',
+        'X-Rate-Limit-Ip': '10:5:60',
+        'X-Rate-Limit-Ip-State': '10:5:1e9'
+    })
+    assert client.next_request <= time.monotonic() + 2.0
+
+
+def test_one_shared_client(monkeypatch):
+    made = []
+
+    class SlowClient():
+        def __init__(self):
+            time.sleep(0.05)
+            made.append(self)
+
+    monkeypatch.setattr(AWS_Classes, 'StashClient', SlowClient)
+    monkeypatch.setattr(AWS_Classes, '_stash_client', None)
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(stash_client()))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(made) == 1
+    assert clients == made * 8
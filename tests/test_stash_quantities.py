@@ -0,0 +1,67 @@
+import decimal
+import io
+import json
+
+from AWS_Classes import (
+    StashCounts,
+    get_stash_quantities,
+    get_stash_quantities_stream
+)
+
+
+PAGE = {
+    "next_change_id": "2",
+    "stashes": [
+        {"items": [
+            {"name": "Mageblood", "ilvl": 86},
+            {"name": "", "ilvl": 86},
+            {"name": "Headhunter", "ilvl": 84},
+            {"name": "Mageblood", "ilvl": 86}
+        ]},
+        {"items": []},
+        {"items": [
+            {"name": "Mageblood", "ilvl": 70},
+            {"name": "Goldrim", "ilvl": ""},
+            {"name": "Headhunter", "ilvl": 84}
+        ]}
+    ]
+}
+
+
+def test_page_and_stream_count_the_same():
+    unique_items = get_stash_quantities(PAGE)
+    streamed, next_id, items = get_stash_quantities_stream(
+        io.BytesIO(json.dumps(PAGE).encode('utf-8')))
+    assert next_id == "2"
+    assert items == 7
+    assert list(streamed) == list(unique_items)
+    assert streamed == unique_items
+    assert len(unique_items) == 3
+    for entry in unique_items.values():
+        assert isinstance(entry['quantity'], decimal.Decimal)
+    totals = {(entry['item'], entry['ilvl']): entry['quantity']
+              for entry in unique_items.values()}
+    assert totals == {("Mageblood", 86): 2, ("Headhunter", 84): 2,
+                      ("Mageblood", 70): 1}
+
+
+def test_stash_counts_agree_with_the_dict():
+    counts = StashCounts()
+    assert counts.add_page(PAGE) == 7
+    next_id, items = counts.add_stream(
+        io.BytesIO(json.dumps(PAGE).encode('utf-8')))
+    assert (next_id, items) == ("2", 7)
+    assert counts.seen == 14
+    doubled = {unique: dict(entry, quantity=entry['quantity'] * 2)
+               for unique, entry in get_stash_quantities(PAGE).items()}
+    assert counts.to_dict() == doubled
+
+
+def test_verbose_prints_progress(capsys):
+    page = {"stashes": [{"items": [{"name": "Goldrim", "ilvl": 1}] * 200}]}
+    get_stash_quantities(page, verbose=True)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == [
+        "1 have been added to Unique_items of 100 total items.",
+        "1 have been added to Unique_items of 200 total items."
+    ]
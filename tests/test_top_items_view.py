@@ -0,0 +1,64 @@
+from AWS_Classes import DynamoDB, create_unique_ilvl_str
+
+
+def deltas(ilvl, names):
+    return {create_unique_ilvl_str(ilvl, name): {
+        "item": name, "ilvl": ilvl, "quantity": 1} for name in names}
+
+
+def top_names(top_db):
+    return sorted(row['item'] for row in top_db.scan_items())
+
+
+def watch_top_table(top_db):
+    # Records how many rows the top table holds after every batch write.
+    sizes = []
+    batch_write_item = top_db.dynamodb.batch_write_item
+
+    def counting_batch_write_item(**kwargs):
+        response = batch_write_item(**kwargs)
+        sizes.append(len(list(top_db.scan_items())))
+        return response
+
+    top_db.dynamodb.batch_write_item = counting_batch_write_item
+    return sizes
+
+
+def test_refresh_never_empties_the_top_table(make_db):
+    db = make_db()
+    top_db = DynamoDB('PoE_top_items', resource=db.dynamodb)
+    old = ['Old {:02d}'.format(number) for number in range(25)]
+    new = ['New {:02d}'.format(number) for number in range(25)]
+    db.update_table(deltas(70, old), bulk=True)
+    view = db.track_top_items(25)
+    assert view.sync(db, top_db) == {"put": 25, "deleted": 0}
+    assert top_names(top_db) == old
+
+    # Every new row has a higher ilvl, so the whole top 25 is replaced,
+    # one batch of puts and then one of deletes.
+    sizes = watch_top_table(top_db)
+    db.update_table(deltas(80, new), bulk=True)
+    assert view.sync(db, top_db) == {"put": 25, "deleted": 25}
+    assert sizes == [50, 25]
+    assert top_names(top_db) == new
+
+
+def test_rows_that_drop_out_are_deleted(make_db):
+    db = make_db()
+    top_db = DynamoDB('PoE_top_items', resource=db.dynamodb)
+    db.update_table(deltas(80, ['Mageblood', 'Headhunter', 'Goldrim']))
+    view = db.track_top_items(2)
+    view.sync(db, top_db)
+    assert top_names(top_db) == ['Goldrim', 'Headhunter']
+
+    # A row that is sold out leaves the view, and the next row in the
+    # table takes its place.
+    db.put_item('Goldrim', 80, 0)
+    assert view.sync(db, top_db) == {"put": 1, "deleted": 1}
+    assert top_names(top_db) == ['Headhunter', 'Mageblood']
+
+    # A higher ilvl pushes the last row out of the top 2.
+    db.update_table(deltas(86, ['Kaom']))
+    assert view.sync(db, top_db) == {"put": 1, "deleted": 1}
+    assert top_names(top_db) == ['Headhunter', 'Kaom']
+    assert view.sync(db, top_db) == {"put": 0, "deleted": 0}
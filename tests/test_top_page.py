@@ -0,0 +1,101 @@
+import decimal
+import json
+
+import pytest
+
+from AWS_Classes import (
+    DecimalEncoder,
+    create_unique_ilvl_str,
+    encode_cursor,
+    encode_top_page
+)
+
+
+ITEMS = [
+    {"item": "Mageblood", "ilvl": 86, "quantity": 2},
+    {"item": "Headhunter", "ilvl": 84, "quantity": 1},
+    {"item": "Goldrim", "ilvl": 84, "quantity": 0},
+    {"item": "Tabula Rasa", "ilvl": 70, "quantity": 5},
+    {"item": "Wanderlust", "ilvl": 1, "quantity": 3}
+]
+
+LAYOUTS = [{}, {'shards': 3}, {'shards': 3, 'top_index': True}]
+
+
+@pytest.fixture
+def make_db(make_db):
+    # Every table here starts with ITEMS in it.
+    def make(**options):
+        db = make_db(**options)
+        db.update_table({
+            create_unique_ilvl_str(row['ilvl'], row['item']): dict(row)
+            for row in ITEMS
+        })
+        return db
+    return make
+
+
+@pytest.mark.parametrize('options', LAYOUTS)
+def test_pages_walk_the_stocked_rows(options, make_db):
+    db = make_db(**options)
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        page = db.find_top_page(cursor, page_size=2)
+        pages += 1
+        seen.extend(row['item'] for row in page['items'])
+        cursor = page['cursor']
+        if cursor is None:
+            break
+    assert seen == ['Mageblood', 'Headhunter', 'Tabula Rasa', 'Wanderlust']
+    assert pages == 2
+    assert db.find_top_page(page_size='3')['items'][2]['item'] == \
+        'Tabula Rasa'
+
+
+@pytest.mark.parametrize('page_size', ['ten', None, '2.5'])
+def test_bad_page_size(page_size, make_db):
+    db = make_db()
+    page = db.find_top_page(page_size=page_size)
+    assert page['statusCode'] == 400
+    assert 'items' not in page
+    body = json.loads(db.find_top_page_body(page_size=page_size))
+    assert body['statusCode'] == 400
+
+
+def test_bad_cursor(make_db):
+    db = make_db()
+    assert db.find_top_page('not a cursor!')['statusCode'] == 400
+    after = encode_cursor(create_unique_ilvl_str(84, 'Headhunter'))
+    assert [row['item'] for row in db.find_top_page(after)['items']] == [
+        'Tabula Rasa', 'Wanderlust']
+
+
+def test_page_size_strings_share_the_cache(make_db):
+    db = make_db(page_cache_size=8)
+    calls = []
+    find_top_page = db.find_top_page
+
+    def counting_find_top_page(*args):
+        calls.append(args)
+        return find_top_page(*args)
+
+    db.find_top_page = counting_find_top_page
+    assert db.find_top_page_body(page_size='2') == \
+        db.find_top_page_body(page_size=2)
+    assert len(calls) == 1
+
+
+def test_encoded_page_matches_decimal_encoder():
+    page = {
+        "items": [
+            {"item": "Mageblood", "ilvl": decimal.Decimal(86),
+             "quantity": decimal.Decimal('2.5')},
+            {"item": "Goldrim", "ilvl": "80", "quantity": 3}
+        ],
+        "cursor": None
+    }
+    assert json.loads(encode_top_page(page)) == \
+        json.loads(json.dumps(page, cls=DecimalEncoder))
+    assert b'"80"' in encode_top_page(page)
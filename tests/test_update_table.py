@@ -0,0 +1,35 @@
+from AWS_Classes import (
+    get_stash_quantities,
+    take_top_items
+)
+
+
+PAGE = {
+    "stashes": [{"items": [
+        {"name": "Kaom's Heart", "ilvl": 84},
+        {"name": "Kaom's Heart", "ilvl": 84},
+        {"name": "Tabula Rasa", "ilvl": 70}
+    ]}]
+}
+
+
+def test_new_rows_get_item_and_ilvl(make_db):
+    for options in ({}, {'epochs': True}, {'shards': 4}):
+        db = make_db(verbose=True, **options)
+        db.update_table(get_stash_quantities(PAGE))
+        db.update_table(get_stash_quantities(PAGE))
+        assert db.get_item("Kaom's Heart", 84)['quantity'] == 4
+        assert db.get_item('Tabula Rasa', 70)['item'] == 'Tabula Rasa'
+        assert db.find_top_quantity(10) == [
+            {'item': "Kaom's Heart", 'ilvl': 84, 'quantity': 4},
+            {'item': 'Tabula Rasa', 'ilvl': 70, 'quantity': 2}
+        ]
+
+
+def test_bulk_and_single_writes_agree(make_db):
+    single = make_db()
+    bulk = make_db()
+    single.update_table(get_stash_quantities(PAGE))
+    bulk.update_table(get_stash_quantities(PAGE), bulk=True)
+    assert take_top_items(single.top_rows(5), 5) == \
+        take_top_items(bulk.top_rows(5), 5)
@@ -0,0 +1,78 @@
+from AWS_Classes import DynamoDB, SeenKeys, create_unique_ilvl_str
+
+
+PAGE = {"stashes": [{"items": [
+    {"name": "Mageblood", "ilvl": 86},
+    {"name": "Headhunter", "ilvl": 84},
+    {"name": "Mageblood", "ilvl": 86},
+    {"name": "Tabula Rasa", "ilvl": 70}
+]}]}
+
+
+def count_puts(db):
+    puts = []
+    put_item = db.table.put_item
+
+    def counting_put_item(**kwargs):
+        puts.append(kwargs['Item']['Unique_ID'])
+        return put_item(**kwargs)
+
+    db.table.put_item = counting_put_item
+    return puts
+
+
+def test_existing_rows_keep_their_quantity(make_db):
+    db = make_db()
+    db.update_table({create_unique_ilvl_str(86, 'Mageblood'): {
+        "item": 'Mageblood', "ilvl": 86, "quantity": 5}})
+    # A new object has not seen any keys, so the put has to find the row.
+    uploader = DynamoDB('PoE_items', resource=db.dynamodb)
+    summary = uploader.upload_stash(PAGE)
+    assert summary == {"items": 4, "inserted": 2, "existing": 1,
+                       "failed": []}
+    assert db.get_item('Mageblood', 86)['quantity'] == 5
+    assert db.get_item('Headhunter', 84)['quantity'] == 0
+    assert db.get_item('Tabula Rasa', 70)['quantity'] == 0
+
+
+def test_seen_keys_skip_the_request(make_db):
+    db = make_db()
+    puts = count_puts(db)
+    db.upload_stash(PAGE)
+    assert len(puts) == 3
+    summary = db.upload_stash(PAGE)
+    assert summary['inserted'] == summary['existing'] == 0
+    assert len(puts) == 3
+
+    # With room for one key only the last one is skipped, and the others
+    # are put again without touching their rows.
+    small = make_db(seen_size=1)
+    small.update_table({create_unique_ilvl_str(84, 'Headhunter'): {
+        "item": 'Headhunter', "ilvl": 84, "quantity": 2}})
+    small_puts = count_puts(small)
+    small.upload_stash(PAGE)
+    small.upload_stash(PAGE)
+    assert len(small_puts) == 3 + 2
+    assert small.get_item('Headhunter', 84)['quantity'] == 2
+
+
+def test_seen_keys_forget_the_least_recently_seen():
+    seen = SeenKeys(2)
+    seen.add('a')
+    seen.add('b')
+    assert 'a' in seen
+    seen.add('c')
+    assert 'b' not in seen
+    assert 'a' in seen and 'c' in seen
+    assert len(seen) == 2
+    seen.add('c')
+    seen.add('d')
+    assert list(seen.keys) == ['c', 'd']
+    seen.discard('c')
+    assert 'c' not in seen
+    seen.clear()
+    assert len(seen) == 0
+
+    nothing = SeenKeys(0)
+    nothing.add('a')
+    assert 'a' not in nothing